@@ -0,0 +1,196 @@
+"""Partner accounts served by one process.
+
+Without PARTNER_ACCOUNTS_FILE the process serves a single account, "default",
+set up from PARTNER_CP_KEY, PARTNER_TOKEN_URL and PARTNER_API_BASE_URL as
+before. With it, the file is a JSON object of account name -> settings:
+
+    {
+      "acme": {"cp_key_env": "ACME_CP_KEY",
+               "api_base_url": "https://partner.flexilis.com",
+               "token_url": "https://partner.flexilis.com/oauth2/token"},
+      "globex": {"cp_key": "...", "pool_size": 4}
+    }
+
+The key is given inline (cp_key) or read from another variable (cp_key_env).
+Everything else falls back to the environment-wide settings.
+
+Each account has its own token cache, connection pool, response cache,
+membership index, snapshot store, dashboard and event streams. They are
+built when a request first uses the account, so configured but idle
+accounts cost nothing. A request picks its account with the /accounts/<name>
+path prefix (stripped before routing, so every route works under it) or the
+X-Partner-Account header. Without either it gets PARTNER_DEFAULT_ACCOUNT, or
+the first account in the file.
+
+The account a request or background task works for is kept in a context
+variable. Code that hands work to another thread wraps it in bind() so the
+work runs for the same account.
+"""
+import contextvars
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+PARTNER_ACCOUNTS_FILE = os.environ.get("PARTNER_ACCOUNTS_FILE")
+PARTNER_DEFAULT_ACCOUNT = os.environ.get("PARTNER_DEFAULT_ACCOUNT")
+
+ACCOUNT_HEADER = "X-Partner-Account"
+ACCOUNT_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+ACCOUNT_PREFIX = re.compile(r"^/accounts/([^/]+)(/.*)?$")
+
+_current = contextvars.ContextVar("partner_account", default=None)
+
+
+class UnknownAccount(KeyError):
+    pass
+
+
+class Account:
+    """One partner account's clients, caches and dashboard state."""
+
+    def __init__(self, name, partner_api, token_manager, response_cache, membership_index, snapshot_store,
+                 dashboard_state, tenant_search, event_hub, dashboard_poller=None):
+        self.name = name
+        self.partner_api = partner_api
+        self.token_manager = token_manager
+        self.response_cache = response_cache
+        self.membership_index = membership_index
+        self.snapshot_store = snapshot_store
+        self.dashboard_state = dashboard_state
+        self.tenant_search = tenant_search
+        self.event_hub = event_hub
+        self.dashboard_poller = dashboard_poller
+
+
+def load_account_configs(path=PARTNER_ACCOUNTS_FILE):
+    # name -> settings, in file order; {"default": {}} without a file
+    if not path:
+        return {"default": {}}
+    with open(path) as f:
+        configs = json.load(f)
+    if not isinstance(configs, dict) or not configs:
+        raise ValueError(f"{path} must be a JSON object of account name -> settings")
+    for name, config in configs.items():
+        if not ACCOUNT_NAME.match(name):
+            raise ValueError(f"Invalid account name {name!r} in {path}")
+        if not isinstance(config, dict):
+            raise ValueError(f"Settings for account {name} in {path} must be an object")
+        if config.get("cp_key_env"):
+            config["cp_key"] = os.environ.get(config["cp_key_env"])
+        if not config.get("cp_key"):
+            raise ValueError(f"No partner key for account {name} in {path}")
+    return configs
+
+
+def account_path(path, name, default_name):
+    # Per-account file next to the configured one, e.g. snapshot-acme.db;
+    # the default account keeps the configured path
+    if not path or path == ":memory:" or name == default_name:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{name}{ext}"
+
+
+class AccountRegistry:
+    def __init__(self, configs, factory, default=PARTNER_DEFAULT_ACCOUNT):
+        # factory(name, config) builds an account's objects on first use
+        self.configs = configs
+        self.factory = factory
+        self.default_name = default or next(iter(configs))
+        if self.default_name not in configs:
+            raise ValueError(f"Default account {self.default_name} is not configured")
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def names(self):
+        return list(self.configs)
+
+    def __contains__(self, name):
+        return name in self.configs
+
+    def get(self, name=None):
+        name = name or self.default_name
+        account = self._accounts.get(name)
+        if account is None:
+            if name not in self.configs:
+                raise UnknownAccount(name)
+            with self._lock:
+                account = self._accounts.get(name)
+                if account is None:
+                    account = self._accounts[name] = self.factory(name, self.configs[name])
+        return account
+
+    def peek(self, name=None):
+        # The account if it is already set up, else None; never builds it
+        return self._accounts.get(name or self.default_name)
+
+    def loaded(self):
+        return list(self._accounts.values())
+
+    def current(self):
+        # The account of the running request or task, or the default one
+        return _current.get() or self.get()
+
+    def resolve(self, path, header=None):
+        """Returns (name, path without the /accounts/<name> prefix, prefix).
+
+        name is None when neither the prefix nor the header names an account.
+        """
+        match = ACCOUNT_PREFIX.match(path)
+        if match:
+            return match.group(1), match.group(2) or "/", f"/accounts/{match.group(1)}"
+        return header or None, path, ""
+
+
+@contextmanager
+def use_account(account):
+    token = _current.set(account)
+    try:
+        yield account
+    finally:
+        _current.reset(token)
+
+
+def bind(fn):
+    # fn, run for the account that is current here, whichever thread calls it
+    account = _current.get()
+    if account is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        with use_account(account):
+            return fn(*args, **kwargs)
+    return bound
+
+
+class AccountMiddleware:
+    """WSGI middleware that selects the request's account.
+
+    The /accounts/<name> prefix moves to SCRIPT_NAME, so url_for() and the
+    page's API calls keep it. An unknown account is a 404.
+    """
+
+    def __init__(self, wsgi_app, registry):
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+        name, path, prefix = self.registry.resolve(environ.get("PATH_INFO", ""),
+                                                   environ.get("HTTP_X_PARTNER_ACCOUNT"))
+        try:
+            account = self.registry.get(name)
+        except UnknownAccount:
+            body = json.dumps({"error": f"Unknown partner account {name}"}).encode()
+            start_response("404 NOT FOUND", [("Content-Type", "application/json"),
+                                             ("Content-Length", str(len(body)))])
+            return [body]
+        if prefix:
+            environ["SCRIPT_NAME"] = environ.get("SCRIPT_NAME", "") + prefix
+            environ["PATH_INFO"] = path
+        # Set for the rest of this thread's request, including a streamed
+        # body; every request sets it again, so it never leaks into the next
+        _current.set(account)
+        return self.wsgi_app(environ, start_response)
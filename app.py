@@ -1,134 +1,554 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, g, render_template, request, redirect, stream_with_context, url_for, jsonify
+from werkzeug.local import LocalProxy
 import requests
+import csv
 import json
 import logging
+import itertools
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
 import time
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import metrics
+from accounts import Account, AccountMiddleware, AccountRegistry, account_path, bind, load_account_configs, use_account
+from dashboard import DashboardState
+from events import DashboardPoller, EventHub, event_stream, format_event
+from jobs import JobConflict, JobQueue
+from key_inventory import (ENTITY_TYPES, ExportState, StateLocked, csv_lines, export_keys, key_list, ndjson_lines,
+                           new_export_summary)
+from membership_index import MembershipIndex
+from payloads import (COMPRESS_MIN_BYTES, COMPRESS_RESPONSES, COMPRESSIBLE_TYPES, ENCODINGS, CachedJSON, compress, compress_stream,
+                      encode, parse_fields, project)
+from provisioning import Checkpoint, RowValidator, count_result, new_summary, submit_rows, validate
+from response_cache import CACHE_MAX_BYTES, CACHE_MAX_ENTRIES, ResponseCache
+from snapshot_store import SNAPSHOT_DB, SnapshotStore
+from tenant_search import SORT_KEYS, TenantSearch
+from token_manager import TOKEN_CACHE_FILE, FileTokenBackend, MemoryTokenBackend, TokenManager
+from upstream import UpstreamClient, iter_pages, request_not_sent
 
 app = Flask(__name__)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is set up by create_app() (or the first request), not at import
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Request/response body dumps are off by default; with LOG_PAYLOADS=1 (and
+# LOG_LEVEL=DEBUG) a LOG_PAYLOAD_SAMPLE_RATE fraction of them is logged
+LOG_PAYLOADS = os.environ.get("LOG_PAYLOADS", "0") == "1"
+LOG_PAYLOAD_SAMPLE_RATE = float(os.environ.get("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
 
-# OAuth 2.0 Configuration
-TOKEN_URL = "https://partner.preprod.flexilis.com/oauth2/token"
-PARTNER_CP_KEY = "Replace with your key"
+# OAuth 2.0 Configuration; with PARTNER_ACCOUNTS_FILE these (and
+# PARTNER_API_BASE_URL) are only the defaults for the accounts in the file
+TOKEN_URL = os.environ.get("PARTNER_TOKEN_URL", "https://partner.preprod.flexilis.com/oauth2/token")
+PARTNER_CP_KEY = os.environ.get("PARTNER_CP_KEY", "Replace with your key")
 
 # API Configuration
-API_BASE_URL = "https://partner.preprod.flexilis.com"
+API_BASE_URL = os.environ.get("PARTNER_API_BASE_URL", "https://partner.preprod.flexilis.com")
+
+# Required fields for /api/new_org and /api/new_order (managed orders also
+# need externalOrgId)
+NEW_ORG_REQUIRED_FIELDS = ("transactionId", "externalPartnerId", "seatTotal", "defaultOrganization",
+                           "commercialPartnerName", "contactEmail", "contactFirstName", "contactLastName", "name")
+NEW_ORDER_REQUIRED_FIELDS = ('transactionId', 'externalPartnerId', 'seatTotal', 'contactEmail',
+                             'contactFirstName', 'contactLastName', 'companyName')
+# The same rules for bulk provisioning rows
+provisioning_validator = RowValidator(NEW_ORG_REQUIRED_FIELDS, NEW_ORDER_REQUIRED_FIELDS)
+
+# Every partner account this process serves (see accounts.py) and the
+# clients, caches and dashboard state each one gets
+def create_account(name, config):
+    default_name = partner_accounts.default_name
+    client = UpstreamClient(config.get("api_base_url", API_BASE_URL), pool_size=config.get("pool_size"),
+                            account=name)
+    # The token cache is shared by every request for the account (and by
+    # every worker when TOKEN_CACHE_FILE is set)
+    token_cache_file = config.get("token_cache_file", account_path(TOKEN_CACHE_FILE, name, default_name))
+    account = Account(
+        name,
+        partner_api=client,
+        token_manager=TokenManager(
+            config.get("token_url", TOKEN_URL),
+            config.get("cp_key", PARTNER_CP_KEY),
+            client,
+            backend=FileTokenBackend(token_cache_file) if token_cache_file else MemoryTokenBackend(),
+            account=name
+        ),
+        response_cache=ResponseCache(config.get("cache_max_entries", CACHE_MAX_ENTRIES),
+                                     config.get("cache_max_bytes", CACHE_MAX_BYTES)),
+        membership_index=MembershipIndex(),
+        snapshot_store=SnapshotStore(config.get("snapshot_db", account_path(SNAPSHOT_DB, name, default_name))),
+        dashboard_state=DashboardState(),
+        tenant_search=TenantSearch(),
+        event_hub=EventHub()
+    )
+    with use_account(account):
+        account.dashboard_poller = DashboardPoller(bind(lambda: refresh_dashboard()), account.event_hub)
+        account.dashboard_state.add_listener(bind(lambda previous, snapshot: publish_dashboard_change(previous, snapshot)))
+        load_snapshot()
+    logging.info(f"Partner account {name} ready, API {client.base_url}")
+    return account
+
+partner_accounts = AccountRegistry(load_account_configs(), create_account)
+app.wsgi_app = AccountMiddleware(app.wsgi_app, partner_accounts)
 
-# Token storage
-token_data = {
-    "access_token": None,
-    "refresh_token": None,
-    "expires_at": None
+def current_account():
+    return partner_accounts.current()
+
+# The current request's (or background task's) account objects, so the code
+# below reads the same as with a single account
+partner_api = LocalProxy(lambda: current_account().partner_api)
+token_manager = LocalProxy(lambda: current_account().token_manager)
+
+# Cached read-only responses, TTL in seconds per endpoint
+response_cache = LocalProxy(lambda: current_account().response_cache)
+CACHE_TTLS = {
+    "orgs": int(os.environ.get("CACHE_TTL_ORGS", "30")),
+    "org": int(os.environ.get("CACHE_TTL_ORG", "60")),
+    "data_bundle": int(os.environ.get("CACHE_TTL_DATA_BUNDLE", "30")),
+    "keys": int(os.environ.get("CACHE_TTL_KEYS", "15"))
 }
 
+# Tenant -> org membership, kept warm in the background
+membership_index = LocalProxy(lambda: current_account().membership_index)
+
+# Last-known tenants, orgs, data bundles and membership; on disk when
+# SNAPSHOT_DB is set, so a restarted worker starts from them
+snapshot_store = LocalProxy(lambda: current_account().snapshot_store)
+
+# Org tenant fan-out: "concurrent" runs the per-org lookups on a bounded
+# thread pool, "serial" keeps the old one-after-another behaviour
+ORG_FANOUT_MODE = os.environ.get("ORG_FANOUT_MODE", "concurrent")
+ORG_FANOUT_MAX_WORKERS = int(os.environ.get("ORG_FANOUT_MAX_WORKERS", "16"))
+
+# Tenants are read page by page; with INDEX_STREAMING the dashboard is
+# sent to the browser as the pages arrive instead of after the last one
+TENANTS_PAGE_SIZE = int(os.environ.get("TENANTS_PAGE_SIZE", "100"))
+INDEX_STREAMING = os.environ.get("INDEX_STREAMING", "1") == "1"
+INDEX_STREAM_BUFFER = int(os.environ.get("INDEX_STREAM_BUFFER", "50"))
+
+# "client" serves the page shell and renders the tables in the browser from
+# /api/dashboard (polled every DASHBOARD_POLL_SECONDS, 0 to disable);
+# "server" renders the tenant rows into index.html as before
+DASHBOARD_RENDER = os.environ.get("DASHBOARD_RENDER", "client")
+DASHBOARD_POLL_SECONDS = int(os.environ.get("DASHBOARD_POLL_SECONDS", "30"))
+# Only the fields the dashboard shows go into /api/dashboard
+DASHBOARD_TENANT_FIELDS = ('name', 'guid', 'externalPartnerId', 'skus', 'billingDate', 'licenseUsage', 'state')
+DASHBOARD_ORG_FIELDS = ('externalOrgId', 'name', 'seats', 'defaultOrganization', 'state')
+dashboard_state = LocalProxy(lambda: current_account().dashboard_state)
+# /api/tenants/search runs over an index of the dashboard snapshot's tenants
+tenant_search = LocalProxy(lambda: current_account().tenant_search)
+TENANT_SEARCH_MAX_LIMIT = int(os.environ.get("TENANT_SEARCH_MAX_LIMIT", "1000"))
+
+# Live updates pushed to the page over /api/events (see events.py) instead
+# of reloading after writes or polling. With the sync server every open
+# stream holds a worker thread, so at most EVENTS_MAX_CLIENTS are served per
+# process; pages past that fall back to polling
+EVENTS_ENABLED = os.environ.get("EVENTS_ENABLED", "1") == "1"
+EVENTS_MAX_CLIENTS = int(os.environ.get("EVENTS_MAX_CLIENTS", "8"))
+event_hub = LocalProxy(lambda: current_account().event_hub)
+dashboard_poller = LocalProxy(lambda: current_account().dashboard_poller)
+
+# Batch routes run their items' upstream calls on a pool of at most
+# BATCH_MAX_WORKERS threads; larger batches are rejected
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "8"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+
+# Uploads to /api/provisioning are spooled to disk, never held in memory;
+# named checkpoints live in PROVISION_CHECKPOINT_DIR
+PROVISION_CHECKPOINT_DIR = os.environ.get("PROVISION_CHECKPOINT_DIR",
+                                          os.path.join(tempfile.gettempdir(), "provisioning"))
+PROVISION_SPOOL_CHUNK = 64 * 1024
+
+# Incremental key exports keep their state files (named per export) in
+# KEY_EXPORT_STATE_DIR
+KEY_EXPORT_STATE_DIR = os.environ.get("KEY_EXPORT_STATE_DIR", os.path.join(tempfile.gettempdir(), "key-exports"))
+
+# Order writes called with ?async=1 or Prefer: respond-async are queued as
+# jobs (see jobs.py) and answered with 202; the handlers make the same
+# upstream calls as the batch and provisioning routes. One queue and pool
+# serves every account, each job running for the account that queued it
+job_queue = JobQueue({
+    "modify": lambda data: run_job_call(order_batch_call("/api/partners/v1/orders/modify", data)),
+    "cancel": lambda data: run_job_call(order_batch_call("/api/partners/v1/orders/cancel", data)),
+    "new_org": lambda data: run_job_call(provisioning_call('org', data)),
+    "new_order": lambda data: run_job_call(provisioning_call('tenant', data))
+}, context=lambda name: use_account(partner_accounts.get(name)))
+
+def log_payload(message, payload):
+    # The f-string over a whole body is the expensive part, so it is only
+    # built for the sampled calls
+    if LOG_PAYLOADS and random.random() < LOG_PAYLOAD_SAMPLE_RATE and logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"{message}: {payload}")
+
 def get_access_token():
-    global token_data
-    current_time = datetime.now()
-    
-    if token_data["access_token"] and token_data["expires_at"] and current_time < token_data["expires_at"]:
-        return token_data["access_token"]
-    
-    if token_data["refresh_token"]:
-        return refresh_access_token()
-    
-    data = {
-        "grant_type": "client_credentials"
-    }
-    
-    headers = {
-        "Accept": "application/json",
-        "Authorization": f"Bearer {PARTNER_CP_KEY}"
-    }
-    
     try:
-        response = requests.post(TOKEN_URL, data=data, headers=headers)
-        response.raise_for_status()
-        new_token_data = response.json()
-        token_data["access_token"] = new_token_data.get("access_token")
-        token_data["refresh_token"] = new_token_data.get("refresh_token")
-        token_data["expires_at"] = current_time + timedelta(seconds=new_token_data.get("expires_in", 3600))
-        return token_data["access_token"]
+        return token_manager.get_token()
     except requests.exceptions.RequestException as e:
         logging.error(f"Error obtaining access token: {str(e)}")
         return None
 
-#This is for fetching the tenants
+def refresh_access_token():
+    try:
+        return token_manager.refresh(force=True)["access_token"]
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error refreshing access token: {str(e)}")
+        return None
 
-@app.route('/')
-def index():
-    access_token = get_access_token()
-    if not access_token:
-        return render_template('error.html', error_message="Failed to obtain access token")
-    
+def auth_headers(access_token=None, content_type=False):
+    # Headers for a partner API call, with a fresh token unless one is given
     headers = {
-        "Authorization": f"Bearer {access_token}",
+        "Authorization": f"Bearer {access_token or get_access_token()}",
         "Accept": "application/json"
     }
+    if content_type:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+# Read-through cache for the read-only partner endpoints, keyed by upstream
+# path; write routes invalidate what they touch
+def cached_get_entry(kind, path, headers):
+    # The upstream body as a CachedJSON, parsed only if .data is used
+    entry = response_cache.get(path)
+    if entry is not None:
+        return entry
     
+    generation = response_cache.generation
+    response = partner_api.get(path, headers=headers)
+    response.raise_for_status()
+    entry = CachedJSON(response.content)
+    if response.content:
+        response_cache.set(path, entry, CACHE_TTLS[kind], len(response.content), generation)
+        remember_response(kind, path, entry)
+    return entry
+
+def cached_get_json(kind, path, headers, default=None):
+    entry = cached_get_entry(kind, path, headers)
+    if default is not None and not entry.raw:
+        return default
+    return entry.data
+
+def remember_response(kind, path, entry):
+    # Fresh upstream orgs listings and tenant data bundles go to the snapshot store
+    if kind == "orgs":
+        snapshot_store.put_orgs(entry.data.get('orgs', []))
+    elif kind == "data_bundle":
+        # /api/partners/v1/tenants/<tenant_id>/data_bundle, stored as received
+        snapshot_store.put_data_bundle(path.split('/')[-2], entry.raw)
+
+# Proxy route bodies: the upstream bytes unchanged, or only the fields the
+# caller asked for with ?fields=a,b.c (see payloads.py)
+def proxy_json(entry):
+    fields = parse_fields(request.args.get('fields'))
+    if fields:
+        return Response(encode(project(entry.data, fields)), mimetype='application/json')
+    response = Response(entry.raw, mimetype='application/json')
+    encoding = request.accept_encodings.best_match(ENCODINGS) if COMPRESS_RESPONSES else None
+    if encoding and len(entry.raw) >= COMPRESS_MIN_BYTES:
+        # Compressed once per cache entry; compress_response leaves it alone
+        response.set_data(entry.encoded(encoding))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+def projected_json(data):
+    # For bodies the proxy builds itself
+    fields = parse_fields(request.args.get('fields'))
+    return Response(encode(project(data, fields) if fields else data), mimetype='application/json')
+
+def record_managed_order(order_data):
+    # After a managed tenant order succeeded: its org membership is known
+    # without waiting for the next index refresh
+    if order_data.get('managed') and order_data.get('externalOrgId'):
+        membership_index.patch(order_data['externalPartnerId'], order_data['externalOrgId'])
+        snapshot_store.put_membership(order_data['externalPartnerId'], order_data['externalOrgId'])
+
+def record_order(order_data):
+    # After any tenant order succeeded
+    record_managed_order(order_data)
+    publish_write("new_order", order_data)
+
+def invalidate_tenant_cache(order_data):
+    # order_data is the order payload sent upstream
+    tenant_id = (order_data or {}).get('externalPartnerId')
+    if tenant_id:
+        response_cache.invalidate(f"/api/partners/v1/tenants/{tenant_id}/data_bundle")
+    else:
+        response_cache.invalidate_prefix("/api/partners/v1/tenants/")
+    # Seat counts and membership roll up into the org endpoints
+    response_cache.invalidate_prefix("/api/partners/v1/orgs")
+
+#This is for fetching the tenants
+
+def fetch_tenant_pages(headers, prefetch=True):
+    started_at = time.time()
+    position = 0
+    # The account's own client: the prefetch thread has no current account
+    for page in iter_pages(current_account().partner_api, "/api/partners/v1/tenants", 'tenants',
+                           page_size=TENANTS_PAGE_SIZE, prefetch=prefetch, headers=headers):
+        log_payload("Tenants API Response Content", page)
+        snapshot_store.put_tenants(page, position)
+        position += len(page)
+        yield page
+    # Only a listing read to the end shows which tenants are gone
+    snapshot_store.finish_tenant_sync(started_at)
+
+def start_tenant_pages(headers, prefetch=True):
+    # Pull the first page up front so upstream errors surface before any
+    # output is sent; returns None if the Tenants API answered with no body
+    pages = fetch_tenant_pages(headers, prefetch)
+    first_page = next(pages, None)
+    if first_page is None:
+        return None
+    return itertools.chain([first_page], pages)
+
+def fetch_orgs(headers, use_cache=True):
+    if use_cache:
+        return cached_get_json("orgs", "/api/partners/v1/orgs", headers, default={}).get('orgs', [])
+    
+    orgs_response = partner_api.get("/api/partners/v1/orgs", headers=headers)
+    orgs_response.raise_for_status()
+    if not orgs_response.content:
+        return []
+    orgs = orgs_response.json().get('orgs', [])
+    snapshot_store.put_orgs(orgs)
+    return orgs
+
+def fetch_org_tenants(org, headers):
+    # Returns (org, tenants, error) so one failing org never aborts the others
+    org_id = org['externalOrgId']
     try:
-        # Fetch tenants
-        tenants_response = requests.get(f"{API_BASE_URL}/api/partners/v1/tenants?offset=0&limit=20", headers=headers)
-        tenants_response.raise_for_status()
-        logging.debug(f"Tenants API Response Content: {tenants_response.content}")
-        
-        if not tenants_response.content:
-            return render_template('error.html', error_message="Empty response from Tenants API")
-        
-        tenants_data = tenants_response.json()
-        tenants = tenants_data.get('tenants', [])
-        
-        # Create a dictionary to track which tenants are managed
-        managed_tenants = {}
-        
-        # Fetch organizations
-        orgs_response = requests.get(f"{API_BASE_URL}/api/partners/v1/orgs", headers=headers)
-        orgs_response.raise_for_status()
-        
-        orgs = []
-        if orgs_response.content:
-            orgs_data = orgs_response.json()
-            orgs = orgs_data.get('orgs', [])
-            
-            # For each organization, fetch its managed tenants
-            for org in orgs:
-                org_id = org['externalOrgId']
-                org_name = org['name']
-                
-                # Call the API to get tenants managed by this org
-                org_tenants_response = requests.get(
-                    f"{API_BASE_URL}/api/partners/v1/orgs/{org_id}/tenants", 
-                    headers=headers
-                )
-                
-                if org_tenants_response.status_code == 200 and org_tenants_response.content:
-                    org_tenants_data = org_tenants_response.json()
-                    org_tenants = org_tenants_data.get('tenants', [])
-                    
-                    # Mark each tenant as managed by this org
-                    for org_tenant in org_tenants:
-                        tenant_id = org_tenant['externalPartnerId']
-                        managed_tenants[tenant_id] = {
-                            'managed': True,
-                            'orgId': org_id,
-                            'orgName': org_name
-                        }
+        response = partner_api.get(f"/api/partners/v1/orgs/{org_id}/tenants", headers=headers)
+        response.raise_for_status()
+        org_tenants = response.json().get('tenants', []) if response.content else []
+        return org, org_tenants, None
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return org, [], str(e)
+
+def fetch_managed_tenants(orgs, headers, executor=None):
+    """Map externalPartnerId -> owning org for every org's managed tenants.
+
+    With an executor the per-org calls run concurrently, bounded by the
+    executor's worker count. Returns (managed_tenants, org_errors).
+    """
+    if executor is None:
+        results = [fetch_org_tenants(org, headers) for org in orgs]
+    else:
+        results = executor.map(bind(lambda org: fetch_org_tenants(org, headers)), orgs)
+    
+    managed_tenants = {}
+    org_errors = []
+    # Results come back in org order, so the merge matches the serial crawl
+    for org, org_tenants, error in results:
+        if error:
+            logging.warning(f"Failed to fetch tenants for org {org['externalOrgId']}: {error}")
+            org_errors.append({
+                'orgId': org['externalOrgId'],
+                'orgName': org['name'],
+                'error': error
+            })
+            continue
         
-        # Enhance tenant data with organization info
-        for tenant in tenants:
-            tenant_id = tenant['externalPartnerId']
-            if tenant_id in managed_tenants:
+        # Mark each tenant as managed by this org
+        for org_tenant in org_tenants:
+            managed_tenants[org_tenant['externalPartnerId']] = {
+                'managed': True,
+                'orgId': org['externalOrgId'],
+                'orgName': org['name']
+            }
+    return managed_tenants, org_errors
+
+def refresh_membership_index():
+    # Run by the background refresher: fresh org listing, then re-query only
+    # the orgs whose seat counts or state changed
+    access_token = get_access_token()
+    if not access_token:
+        return
+    headers = auth_headers(access_token)
+    orgs = fetch_orgs(headers, use_cache=False)
+    fetch = bind(lambda org: fetch_org_tenants(org, headers))
+    if ORG_FANOUT_MODE == "serial":
+        requeried = membership_index.refresh(orgs, fetch)
+    else:
+        with ThreadPoolExecutor(max_workers=ORG_FANOUT_MAX_WORKERS) as executor:
+            requeried = membership_index.refresh(orgs, fetch, executor.map)
+    snapshot_store.put_memberships(membership_index.members(), membership_index.updated_at)
+    logging.debug(f"Membership index refreshed, {requeried} of {len(orgs)} orgs re-queried")
+
+def fetch_membership(orgs, headers, executor=None, use_index=True):
+    # Returns (managed_tenants, org_errors); managed_tenants maps
+    # externalPartnerId -> org info through .get()
+    if not use_index:
+        return fetch_managed_tenants(orgs, headers, executor)
+    
+    if not membership_index.is_warm:
+        # Cold start: build it inline once, the refresher keeps it warm after
+        map_fn = executor.map if executor else map
+        membership_index.refresh(orgs, bind(lambda org: fetch_org_tenants(org, headers)), map_fn)
+        snapshot_store.put_memberships(membership_index.members(), membership_index.updated_at)
+    membership_index.start(bind(refresh_membership_index))
+    return membership_index, membership_index.org_errors
+
+def fetch_dashboard_data(headers, mode=None, max_workers=None, use_index=True):
+    # Returns (tenant_pages, orgs, managed_tenants, org_errors); tenant_pages
+    # is a lazy page iterator, or None when the Tenants API answered with an
+    # empty body. use_index=False forces the full per-org crawl.
+    mode = mode or ORG_FANOUT_MODE
+    if mode == "serial":
+        tenant_pages = start_tenant_pages(headers, prefetch=False)
+        orgs = fetch_orgs(headers)
+        managed_tenants, org_errors = fetch_membership(orgs, headers, use_index=use_index)
+        return tenant_pages, orgs, managed_tenants, org_errors
+    
+    # The tenants call, the orgs call and the per-org fan-out all share one
+    # pool, so max_workers caps the upstream calls in flight for this page
+    with ThreadPoolExecutor(max_workers=max_workers or ORG_FANOUT_MAX_WORKERS) as executor:
+        tenants_future = executor.submit(bind(start_tenant_pages), headers)
+        orgs = executor.submit(bind(fetch_orgs), headers).result()
+        managed_tenants, org_errors = fetch_membership(orgs, headers, executor, use_index)
+        return tenants_future.result(), orgs, managed_tenants, org_errors
+
+def annotate_tenants(tenant_pages, managed_tenants):
+    # Enhance tenant data with organization info, one page at a time
+    for page in tenant_pages:
+        for tenant in page:
+            member = managed_tenants.get(tenant['externalPartnerId'])
+            if member:
                 tenant['managed'] = True
-                tenant['orgId'] = managed_tenants[tenant_id]['orgId']
-                tenant['orgName'] = managed_tenants[tenant_id]['orgName']
+                tenant['orgId'] = member['orgId']
+                tenant['orgName'] = member['orgName']
             else:
                 tenant['managed'] = False
                 tenant['orgId'] = ''
                 tenant['orgName'] = '-'
+            yield tenant
+
+class TenantStream:
+    """Tenants for a streamed render of index.html.
+
+    Once the first bytes are sent an upstream failure can no longer become
+    an error page, so it ends the iteration and is kept on .error for the
+    template to report.
+    """
+
+    def __init__(self, tenants):
+        self.tenants = tenants
+        self.error = None
+
+    def __iter__(self):
+        try:
+            yield from self.tenants
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.error = f"Error fetching tenants: {str(e)}"
+            logging.error(self.error)
+
+def build_dashboard(headers):
+    # Returns (tenants, orgs, meta) for DashboardState, all compact
+    tenant_pages, orgs, managed_tenants, org_errors = fetch_dashboard_data(headers)
+    if tenant_pages is None:
+        raise ValueError("Empty response from Tenants API")
+    return compact_dashboard(itertools.chain.from_iterable(tenant_pages), orgs, managed_tenants, org_errors)
+
+def compact_dashboard(tenants, orgs, managed_tenants, org_errors, snapshot_at=None):
+    # snapshot_at is set when the data comes from the snapshot store
+    compact_tenants = []
+    for tenant in tenants:
+        entry = {field: tenant.get(field) for field in DASHBOARD_TENANT_FIELDS}
+        member = managed_tenants.get(tenant['externalPartnerId'])
+        entry['orgId'] = member['orgId'] if member else None
+        compact_tenants.append(entry)
+    compact_orgs = [{field: org.get(field) for field in DASHBOARD_ORG_FIELDS} for org in orgs]
+    meta = {
+        "orgErrors": org_errors,
+        "membershipUpdatedAt": membership_index.updated_at,
+        "stale": snapshot_at is not None,
+        "snapshotAt": snapshot_at
+    }
+    return compact_tenants, compact_orgs, meta
+
+def load_snapshot():
+    # Warm the membership index and the dashboard from the snapshot store, so
+    # the first requests after a restart don't wait on the full crawl; both
+    # refresh from upstream in the background on first use
+    members, membership_updated_at = snapshot_store.load_memberships()
+    if members:
+        membership_index.load(members, membership_updated_at)
+    tenants = snapshot_store.load_tenants()
+    if tenants:
+        snapshot_at = snapshot_store.meta('tenants_synced_at')
+        dashboard_state.seed(*compact_dashboard(tenants, snapshot_store.load_orgs(), membership_index, [], snapshot_at))
+        logging.info(f"Loaded {len(tenants)} tenants and {len(members)} memberships from {snapshot_store.path}")
+
+# Per-process startup, run by the first request a process serves rather
+# than at import: a server that preloads the app (gunicorn --preload) forks
+# its workers before any account, snapshot or job thread exists
+_started_pid = None
+_start_lock = threading.Lock()
+
+def configure_logging():
+    # Leaves logging alone if the server already set it up
+    logging.basicConfig(level=LOG_LEVEL)
+
+def is_started():
+    return _started_pid == os.getpid()
+
+def ensure_started():
+    global _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        configure_logging()
+        # The default account is set up (and warmed from its snapshot) now,
+        # any others on their first request
+        partner_accounts.get()
+        job_queue.resume()
+        _started_pid = os.getpid()
+
+def stream_index(**context):
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template('index.html').stream(context)
+    # Group Jinja's many small chunks into fewer socket writes
+    stream.enable_buffering(INDEX_STREAM_BUFFER)
+    return Response(stream_with_context(stream), mimetype='text/html')
+
+@app.route('/')
+def index():
+    if DASHBOARD_RENDER == "client":
+        # The tables are filled in by the page from /api/dashboard
+        return render_template('index.html', tenants=[], orgs=[], org_errors=[], membership_updated_at=None,
+                               client_render=True, poll_seconds=DASHBOARD_POLL_SECONDS, events=EVENTS_ENABLED)
+    
+    access_token = get_access_token()
+    if not access_token:
+        return render_template('error.html', error_message="Failed to obtain access token")
+    
+    headers = auth_headers(access_token)
+    
+    try:
+        tenant_pages, orgs, managed_tenants, org_errors = fetch_dashboard_data(headers)
+        
+        if tenant_pages is None:
+            return render_template('error.html', error_message="Empty response from Tenants API")
         
-        return render_template('index.html', tenants=tenants, orgs=orgs)
+        tenants = annotate_tenants(tenant_pages, managed_tenants)
+        context = {
+            "orgs": orgs,
+            "org_errors": org_errors,
+            "client_render": False,
+            "poll_seconds": 0,
+            "events": EVENTS_ENABLED,
+            "membership_updated_at": datetime.fromtimestamp(membership_index.updated_at) if membership_index.updated_at else None
+        }
+        if INDEX_STREAMING:
+            # Rows go out page by page while later pages are still loading
+            return stream_index(tenants=TenantStream(tenants), **context)
+        return render_template('index.html', tenants=list(tenants), **context)
     except requests.exceptions.RequestException as e:
         error_message = f"Error fetching data: {str(e)}"
         if hasattr(e, 'response') and e.response is not None:
@@ -143,223 +563,326 @@ def index():
         logging.error(error_message)
         return render_template('error.html', error_message=error_message)
 
-# Tenant Management API routes
-@app.route('/api/mgmt/tenants/<tenant_id>/keys', methods=['GET'])
-def get_tenant_keys(tenant_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
+# Dashboard data for client-side rendering. Without since= it returns the
+# whole snapshot; with since=<version> only the tenants changed after that
+# version, the ids removed since, and orgs if they changed. Either way the
+# ETag/Last-Modified let an unchanged poll end in a 304.
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    headers = auth_headers()
     
     try:
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/mgmt/tenants/{tenant_id}/application_keys", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching tenant keys: {str(e)}")
+        snapshot = dashboard_state.get(bind(lambda: build_dashboard(headers)), response_cache.generation)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        app.logger.error(f"Error fetching dashboard data: {str(e)}")
         return jsonify({"error": str(e)}), 500
-
-@app.route('/api/mgmt/tenants/<tenant_id>/keys', methods=['POST'])
-def create_tenant_key(tenant_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
     
-    try:
-        data = request.json or {}
-        response = requests.post(f"{API_BASE_URL}/api/partners/v1/mgmt/tenants/{tenant_id}/application_keys", headers=headers, json=data)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error creating tenant key: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    since = request.args.get('since', type=int)
+    if since is None:
+        body, etag = snapshot.body, snapshot.etag
+    else:
+        body, etag = snapshot.delta(since)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.last_modified = snapshot.last_modified
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
 
-@app.route('/api/mgmt/tenants/<tenant_id>/keys/<key_guid>', methods=['GET'])
-def get_tenant_key(tenant_id, key_guid):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
-    
-    try:
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/mgmt/tenants/{tenant_id}/application_keys/{key_guid}", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching tenant key: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+# Live dashboard updates as server-sent events:
+#   event: dashboard   id: <version>   data: the /api/dashboard?since= delta
+#   event: write       data: {"kind", "externalPartnerId", "externalOrgId"}
+# "write" is sent as soon as a local write succeeds; the "dashboard" event
+# with its changed rows follows from the rebuild it triggers, or from the
+# periodic poll for changes made elsewhere. A reconnecting EventSource sends
+# Last-Event-ID (or the page since=) and first gets what it missed.
 
-@app.route('/api/mgmt/tenants/<tenant_id>/keys/<key_guid>', methods=['DELETE'])
-def delete_tenant_key(tenant_id, key_guid):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
-    
-    try:
-        response = requests.delete(f"{API_BASE_URL}/api/partners/v1/mgmt/tenants/{tenant_id}/application_keys/{key_guid}", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error deleting tenant key: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+def refresh_dashboard():
+    # The poller's rebuild; the change listener publishes what changed
+    headers = auth_headers()
+    dashboard_state.get(bind(lambda: build_dashboard(headers)), response_cache.generation)
 
-# Organization Management API routes
-@app.route('/api/mgmt/orgs/<org_id>/keys', methods=['GET'])
-def get_org_keys(org_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
-    
-    try:
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/mgmt/orgs/{org_id}/application_keys", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching organization keys: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+def publish_dashboard_change(previous, snapshot):
+    if event_hub.subscribers:
+        body, _ = snapshot.delta(previous.version)
+        event_hub.publish("dashboard", body.decode(), snapshot.version)
 
-@app.route('/api/mgmt/orgs/<org_id>/keys', methods=['POST'])
-def create_org_key(org_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    
-    try:
-        data = request.json or {}
-        response = requests.post(f"{API_BASE_URL}/api/partners/v1/mgmt/orgs/{org_id}/application_keys", headers=headers, json=data)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error creating organization key: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+def publish_write(kind, data):
+    if not event_hub.subscribers or not isinstance(data, dict):
+        return
+    event_hub.publish("write", json.dumps({
+        "kind": kind,
+        "externalPartnerId": data.get('externalPartnerId'),
+        "externalOrgId": data.get('externalOrgId')
+    }))
+    dashboard_poller.wake()
 
-@app.route('/api/mgmt/orgs/<org_id>/keys/<key_guid>', methods=['GET'])
-def get_org_key(org_id, key_guid):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
+def dashboard_catch_up(since):
+    # What a reconnecting page missed, from the current snapshot
+    snapshot = dashboard_state.snapshot
+    if since is None or snapshot is None or since >= snapshot.version:
+        return []
+    body, _ = snapshot.delta(since)
+    return [format_event("dashboard", body.decode(), snapshot.version)]
+
+@app.route('/api/events', methods=['GET'])
+def dashboard_events():
+    ready = threading.Event()
+    subscription = event_hub.subscribe(ready.set, EVENTS_MAX_CLIENTS)
+    if subscription is None:
+        return jsonify({"error": "Too many open event streams, poll /api/dashboard instead"}), 503
+    dashboard_poller.ensure_started()
     
-    try:
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/mgmt/orgs/{org_id}/application_keys/{key_guid}", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching organization key: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    # On a reconnect Last-Event-ID is newer than the since= the page opened with
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    response = Response(event_stream(subscription, ready, dashboard_catch_up(since)), mimetype='text/event-stream')
+    # A stream closed before it started never runs the generator's cleanup
+    response.call_on_close(subscription.close)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
-@app.route('/api/mgmt/orgs/<org_id>/keys/<key_guid>', methods=['DELETE'])
-def delete_org_key(org_id, key_guid):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
+# Search, filter and sort over the dashboard's tenants, served from an
+# in-memory index of the current snapshot. An outdated snapshot is searched
+# as-is while it is rebuilt in the background, so only the very first call
+# waits on upstream.
+#   q=          case-insensitive substring of name or externalPartnerId
+#   match=      "substring" (default) or "prefix"
+#   field=      "name" or "externalPartnerId" to search only one of them
+#   state=, sku= (repeatable, any of), managed=true|false, orgId=
+#   sort=       name, billingDate or licenseUsage; "-" prefix for descending
+@app.route('/api/tenants/search', methods=['GET'])
+def search_tenants():
+    headers = auth_headers()
+    
+    sort = request.args.get('sort') or None
+    descending = bool(sort) and sort.startswith('-')
+    if sort:
+        sort = sort.lstrip('-')
+        if sort not in SORT_KEYS:
+            return jsonify({"error": f"sort must be one of {', '.join(SORT_KEYS)}"}), 400
+    field = request.args.get('field')
+    if field and field not in ('name', 'externalPartnerId'):
+        return jsonify({"error": "field must be name or externalPartnerId"}), 400
+    match = request.args.get('match', 'substring')
+    if match not in ('substring', 'prefix'):
+        return jsonify({"error": "match must be substring or prefix"}), 400
+    managed = request.args.get('managed')
+    if managed is not None:
+        managed = managed.lower() in ('1', 'true', 'yes')
+    limit = max(0, min(request.args.get('limit', 50, type=int), TENANT_SEARCH_MAX_LIMIT))
+    offset = max(0, request.args.get('offset', 0, type=int))
     
     try:
-        response = requests.delete(f"{API_BASE_URL}/api/partners/v1/mgmt/orgs/{org_id}/application_keys/{key_guid}", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error deleting organization key: {str(e)}")
+        snapshot = dashboard_state.peek(bind(lambda: build_dashboard(headers)), response_cache.generation)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        app.logger.error(f"Error fetching dashboard data: {str(e)}")
         return jsonify({"error": str(e)}), 500
+    
+    total, tenants = tenant_search.for_snapshot(snapshot).search(
+        q=request.args.get('q', '').strip(),
+        fields=(field,) if field else ('name', 'externalPartnerId'),
+        prefix=match == 'prefix',
+        states=request.args.getlist('state'),
+        skus=request.args.getlist('sku'),
+        managed=managed,
+        org_id=request.args.get('orgId'),
+        sort=sort,
+        descending=descending,
+        offset=offset,
+        limit=limit
+    )
+    return jsonify({
+        "tenants": tenants,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "version": snapshot.version,
+        "stale": snapshot.meta.get("stale", False)
+    }), 200
 
+# Routes that proxy one partner API endpoint each, as a table; asgi_app.py
+# serves the same table. upstream is the path template the route's
+# parameters fill in. Reads go through the response cache as kind `cache`;
+# writes invalidate the cached paths under `invalidates` and, with `event`,
+# tell the dashboard streams.
+class ProxyRoute:
+    def __init__(self, method, rule, endpoint, upstream, label, cache=None, invalidates=None, default_body=None,
+                 event=None):
+        self.method = method
+        self.rule = rule
+        self.endpoint = endpoint
+        self.upstream = upstream
+        self.label = label
+        self.cache = cache
+        self.invalidates = invalidates
+        self.default_body = default_body
+        self.event = event
 
-# Get organization details by ID
-# This endpoint retrieves detailed information about a specific organization
-@app.route('/api/org/<org_id>', methods=['GET'])
-def get_org_details(org_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
-    
-    try:
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/orgs/{org_id}", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error fetching organization details: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    def path(self, params):
+        return self.upstream.format_map(params)
 
-# Update organization default status
-# This endpoint allows setting an organization as the default organization
-@app.route('/api/org/<org_id>/default', methods=['PUT'])
-def update_org_default(org_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    
-    try:
-        data = request.json
-        response = requests.put(f"{API_BASE_URL}/api/partners/v1/orgs/{org_id}/default", headers=headers, json=data)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
-    except requests.exceptions.RequestException as e:
-        app.logger.error(f"Error updating organization default status: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    def invalidate(self, params):
+        response_cache.invalidate_prefix(self.invalidates.format_map(params))
+
+    def publish(self, params):
+        if self.event:
+            publish_write(self.event, {"externalOrgId": params.get('org_id'),
+                                       "externalPartnerId": params.get('tenant_id')})
+
+TENANT_KEYS = "/api/partners/v1/mgmt/tenants/{tenant_id}/application_keys"
+ORG_KEYS = "/api/partners/v1/mgmt/orgs/{org_id}/application_keys"
+PROXY_ROUTES = [
+    # Tenant Management API routes
+    ProxyRoute('GET', '/api/mgmt/tenants/<tenant_id>/keys', 'get_tenant_keys', TENANT_KEYS,
+               "fetching tenant keys", cache="keys"),
+    ProxyRoute('POST', '/api/mgmt/tenants/<tenant_id>/keys', 'create_tenant_key', TENANT_KEYS,
+               "creating tenant key", invalidates=TENANT_KEYS, default_body={}),
+    ProxyRoute('GET', '/api/mgmt/tenants/<tenant_id>/keys/<key_guid>', 'get_tenant_key', TENANT_KEYS + "/{key_guid}",
+               "fetching tenant key", cache="keys"),
+    ProxyRoute('DELETE', '/api/mgmt/tenants/<tenant_id>/keys/<key_guid>', 'delete_tenant_key', TENANT_KEYS + "/{key_guid}",
+               "deleting tenant key", invalidates=TENANT_KEYS),
+    # Organization Management API routes
+    ProxyRoute('GET', '/api/mgmt/orgs/<org_id>/keys', 'get_org_keys', ORG_KEYS,
+               "fetching organization keys", cache="keys"),
+    ProxyRoute('POST', '/api/mgmt/orgs/<org_id>/keys', 'create_org_key', ORG_KEYS,
+               "creating organization key", invalidates=ORG_KEYS, default_body={}),
+    ProxyRoute('GET', '/api/mgmt/orgs/<org_id>/keys/<key_guid>', 'get_org_key', ORG_KEYS + "/{key_guid}",
+               "fetching organization key", cache="keys"),
+    ProxyRoute('DELETE', '/api/mgmt/orgs/<org_id>/keys/<key_guid>', 'delete_org_key', ORG_KEYS + "/{key_guid}",
+               "deleting organization key", invalidates=ORG_KEYS),
+    # Organization details, and setting an organization as the default one
+    # (which changes the flag on the previous default org too)
+    ProxyRoute('GET', '/api/org/<org_id>', 'get_org_details', "/api/partners/v1/orgs/{org_id}",
+               "fetching organization details", cache="org"),
+    ProxyRoute('PUT', '/api/org/<org_id>/default', 'update_org_default', "/api/partners/v1/orgs/{org_id}/default",
+               "updating organization default status", invalidates="/api/partners/v1/orgs", event="org_default"),
+]
+
+def proxy_view(route):
+    def view(**params):
+        headers = auth_headers(content_type=route.method in ('POST', 'PUT'))
+        try:
+            if route.cache:
+                return proxy_json(cached_get_entry(route.cache, route.path(params), headers)), 200
+            kwargs = {}
+            if route.method != 'DELETE':
+                data = request.json
+                kwargs['json'] = route.default_body if data is None else data
+            response = partner_api.request(route.method, route.path(params), headers=headers, **kwargs)
+            route.invalidate(params)
+            response.raise_for_status()
+            route.publish(params)
+            return proxy_json(CachedJSON(response.content)), 200
+        except requests.exceptions.RequestException as e:
+            app.logger.error(f"Error {route.label}: {str(e)}")
+            return jsonify({"error": str(e)}), 500
+    return view
+
+for route in PROXY_ROUTES:
+    app.add_url_rule(route.rule, route.endpoint, proxy_view(route), methods=[route.method])
 
 
 #This is for for the view button
 
 @app.route('/api/tenant/<tenant_id>', methods=['GET'])
 def get_tenant(tenant_id):
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
+    headers = auth_headers()
     
     try:
         # Use the tenant_id parameter from the route
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/tenants/{tenant_id}/data_bundle", headers=headers)
-        response.raise_for_status()
-        return jsonify(response.json()), 200
+        return proxy_json(cached_get_entry("data_bundle", f"/api/partners/v1/tenants/{tenant_id}/data_bundle", headers)), 200
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error fetching tenant details: {str(e)}")
+        # Fall back to the last-known bundle, flagged with its age
+        stored = snapshot_store.get_data_bundle(tenant_id)
+        if stored:
+            body, seen_at = stored
+            response = proxy_json(CachedJSON(body))
+            response.headers['X-Snapshot-At'] = datetime.fromtimestamp(seen_at).isoformat()
+            return response, 200
         return jsonify({"error": str(e)}), 500
 
+# Indexed lookups over the last-known tenants; no upstream call
+@app.route('/api/snapshot/tenants', methods=['GET'])
+def query_snapshot_tenants():
+    tenants = snapshot_store.query_tenants(
+        external_partner_id=request.args.get('externalPartnerId'),
+        guid=request.args.get('guid'),
+        state=request.args.get('state'),
+        org_id=request.args.get('orgId'),
+        limit=min(request.args.get('limit', 100, type=int), 1000),
+        offset=request.args.get('offset', 0, type=int)
+    )
+    return jsonify({"tenants": tenants, "snapshotAt": snapshot_store.meta('tenants_synced_at')}), 200
+
+
+# Async job mode for the order writes: the route validates as usual, queues
+# the upstream call and returns 202 with the job; /api/jobs/<id> has its
+# state and, once finished, the upstream status and body. The payload's
+# transactionId is the idempotency key, so a retried submission gets the
+# job it already created.
+
+def wants_async_job():
+    return request.args.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', '')
+
+def run_job_call(call):
+    # Token per job: a queued job can run after the caller's token expired
+    headers = auth_headers(content_type=True)
+    return run_batch_call(None, call, headers)
+
+def job_response(job, status):
+    response = jsonify(job)
+    response.status_code = status
+    if job['state'] in ('queued', 'running'):
+        response.headers['Retry-After'] = '1'
+    return response
+
+def enqueue_job(kind, data):
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request body must be a JSON object"}), 400
+    try:
+        job, created = job_queue.submit(kind, data, key=data.get('transactionId'), account=current_account().name)
+    except JobConflict as e:
+        return jsonify({"error": str(e)}), 409
+    app.logger.info(f"Job {job['id']} ({kind}) {'queued' if created else 'already exists'}")
+    response = job_response(job, 202)
+    response.headers['Location'] = url_for('get_job', job_id=job['id'])
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        response.headers['Preference-Applied'] = 'respond-async'
+    return response
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id, current_account().name)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return job_response(job, 200)
 
 #This could be for edit
 
 @app.route('/api/orders/modify', methods=['POST'])
 def modify_order():
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    headers = auth_headers(content_type=True)
     
     try:
         # Get the request data
         data = request.json
+        if wants_async_job():
+            return enqueue_job("modify", data)
         
         # Send the modify request to the orders/modify endpoint
-        response = requests.post(
-            f"{API_BASE_URL}/api/partners/v1/orders/modify", 
+        response = partner_api.post(
+            "/api/partners/v1/orders/modify", 
             headers=headers, 
             json=data
         )
+        invalidate_tenant_cache(data)
         response.raise_for_status()
-        return jsonify(response.json()), 200
+        publish_write("modify", data)
+        return proxy_json(CachedJSON(response.content)), 200
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error modifying order: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -368,29 +891,327 @@ def modify_order():
 
 @app.route('/api/orders/cancel', methods=['POST'])
 def cancel_order():
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    headers = auth_headers(content_type=True)
     
     try:
         # Get the request data
         data = request.json
+        if wants_async_job():
+            return enqueue_job("cancel", data)
         
         # Send the cancel request to the orders/cancel endpoint
-        response = requests.post(
-            f"{API_BASE_URL}/api/partners/v1/orders/cancel", 
+        response = partner_api.post(
+            "/api/partners/v1/orders/cancel", 
             headers=headers, 
             json=data
         )
+        invalidate_tenant_cache(data)
         response.raise_for_status()
-        return jsonify(response.json()), 200
+        publish_write("cancel", data)
+        return proxy_json(CachedJSON(response.content)), 200
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error cancelling order: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Batch variants of the order and key routes. The body is {"items": [...]}
+# (or a bare list); every item becomes one upstream call made with a single
+# access token. Results come back together, or as NDJSON lines while the
+# calls complete when the client asks for ?stream=1 or application/x-ndjson.
+
+def read_batch_items():
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return None, "Request body must be a non-empty list of items or {\"items\": [...]}"
+    if len(items) > BATCH_MAX_ITEMS:
+        return None, f"Batch has {len(items)} items, the limit is {BATCH_MAX_ITEMS}"
+    return items, None
+
+def run_batch_call(index, call, headers):
+    # call is {"method", "path", "json", "invalidate", "on_success"?} or
+    # {"error"} for an item that failed validation; returns the item's
+    # result, never raises. A failure is marked "sent": false when the call
+    # never reached the partner API, so resending it is safe
+    if 'error' in call:
+        return {"index": index, "ok": False, "status": 400, "error": call['error']}
+    try:
+        response = partner_api.request(call['method'], call['path'], headers=headers, json=call.get('json'))
+        call['invalidate']()
+        response.raise_for_status()
+        if call.get('on_success'):
+            call['on_success']()
+        return {"index": index, "ok": True, "status": response.status_code,
+                "result": response.json() if response.content else None}
+    except requests.exceptions.RequestException as e:
+        status = e.response.status_code if getattr(e, 'response', None) is not None else 502
+        result = {"index": index, "ok": False, "status": status, "error": str(e)}
+        if request_not_sent(e):
+            result["sent"] = False
+        return result
+    except ValueError as e:
+        return {"index": index, "ok": False, "status": 502, "error": f"Invalid JSON response: {str(e)}"}
+
+def run_batch(calls, headers):
+    # Yields results in completion order
+    executor = ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(calls)))
+    try:
+        futures = [executor.submit(bind(run_batch_call), index, call, headers) for index, call in enumerate(calls)]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # A streaming client that disconnects cancels the items not yet started
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def batch_response(calls, label):
+    headers = auth_headers(content_type=True)
+    results = run_batch(calls, headers)
+    
+    if request.args.get('stream') == '1' or request.accept_mimetypes.best == 'application/x-ndjson':
+        def generate():
+            succeeded = 0
+            for result in results:
+                succeeded += result['ok']
+                yield json.dumps(result) + "\n"
+            app.logger.info(f"{label}: {succeeded} of {len(calls)} items succeeded")
+            yield json.dumps({"done": True, "total": len(calls), "succeeded": succeeded,
+                              "failed": len(calls) - succeeded}) + "\n"
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    results = sorted(results, key=lambda result: result['index'])
+    succeeded = sum(result['ok'] for result in results)
+    app.logger.info(f"{label}: {succeeded} of {len(calls)} items succeeded")
+    return jsonify({
+        "results": results,
+        "total": len(calls),
+        "succeeded": succeeded,
+        "failed": len(calls) - succeeded
+    }), 200
+
+def order_batch_call(path, item):
+    if not isinstance(item, dict):
+        return {"error": "Item must be an order object"}
+    kind = path.rsplit('/', 1)[1]
+    return {"method": "POST", "path": path, "json": item, "invalidate": lambda: invalidate_tenant_cache(item),
+            "on_success": lambda: publish_write(kind, item)}
+
+def key_batch_call(item):
+    # {"action": "create", "tenantId"|"orgId": ..., "data": {...}} or
+    # {"action": "delete", "tenantId"|"orgId": ..., "keyGuid": ...}
+    if not isinstance(item, dict):
+        return {"error": "Item must be a key operation object"}
+    if item.get('tenantId'):
+        keys_path = f"/api/partners/v1/mgmt/tenants/{item['tenantId']}/application_keys"
+    elif item.get('orgId'):
+        keys_path = f"/api/partners/v1/mgmt/orgs/{item['orgId']}/application_keys"
+    else:
+        return {"error": "tenantId or orgId is required"}
+    
+    invalidate = lambda: response_cache.invalidate_prefix(keys_path)
+    if item.get('action') == 'create':
+        return {"method": "POST", "path": keys_path, "json": item.get('data') or {}, "invalidate": invalidate}
+    if item.get('action') == 'delete':
+        if not item.get('keyGuid'):
+            return {"error": "keyGuid is required to delete a key"}
+        return {"method": "DELETE", "path": f"{keys_path}/{item['keyGuid']}", "invalidate": invalidate}
+    return {"error": "action must be 'create' or 'delete'"}
+
+@app.route('/api/orders/modify:batch', methods=['POST'])
+def modify_orders_batch():
+    items, error = read_batch_items()
+    if error:
+        return jsonify({"error": error}), 400
+    calls = [order_batch_call("/api/partners/v1/orders/modify", item) for item in items]
+    return batch_response(calls, "Batch order modify")
+
+@app.route('/api/orders/cancel:batch', methods=['POST'])
+def cancel_orders_batch():
+    items, error = read_batch_items()
+    if error:
+        return jsonify({"error": error}), 400
+    calls = [order_batch_call("/api/partners/v1/orders/cancel", item) for item in items]
+    return batch_response(calls, "Batch order cancel")
+
+@app.route('/api/mgmt/keys:batch', methods=['POST'])
+def keys_batch():
+    items, error = read_batch_items()
+    if error:
+        return jsonify({"error": error}), 400
+    return batch_response([key_batch_call(item) for item in items], "Batch key operations")
+
+# Key inventory export (see key_inventory.py): every org's and tenant's
+# application keys, streamed as NDJSON (default) or CSV (format=csv or
+# Accept: text/csv). type=org|tenant limits it to one kind; state=<name>
+# makes it incremental, writing out only what changed since the last export
+# with that name, and full=1 refetches everything. Keys are listed directly
+# upstream, not through the response cache, so an export doesn't evict the
+# cached pages.
+
+def iter_key_entities(headers, kinds, errors):
+    # (kind, entity_id, name, record) for the orgs, then the tenants page by
+    # page; a failed listing is appended to errors and ends that kind
+    if 'org' in kinds:
+        try:
+            orgs = fetch_orgs(headers, use_cache=False)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            errors.append(f"Error listing orgs: {str(e)}")
+            orgs = []
+        for org in orgs:
+            yield 'org', org['externalOrgId'], org.get('name'), org
+    if 'tenant' in kinds:
+        try:
+            for page in iter_pages(current_account().partner_api, "/api/partners/v1/tenants", 'tenants',
+                                   page_size=TENANTS_PAGE_SIZE, headers=headers):
+                for tenant in page:
+                    yield 'tenant', tenant['externalPartnerId'], tenant.get('name'), tenant
+        except (requests.exceptions.RequestException, ValueError) as e:
+            errors.append(f"Error listing tenants: {str(e)}")
+
+def fetch_entity_keys(kind, entity_id):
+    # Returns (keys, None) or (None, (error, status)); never raises
+    path = (ORG_KEYS if kind == 'org' else TENANT_KEYS).format(org_id=entity_id, tenant_id=entity_id)
+    try:
+        # Token per entity: a large fleet can outlive an access token
+        response = partner_api.get(path, headers=auth_headers())
+        response.raise_for_status()
+        return key_list(response.json() if response.content else []), None
+    except requests.exceptions.RequestException as e:
+        status = e.response.status_code if getattr(e, 'response', None) is not None else 502
+        return None, (str(e), status)
+    except ValueError as e:
+        return None, (f"Invalid JSON response: {str(e)}", 502)
+
+@app.route('/api/mgmt/keys:export', methods=['GET'])
+def export_key_inventory():
+    fmt = request.args.get('format')
+    if not fmt:
+        fmt = 'csv' if request.accept_mimetypes.best in ('text/csv', 'application/csv') else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({"error": "format must be csv or ndjson"}), 400
+    kinds = tuple(request.args.getlist('type')) or ENTITY_TYPES
+    if any(kind not in ENTITY_TYPES for kind in kinds):
+        return jsonify({"error": "type must be org or tenant"}), 400
+    state_name = request.args.get('state')
+    if state_name and not re.fullmatch(r"[A-Za-z0-9_.-]+", state_name):
+        return jsonify({"error": "state may only contain letters, digits, '.', '_' and '-'"}), 400
+    
+    state = None
+    if state_name:
+        # State names are per account
+        state_dir = account_path(KEY_EXPORT_STATE_DIR, current_account().name, partner_accounts.default_name)
+        os.makedirs(state_dir, exist_ok=True)
+        try:
+            state = ExportState(os.path.join(state_dir, state_name))
+        except StateLocked as e:
+            return jsonify({"error": str(e)}), 409
+    
+    summary = new_export_summary()
+    listing_errors = []
+    results = export_keys(iter_key_entities(auth_headers(), kinds, listing_errors), bind(fetch_entity_keys),
+                          summary, state, request.args.get('full') == '1', kinds, listing_errors)
+    
+    def generate():
+        try:
+            yield from csv_lines(results) if fmt == 'csv' else ndjson_lines(results, summary)
+            app.logger.info(f"Key export: {summary}")
+        finally:
+            if state:
+                state.close()
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if fmt == 'csv':
+        response.headers['Content-Disposition'] = 'attachment; filename="key-inventory.csv"'
+    if state:
+        # Also releases the state of a response closed before it was streamed
+        response.call_on_close(state.close)
+    return response
+
+# Bulk provisioning: a CSV or JSONL upload of org and tenant rows (see
+# provisioning.py). Every row is validated before anything is sent; an
+# invalid file gets a 400 with the invalid rows unless skip_invalid=1.
+# Otherwise the orgs, then the tenants, are created BATCH_MAX_WORKERS at a
+# time and the per-row results are streamed back as NDJSON, ending with a
+# summary line. checkpoint=<name> makes a rerun skip the rows that already
+# succeeded; dry_run=1 stops after validation.
+
+def spool_upload():
+    # The request body, copied to a temporary file in chunks
+    spool = tempfile.NamedTemporaryFile(prefix="provisioning-", delete=False)
+    with spool:
+        while True:
+            chunk = request.stream.read(PROVISION_SPOOL_CHUNK)
+            if not chunk:
+                break
+            spool.write(chunk)
+    return spool.name
+
+def provisioning_call(kind, data):
+    # Both kinds are orders, as in /api/new_org and /api/new_order
+    if kind == 'org':
+        return {"method": "POST", "path": "/api/partners/v1/orders", "json": data,
+                "invalidate": lambda: response_cache.invalidate_prefix("/api/partners/v1/orgs"),
+                "on_success": lambda: publish_write("new_org", data)}
+    return {"method": "POST", "path": "/api/partners/v1/orders", "json": data,
+            "invalidate": lambda: invalidate_tenant_cache(data), "on_success": lambda: record_order(data)}
+
+def submit_provisioning_row(line, kind, data):
+    # Token per row: a large file can outlive an access token
+    headers = auth_headers(content_type=True)
+    return run_batch_call(line, provisioning_call(kind, data), headers)
+
+@app.route('/api/provisioning', methods=['POST'])
+def provision():
+    fmt = request.args.get('format')
+    if not fmt:
+        fmt = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'jsonl'
+    if fmt not in ('csv', 'jsonl'):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+    checkpoint_name = request.args.get('checkpoint')
+    if checkpoint_name and not re.fullmatch(r"[A-Za-z0-9_.-]+", checkpoint_name):
+        return jsonify({"error": "checkpoint may only contain letters, digits, '.', '_' and '-'"}), 400
+    
+    path = spool_upload()
+    try:
+        validation = validate(path, provisioning_validator, fmt)
+    except (UnicodeDecodeError, csv.Error) as e:
+        os.unlink(path)
+        return jsonify({"error": f"Could not read the upload: {str(e)}"}), 400
+    app.logger.info(f"Provisioning upload: {validation.rows} rows ({validation.counts['org']} orgs, "
+                    f"{validation.counts['tenant']} tenants), {len(validation.errors)} invalid")
+    
+    if request.args.get('dry_run') == '1' or (validation.errors and request.args.get('skip_invalid') != '1'):
+        os.unlink(path)
+        return jsonify({
+            "valid": validation.ok,
+            "rows": validation.rows,
+            "orgs": validation.counts['org'],
+            "tenants": validation.counts['tenant'],
+            "errors": validation.errors
+        }), 200 if validation.ok else 400
+    
+    checkpoint = None
+    if checkpoint_name:
+        # Checkpoint names are per account
+        checkpoint_dir = account_path(PROVISION_CHECKPOINT_DIR, current_account().name, partner_accounts.default_name)
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        checkpoint = Checkpoint(os.path.join(checkpoint_dir, checkpoint_name))
+    
+    def generate():
+        summary = new_summary()
+        try:
+            for result in validation.errors:
+                count_result(summary, result)
+                yield json.dumps(result) + "\n"
+            for result in submit_rows(path, bind(submit_provisioning_row), validation, fmt, checkpoint, BATCH_MAX_WORKERS):
+                count_result(summary, result)
+                yield json.dumps(result) + "\n"
+            app.logger.info(f"Provisioning: {summary['succeeded']} of {summary['total']} rows succeeded")
+            yield json.dumps(dict(summary, done=True)) + "\n"
+        finally:
+            if checkpoint:
+                checkpoint.close()
+            os.unlink(path)
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 #This is for ORG 
 @app.route('/api/new_org', methods=['POST'])
 def create_new_org():
@@ -399,11 +1220,7 @@ def create_new_org():
         logging.error("Failed to obtain access token for order creation")
         return jsonify({"error": "Authentication failed"}), 401
     
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    headers = auth_headers(access_token, content_type=True)
     
     try:
         # Check if we have JSON data
@@ -412,24 +1229,27 @@ def create_new_org():
             return jsonify({"error": "Request must be in JSON format"}), 400
         
         data = request.json
-        logging.debug(f"Received order data: {data}")
+        log_payload("Received order data", data)
         
         # Validate required fields
-        required_fields = ["transactionId", "externalPartnerId", "seatTotal", "defaultOrganization", 
-                           "commercialPartnerName", "contactEmail", "contactFirstName", "contactLastName", "name"]
-        missing_fields = [field for field in required_fields if field not in data or not data[field]]
+        missing_fields = [field for field in NEW_ORG_REQUIRED_FIELDS if field not in data or not data[field]]
         
         if missing_fields:
             logging.error(f"Missing required fields: {missing_fields}")
             return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
+        if wants_async_job():
+            return enqueue_job("new_org", data)
          
         # Make the API request
-        print(data)
-        response = requests.post(f"{API_BASE_URL}/api/partners/v1/orders", headers=headers, json=data)
+        response = partner_api.post("/api/partners/v1/orders", headers=headers, json=data)
+        response_cache.invalidate_prefix("/api/partners/v1/orgs")
         response.raise_for_status()
         
-        logging.info(f"Order created successfully: {response.json()}")
-        return jsonify(response.json()), 201
+        order = response.json()
+        publish_write("new_org", data)
+        logging.info("Order created successfully")
+        log_payload("Created order", order)
+        return jsonify(order), 201
     
     except requests.exceptions.HTTPError as e:
         error_message = f"HTTP error creating order: {str(e)}"
@@ -459,21 +1279,15 @@ def create_new_org():
 # This endpoint creates a new tenant order with support for both regular and managed tenants
 @app.route('/api/new_order', methods=['POST'])
 def create_new_order():
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+    headers = auth_headers(content_type=True)
     
     try:
         # Get the request data
         data = request.json
-        logging.debug(f"Received order data: {data}")
+        log_payload("Received order data", data)
         
         # Validate required fields
-        required_fields = ['transactionId', 'externalPartnerId', 'seatTotal', 'contactEmail', 
-                          'contactFirstName', 'contactLastName', 'companyName']
+        required_fields = list(NEW_ORDER_REQUIRED_FIELDS)
         
         # Add managed-specific required fields
         if data.get('managed', False):
@@ -483,15 +1297,19 @@ def create_new_order():
         if missing_fields:
             logging.error(f"Missing required fields: {missing_fields}")
             return jsonify({"error": f"Missing required fields", "details": missing_fields}), 400
+        if wants_async_job():
+            return enqueue_job("new_order", data)
         
         # Send the order creation request
-        response = requests.post(
-            f"{API_BASE_URL}/api/partners/v1/orders", 
+        response = partner_api.post(
+            "/api/partners/v1/orders", 
             headers=headers, 
             json=data
         )
+        invalidate_tenant_cache(data)
         response.raise_for_status()
-        return jsonify(response.json()), 200
+        record_order(data)
+        return proxy_json(CachedJSON(response.content)), 200
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error creating order: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -500,22 +1318,69 @@ def create_new_order():
 #This is for fetching the orgs
 @app.route('/api/orgs', methods=['GET'])
 def get_orgs():
-    access_token = get_access_token()
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
+    headers = auth_headers()
     
     try:
-        response = requests.get(f"{API_BASE_URL}/api/partners/v1/orgs", headers=headers)
-        response.raise_for_status()
-        orgs_data = response.json()
+        orgs_data = cached_get_json("orgs", "/api/partners/v1/orgs", headers)
         orgs = orgs_data.get('orgs', [])
-        return jsonify(orgs), 200
+        return projected_json(orgs), 200
     except requests.exceptions.RequestException as e:
         app.logger.error(f"Error fetching organizations: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# Connection pool usage for the partner API client
+@app.route('/api/upstream/stats', methods=['GET'])
+def get_upstream_stats():
+    return jsonify(partner_api.stats()), 200
+
+# Response cache counters, for sizing CACHE_MAX_ENTRIES / CACHE_MAX_BYTES
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(response_cache.stats()), 200
+
+# Prometheus scrape endpoint; each worker process reports its own counters
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    ensure_started()
+
+@app.after_request
+def record_request_metrics(response):
+    # Labelled by route template so /api/tenant/<tenant_id> is one series
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    account = current_account().name
+    metrics.HTTP_REQUESTS.inc(route, request.method, str(response.status_code), account)
+    if 'request_started' in g:
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - g.request_started, route, request.method, account)
+    return response
+
+@app.after_request
+def compress_response(response):
+    # gzip/brotli for JSON, NDJSON and the dashboard page, negotiated on
+    # Accept-Encoding; streamed bodies are compressed chunk by chunk
+    if (not COMPRESS_RESPONSES or response.mimetype not in COMPRESSIBLE_TYPES
+            or response.status_code in (204, 304) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     # Log the error
@@ -528,5 +1393,55 @@ def handle_exception(e):
     # Return an HTML error page for web routes
     return render_template('error.html', error_message=f"An unexpected error occurred: {str(e)}"), 500
 
+# Settings create_app(config) can change: app.py's own, read when used. The
+# ones app.py takes from other modules are changed there (and in asgi_app)
+# too. Everything else (UPSTREAM_*, JOBS_DB, TOKEN_REFRESH_MARGIN, ...) is
+# read at import and can only come from the environment.
+CONFIG_SETTINGS = frozenset((
+    "LOG_LEVEL", "LOG_PAYLOADS", "LOG_PAYLOAD_SAMPLE_RATE", "TOKEN_URL", "PARTNER_CP_KEY", "API_BASE_URL",
+    "TOKEN_CACHE_FILE", "SNAPSHOT_DB", "CACHE_MAX_ENTRIES", "CACHE_MAX_BYTES", "CACHE_TTLS",
+    "ORG_FANOUT_MODE", "ORG_FANOUT_MAX_WORKERS", "TENANTS_PAGE_SIZE", "INDEX_STREAMING", "INDEX_STREAM_BUFFER",
+    "DASHBOARD_RENDER", "DASHBOARD_POLL_SECONDS", "TENANT_SEARCH_MAX_LIMIT", "EVENTS_ENABLED", "EVENTS_MAX_CLIENTS",
+    "BATCH_MAX_WORKERS", "BATCH_MAX_ITEMS", "PROVISION_CHECKPOINT_DIR", "KEY_EXPORT_STATE_DIR",
+    "COMPRESS_RESPONSES", "COMPRESS_MIN_BYTES"
+))
+SETTING_MODULES = ("payloads", "response_cache", "snapshot_store", "token_manager", "asgi_app")
+
+def apply_settings(config):
+    # Flask's own keys are upper-case too; they only go to app.config
+    unknown = sorted(name for name in config
+                     if name.isupper() and name not in CONFIG_SETTINGS and name not in app.config)
+    if unknown:
+        raise ValueError(f"create_app() can't change {', '.join(unknown)}; set it in the environment instead")
+    for name, value in config.items():
+        if name not in CONFIG_SETTINGS:
+            continue
+        globals()[name] = value
+        for module in filter(None, (sys.modules.get(module_name) for module_name in SETTING_MODULES)):
+            if hasattr(module, name):
+                setattr(module, name, value)
+
+def create_app(config=None):
+    """Application factory for WSGI servers:
+
+        gunicorn --preload --workers 4 'app:create_app()'
+
+    config overrides settings read from the environment: any of
+    CONFIG_SETTINGS (e.g. {"DASHBOARD_RENDER": "server"}), plus Flask's own;
+    all of it also lands in app.config. Other upper-case keys raise
+    ValueError rather than being ignored. Nothing is connected or loaded
+    here, see ensure_started(). There is one app per process, so every call
+    returns the same one.
+    """
+    config = config or {}
+    apply_settings(config)
+    configure_logging()
+    if "LOG_LEVEL" in config:
+        # basicConfig() leaves an already configured root logger alone
+        logging.getLogger().setLevel(LOG_LEVEL)
+    app.config.from_mapping(config)
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Development server only; FLASK_DEBUG=1 turns on the debugger
+    create_app().run(debug=os.environ.get("FLASK_DEBUG") == "1")
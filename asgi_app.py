@@ -0,0 +1,564 @@
+"""ASGI entry point that serves the JSON proxy routes on an async HTTP client.
+
+    uvicorn --factory asgi_app:create_application --workers 2
+
+A worker no longer holds a thread per in-flight upstream call, so thousands
+of proxied requests can wait on the partner API from one process. The proxy
+routes keep the URLs and JSON contracts of app.py and share its token
+manager, response cache and membership index. Every other route (the
+dashboard, stats) is passed through to the Flask app, on a pool of
+ASGI_FLASK_THREADS threads, so the URL space is identical to the sync
+server. So are order writes asking for async job
+mode (?async=1 or Prefer: respond-async): queueing the job is quick, and the
+job then runs on app.py's job queue.
+
+/api/events is served here too, on the event loop, so open event streams
+cost no threads and aren't capped by EVENTS_MAX_CLIENTS as they are in
+app.py.
+
+The partner account is picked as in app.py (the /accounts/<name> prefix or
+the X-Partner-Account header); each account gets its own async client.
+
+Requires aiohttp and asgiref in addition to the Flask app's dependencies.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.http import parse_accept_header
+
+import app as sync_app
+import metrics
+from accounts import ACCOUNT_HEADER, use_account
+from payloads import (COMPRESS_MIN_BYTES, COMPRESS_RESPONSES, ENCODINGS, CachedJSON, compress, encode, parse_fields,
+                      project)
+from events import EVENTS_HEARTBEAT_SECONDS, EVENTS_STREAM_SECONDS, HEARTBEAT, stream_preamble
+from resilience import CircuitOpenError
+
+# The async client multiplexes every in-flight request over these
+ASGI_UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("ASGI_UPSTREAM_MAX_CONNECTIONS", "500"))
+# Requests passed through to Flask run on this many threads per process,
+# like the threads of a gthread worker
+ASGI_FLASK_THREADS = int(os.environ.get("ASGI_FLASK_THREADS", "16"))
+
+# What an upstream call can fail with, like requests' RequestException
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, ValueError, CircuitOpenError)
+
+
+class AsyncResponse:
+    # The parts of a requests.Response the handlers use, body already read
+    def __init__(self, response, content):
+        self._response = response
+        self.status_code = response.status
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        self._response.raise_for_status()
+
+
+class AsyncPartnerAPI:
+    def __init__(self, upstream, max_connections=ASGI_UPSTREAM_MAX_CONNECTIONS):
+        # upstream is the account's UpstreamClient: same base URL, timeouts
+        # and policy
+        self.upstream = upstream
+        self.base_url = upstream.base_url
+        self.max_connections = max_connections
+        self._session = None
+
+    @property
+    def session(self):
+        # Created on first use so it binds to the server's event loop
+        if self._session is None:
+            connect_timeout, read_timeout = self.upstream.timeout
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+            )
+        return self._session
+
+    async def request(self, method, path, **kwargs):
+        # Same policy object, metrics and retry loop as UpstreamClient.request
+        policy = self.upstream.policy
+        account = self.upstream.account
+        endpoint = metrics.endpoint_template(path)
+        attempt = 0
+        while True:
+            wait = policy.before_attempt(endpoint)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = time.perf_counter()
+            try:
+                async with self.session.request(method, f"{self.base_url}{path}", **kwargs) as response:
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.UPSTREAM_REQUESTS.inc(endpoint, method, type(e).__name__, account)
+                delay = policy.after_attempt(endpoint, method, attempt, error=e,
+                                             safe_to_resend=isinstance(e, aiohttp.ClientConnectorError))
+                if delay is None:
+                    raise
+            else:
+                metrics.UPSTREAM_REQUESTS.inc(endpoint, method, str(response.status), account)
+                delay = policy.after_attempt(endpoint, method, attempt, status=response.status,
+                                             retry_after=response.headers.get("Retry-After"))
+                if delay is None:
+                    return AsyncResponse(response, content)
+            finally:
+                metrics.UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint, method, account)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AccountClients:
+    # The current account's AsyncPartnerAPI, created on its first call;
+    # only used from the event loop
+    def __init__(self):
+        self._clients = {}
+
+    def current(self):
+        account = sync_app.current_account()
+        client = self._clients.get(account.name)
+        if client is None:
+            client = self._clients[account.name] = AsyncPartnerAPI(account.partner_api)
+        return client
+
+    async def request(self, method, path, **kwargs):
+        return await self.current().request(method, path, **kwargs)
+
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+
+partner_api = AccountClients()
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        self.args = {name: values[0] for name, values in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.body = body
+
+    @property
+    def is_json(self):
+        content_type = self.headers.get("content-type", "").split(";")[0].strip()
+        return content_type == "application/json" or content_type.endswith("+json")
+
+    @property
+    def json(self):
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+async def get_access_token():
+    # Only a missing/expired token needs the (blocking) token manager
+    return sync_app.token_manager.peek() or await asyncio.to_thread(sync_app.get_access_token)
+
+
+async def auth_headers(content_type=False):
+    headers = {
+        "Authorization": f"Bearer {await get_access_token()}",
+        "Accept": "application/json"
+    }
+    if content_type:
+        headers["Content-Type"] = "application/json"
+    return headers
+
+
+async def cached_get_entry(kind, path, headers):
+    # Same cache, keys and CachedJSON entries as app.cached_get_entry
+    cache = sync_app.response_cache
+    entry = cache.get(path)
+    if entry is not None:
+        return entry
+
+    generation = cache.generation
+    response = await partner_api.request("GET", path, headers=headers)
+    response.raise_for_status()
+    entry = CachedJSON(response.content)
+    if response.content:
+        cache.set(path, entry, sync_app.CACHE_TTLS[kind], len(response.content), generation)
+        # SQLite writes, kept off the event loop
+        await asyncio.to_thread(sync_app.remember_response, kind, path, entry)
+    return entry
+
+
+async def cached_get_json(kind, path, headers):
+    return (await cached_get_entry(kind, path, headers)).data
+
+
+def proxy_body(request, entry):
+    # The upstream body as-is, or the ?fields= projection, like app.proxy_json
+    fields = parse_fields(request.args.get('fields'))
+    return encode(project(entry.data, fields)) if fields else entry
+
+
+def read_route(kind, upstream_path, error_label):
+    async def handler(request, **params):
+        headers = await auth_headers()
+        try:
+            return 200, proxy_body(request, await cached_get_entry(kind, upstream_path.format(**params), headers))
+        except UPSTREAM_ERRORS as e:
+            logging.error(f"Error {error_label}: {str(e)}")
+            return 500, {"error": str(e)}
+    return handler
+
+
+def write_route(method, upstream_path, error_label, invalidate, default_body=None, on_success=None):
+    async def handler(request, **params):
+        headers = await auth_headers(content_type=method != "DELETE")
+        data = request.json
+        if data is None:
+            data = default_body
+        try:
+            kwargs = {"json": data} if method != "DELETE" else {}
+            response = await partner_api.request(method, upstream_path.format(**params), headers=headers, **kwargs)
+            invalidate(params, data)
+            response.raise_for_status()
+            if on_success:
+                on_success(params, data)
+            return 200, proxy_body(request, CachedJSON(response.content))
+        except UPSTREAM_ERRORS as e:
+            logging.error(f"Error {error_label}: {str(e)}")
+            return 500, {"error": str(e)}
+    return handler
+
+
+def invalidate_orgs(params, data):
+    sync_app.response_cache.invalidate_prefix("/api/partners/v1/orgs")
+
+
+def invalidate_tenant(params, data):
+    sync_app.invalidate_tenant_cache(data)
+
+
+async def get_tenant(request, tenant_id):
+    # Like app.get_tenant: the last-known bundle, flagged with its age, when
+    # upstream fails
+    headers = await auth_headers()
+    try:
+        entry = await cached_get_entry("data_bundle", f"/api/partners/v1/tenants/{tenant_id}/data_bundle", headers)
+        return 200, proxy_body(request, entry)
+    except UPSTREAM_ERRORS as e:
+        logging.error(f"Error fetching tenant details: {str(e)}")
+        stored = await asyncio.to_thread(sync_app.snapshot_store.get_data_bundle, tenant_id)
+        if stored:
+            body, seen_at = stored
+            return 200, proxy_body(request, CachedJSON(body)), [
+                (b"x-snapshot-at", datetime.fromtimestamp(seen_at).isoformat().encode())]
+        return 500, {"error": str(e)}
+
+
+async def get_orgs(request):
+    headers = await auth_headers()
+    try:
+        orgs_data = await cached_get_json("orgs", "/api/partners/v1/orgs", headers)
+        fields = parse_fields(request.args.get('fields'))
+        orgs = orgs_data.get('orgs', [])
+        return 200, project(orgs, fields) if fields else orgs
+    except UPSTREAM_ERRORS as e:
+        logging.error(f"Error fetching organizations: {str(e)}")
+        return 500, {"error": str(e)}
+
+
+async def create_new_org(request):
+    access_token = await get_access_token()
+    if not access_token:
+        logging.error("Failed to obtain access token for order creation")
+        return 401, {"error": "Authentication failed"}
+    if not request.is_json:
+        logging.error(f"Invalid request format. Expected JSON, got: {request.headers.get('content-type')}")
+        return 400, {"error": "Request must be in JSON format"}
+
+    data = request.json or {}
+    missing_fields = [field for field in sync_app.NEW_ORG_REQUIRED_FIELDS if not data.get(field)]
+    if missing_fields:
+        logging.error(f"Missing required fields: {missing_fields}")
+        return 400, {"error": f"Missing required fields: {', '.join(missing_fields)}"}
+
+    try:
+        response = await partner_api.request("POST", "/api/partners/v1/orders",
+                                             headers=await auth_headers(content_type=True), json=data)
+        invalidate_orgs(None, data)
+        response.raise_for_status()
+        sync_app.publish_write("new_org", data)
+        return 201, response.json()
+    except aiohttp.ClientResponseError as e:
+        error_message = f"HTTP error creating order: {str(e)}"
+        logging.error(error_message)
+        try:
+            error_detail = response.json()
+        except ValueError:
+            error_detail = response.text
+        return e.status, {"error": error_message, "details": error_detail}
+    except UPSTREAM_ERRORS as e:
+        error_message = f"Error creating order: {str(e)}"
+        logging.error(error_message)
+        return 500, {"error": error_message}
+
+
+async def create_new_order(request):
+    headers = await auth_headers(content_type=True)
+    data = request.json or {}
+    required_fields = list(sync_app.NEW_ORDER_REQUIRED_FIELDS)
+    if data.get('managed', False):
+        required_fields.append('externalOrgId')
+    missing_fields = [field for field in required_fields if not data.get(field)]
+    if missing_fields:
+        logging.error(f"Missing required fields: {missing_fields}")
+        return 400, {"error": "Missing required fields", "details": missing_fields}
+
+    try:
+        response = await partner_api.request("POST", "/api/partners/v1/orders", headers=headers, json=data)
+        sync_app.invalidate_tenant_cache(data)
+        response.raise_for_status()
+        await asyncio.to_thread(sync_app.record_order, data)
+        return 200, proxy_body(request, CachedJSON(response.content))
+    except UPSTREAM_ERRORS as e:
+        logging.error(f"Error creating order: {str(e)}")
+        return 500, {"error": str(e)}
+
+
+def table_route(route):
+    # A handler for one of app.PROXY_ROUTES
+    if route.cache:
+        return read_route(route.cache, route.upstream, route.label)
+    return write_route(route.method, route.upstream, route.label, lambda params, data: route.invalidate(params),
+                       default_body=route.default_body, on_success=lambda params, data: route.publish(params))
+
+
+# (method, Flask-style rule, handler); anything unmatched goes to Flask
+ROUTES = [(route.method, route.rule, table_route(route)) for route in sync_app.PROXY_ROUTES] + [
+    ('GET', '/api/tenant/<tenant_id>', get_tenant),
+    ('POST', '/api/orders/modify',
+     write_route("POST", "/api/partners/v1/orders/modify", "modifying order", invalidate_tenant,
+                 on_success=lambda params, data: sync_app.publish_write("modify", data))),
+    ('POST', '/api/orders/cancel',
+     write_route("POST", "/api/partners/v1/orders/cancel", "cancelling order", invalidate_tenant,
+                 on_success=lambda params, data: sync_app.publish_write("cancel", data))),
+    ('POST', '/api/new_org', create_new_org),
+    ('POST', '/api/new_order', create_new_order),
+    ('GET', '/api/orgs', get_orgs),
+]
+
+
+def compile_rule(rule):
+    return re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", rule) + "$")
+
+
+COMPILED_ROUTES = [(method, rule, compile_rule(rule), handler) for method, rule, handler in ROUTES]
+
+
+def match_route(method, path):
+    # Returns (rule, handler, params), or Nones when Flask should serve it
+    for route_method, rule, pattern, handler in COMPILED_ROUTES:
+        if route_method == method:
+            match = pattern.match(path)
+            if match:
+                return rule, handler, match.groupdict()
+    return None, None, None
+
+
+async def read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def send_json(send, status, payload, accept_encoding=None, extra_headers=()):
+    # payload is a proxied upstream body (CachedJSON), JSON bytes, or a value
+    # to encode
+    if isinstance(payload, CachedJSON):
+        body = payload.raw
+    else:
+        body = payload if isinstance(payload, bytes) else encode(payload)
+    headers = [(b"content-type", b"application/json"), (b"vary", b"Accept-Encoding"), *extra_headers]
+    # Same negotiation as app.compress_response
+    encoding = parse_accept_header(accept_encoding).best_match(ENCODINGS) if accept_encoding else None
+    if COMPRESS_RESPONSES and encoding and len(body) >= COMPRESS_MIN_BYTES:
+        body = payload.encoded(encoding) if isinstance(payload, CachedJSON) else compress(body, encoding)
+        headers.append((b"content-encoding", encoding.encode()))
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": headers
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def stream_events(request, receive, send):
+    # Same stream as app.dashboard_events
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = sync_app.event_hub.subscribe(lambda: loop.call_soon_threadsafe(ready.set))
+    sync_app.dashboard_poller.ensure_started()
+    since = request.headers.get('last-event-id') or request.args.get('since')
+    initial = sync_app.dashboard_catch_up(int(since) if since and since.isdigit() else None)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")]
+        })
+        for message in [stream_preamble()] + initial:
+            await send({"type": "http.response.body", "body": message, "more_body": True})
+        deadline = loop.time() + EVENTS_STREAM_SECONDS
+        while not subscription.overflowed and not disconnected.done():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            waiter = asyncio.ensure_future(ready.wait())
+            await asyncio.wait({waiter, disconnected}, timeout=min(EVENTS_HEARTBEAT_SECONDS, remaining),
+                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                waiter.cancel()
+                break
+            if not waiter.done():
+                waiter.cancel()
+                await send({"type": "http.response.body", "body": HEARTBEAT, "more_body": True})
+                continue
+            ready.clear()
+            for message in subscription.drain():
+                await send({"type": "http.response.body", "body": message, "more_body": True})
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        subscription.close()
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+# asgiref runs every WSGI request on one shared thread (thread_sensitive),
+# so a slow Flask route would hold up all the others; these run on a pool
+flask_executor = ThreadPoolExecutor(max_workers=ASGI_FLASK_THREADS, thread_name_prefix="flask")
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False,
+                                 executor=flask_executor)
+
+
+class PooledWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_fallback = PooledWsgiToAsgi(sync_app.app)
+
+
+def scope_header(scope, name):
+    name = name.lower().encode("latin-1")
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def wants_async_job(scope):
+    # Decided from the scope, before the body is read, so the request can
+    # still be handed to Flask untouched
+    if b"async=1" in scope.get("query_string", b"").split(b"&"):
+        return True
+    return any(name == b"prefer" and b"respond-async" in value for name, value in scope.get("headers", ()))
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await asyncio.to_thread(sync_app.ensure_started)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await partner_api.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http":
+        # Startup and a first use of an account read SQLite (job queue,
+        # snapshots), so they run off the event loop
+        if not sync_app.is_started():
+            await asyncio.to_thread(sync_app.ensure_started)
+        accounts = sync_app.partner_accounts
+        name, path, _ = accounts.resolve(scope["path"], scope_header(scope, ACCOUNT_HEADER))
+        # An unknown account gets app.py's 404
+        if name is None or name in accounts:
+            account = accounts.peek(name) or await asyncio.to_thread(accounts.get, name)
+            with use_account(account):
+                if await serve_native(scope, path, account.name, receive, send):
+                    return
+
+    await flask_fallback(scope, receive, send)
+
+
+async def serve_native(scope, path, account, receive, send):
+    # Returns False for a request Flask should serve
+    if scope["method"] == "GET" and path == "/api/events":
+        started = time.perf_counter()
+        await stream_events(Request(scope, b""), receive, send)
+        metrics.HTTP_REQUESTS.inc("/api/events", "GET", "200", account)
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, "/api/events", "GET", account)
+        return True
+    rule, handler, params = match_route(scope["method"], path)
+    if handler is None or (scope["method"] == "POST" and wants_async_job(scope)):
+        return False
+    started = time.perf_counter()
+    request = Request(scope, await read_body(receive))
+    # A handler returns (status, payload) or (status, payload, extra headers)
+    extra_headers = ()
+    try:
+        status, payload, *rest = await handler(request, **params)
+        if rest:
+            extra_headers = rest[0]
+    except Exception as e:
+        logging.error(f"Unhandled exception: {str(e)}")
+        status, payload = 500, {"error": "Internal server error", "message": str(e)}
+    await send_json(send, status, payload, request.headers.get("accept-encoding"), extra_headers)
+    # Same series as the Flask routes record in app.record_request_metrics
+    metrics.HTTP_REQUESTS.inc(rule, request.method, str(status), account)
+    metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, rule, request.method, account)
+    return True
+
+
+def create_application(config=None):
+    # For uvicorn --factory; config as for app.create_app()
+    sync_app.create_app(config)
+    return application
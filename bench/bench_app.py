@@ -0,0 +1,13 @@
+"""The app as bench_suite.py serves it: app for gunicorn, application for uvicorn.
+
+index.html and error.html sit next to app.py rather than in a templates
+folder, so Flask is pointed at them when that folder doesn't exist.
+"""
+import os
+
+import app as sync_app
+from asgi_app import application  # noqa: F401
+
+if not os.path.isdir(os.path.join(sync_app.app.root_path, sync_app.app.template_folder)):
+    sync_app.app.template_folder = sync_app.app.root_path
+app = sync_app.create_app()
@@ -0,0 +1,138 @@
+"""Load test: sync (gunicorn threads) vs async (uvicorn) serving of a proxy route.
+
+Both servers proxy GET /api/tenant/<id> to a local mock partner API with
+injected latency (response caching disabled), under the same concurrent
+load. Reports requests/sec and latency percentiles for each.
+
+    python bench/bench_asgi.py --latency 0.1 --concurrency 200 --requests 2000
+
+Needs gunicorn, uvicorn and aiohttp installed.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_partner import start_mock_partner  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, env, port):
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 20
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"server did not start: {' '.join(command)}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_load(base_url, tenant_ids, total, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async with aiohttp.ClientSession(base_url, connector=aiohttp.TCPConnector(limit=concurrency),
+                                     timeout=aiohttp.ClientTimeout(total=60)) as session:
+        async def fetch(tenant_id):
+            async with session.get(f"/api/tenant/{tenant_id}") as response:
+                await response.read()
+                return response.status
+
+        # Warm the token and connections before measuring
+        await fetch(tenant_ids[0])
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    if await fetch(tenant_ids[i % len(tenant_ids)]) != 200:
+                        errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "errors": errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.1, help="mock upstream latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sync-threads", type=int, default=16, help="gunicorn threads for the sync app")
+    args = parser.parse_args()
+
+    mock = start_mock_partner(org_count=5, latency=args.latency)
+    tenant_ids = [tenant["externalPartnerId"] for tenant in mock.dataset["tenants"]]
+    env = dict(
+        os.environ,
+        PARTNER_API_BASE_URL=mock.url,
+        PARTNER_TOKEN_URL=f"{mock.url}/oauth2/token",
+        CACHE_TTL_DATA_BUNDLE="0",
+        UPSTREAM_POOL_SIZE=str(args.sync_threads)
+    )
+
+    servers = {
+        "sync (gunicorn gthread)": lambda port: [
+            sys.executable, "-m", "gunicorn", "-w", "1", "-k", "gthread", "--threads", str(args.sync_threads),
+            "-b", f"127.0.0.1:{port}", "app:app"
+        ],
+        "async (uvicorn)": lambda port: [
+            sys.executable, "-m", "uvicorn", "asgi_app:application", "--port", str(port), "--log-level", "warning"
+        ]
+    }
+
+    print(f"upstream latency={args.latency * 1000:.0f}ms concurrency={args.concurrency} requests={args.requests}")
+    print(f"{'server':<26} {'req/s':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'errors':>7}")
+    try:
+        for name, command in servers.items():
+            port = free_port()
+            process = start_server(command(port), env, port)
+            try:
+                result = asyncio.run(run_load(f"http://127.0.0.1:{port}", tenant_ids, args.requests, args.concurrency))
+            finally:
+                process.terminate()
+                process.wait()
+            print(f"{name:<26} {result['rps']:>8.1f} {result['p50'] * 1000:>10.1f} "
+                  f"{result['p99'] * 1000:>10.1f} {result['errors']:>7}")
+    finally:
+        mock.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Wall-clock time of the dashboard crawl versus org count, serial vs concurrent.
+
+    python bench/bench_fanout.py --orgs 10 50 100 200 --latency 0.05
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from mock_partner import start_mock_partner  # noqa: E402
+
+
+def time_crawl(mode, max_workers, repeat):
+    headers = {"Authorization": "Bearer mock-token", "Accept": "application/json"}
+    best = None
+    for _ in range(repeat):
+        # Every crawl lists the orgs upstream, as they were before the cache,
+        # and never sees the org list of the previous mock server
+        app.response_cache.clear()
+        started = time.perf_counter()
+        tenant_pages = app.fetch_dashboard_data(headers, mode=mode, max_workers=max_workers, use_index=False)[0]
+        for _ in tenant_pages:
+            pass
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--orgs", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--max-workers", type=int, default=app.ORG_FANOUT_MAX_WORKERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"latency={args.latency * 1000:.0f}ms max_workers={args.max_workers}")
+    print(f"{'orgs':>6} {'serial (s)':>12} {'concurrent (s)':>15} {'speedup':>8}")
+    for org_count in args.orgs:
+        server = start_mock_partner(org_count=org_count, latency=args.latency)
+        app.partner_api.base_url = server.url
+        try:
+            serial = time_crawl("serial", args.max_workers, args.repeat)
+            concurrent = time_crawl("concurrent", args.max_workers, args.repeat)
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(f"{org_count:>6} {serial:>12.3f} {concurrent:>15.3f} {serial / concurrent:>7.1f}x")
+    print(f"upstream pool: {app.partner_api.stats()}")
+
+
+if __name__ == "__main__":
+    main()
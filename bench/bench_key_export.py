@@ -0,0 +1,77 @@
+"""Key inventory export (key_inventory.py) time and memory versus fleet size.
+
+For each tenant count, times a full export at one worker and at --workers,
+then an incremental rerun against the state the full one left, which makes
+no key calls. Peak memory is what tracemalloc sees during one more
+(untimed) full export, and should stay flat as the fleet grows. With a low
+--latency the runs are CPU-bound and more workers help less.
+
+    python bench/bench_key_export.py --tenants 500 2000 10000 --latency 0.05
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import key_inventory  # noqa: E402
+from mock_partner import start_mock_partner  # noqa: E402
+
+
+def run_export(max_workers, state=None, full=False):
+    # Returns (seconds, summary); the output is encoded and dropped
+    summary = key_inventory.new_export_summary()
+    listing_errors = []
+    started = time.perf_counter()
+    results = key_inventory.export_keys(app.iter_key_entities(app.auth_headers(), key_inventory.ENTITY_TYPES,
+                                                              listing_errors),
+                                        app.fetch_entity_keys, summary, state, full, listing_errors=listing_errors,
+                                        max_workers=max_workers)
+    for _ in key_inventory.ndjson_lines(results, summary):
+        pass
+    if listing_errors:
+        raise RuntimeError(listing_errors)
+    return time.perf_counter() - started, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, default=key_inventory.KEY_EXPORT_MAX_WORKERS)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    print(f"latency={args.latency * 1000:.0f}ms workers={args.workers}")
+    print(f"{'entities':>9} {'serial (s)':>11} {'concurrent (s)':>15} {'speedup':>8} "
+          f"{'incremental (s)':>16} {'peak (KiB)':>11}")
+    for tenant_count in args.tenants:
+        org_count = max(1, tenant_count // 20)
+        server = start_mock_partner(org_count=org_count, latency=args.latency, tenants_per_org=10,
+                                    standalone_tenants=tenant_count - org_count * 10)
+        app.partner_api.base_url = server.url
+        app.token_manager.token_url = f"{server.url}/oauth2/token"
+        state = key_inventory.ExportState(os.path.join(tempfile.mkdtemp(), "keys.state"))
+        try:
+            serial, summary = run_export(1)
+            concurrent, _ = run_export(args.workers, state)
+            incremental, _ = run_export(args.workers, state)
+            tracemalloc.start()
+            run_export(args.workers, state, full=True)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        finally:
+            state.close()
+            server.shutdown()
+            server.server_close()
+        print(f"{summary['entities']:>9} {serial:>11.2f} {concurrent:>15.2f} {serial / concurrent:>7.1f}x "
+              f"{incremental:>16.2f} {peak / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Bytes sent and proxy CPU per request for GET /api/tenant/<id>.
+
+The data bundle comes from the mock partner API padded with devices and is
+served from the response cache after the first call, so the numbers are the
+proxy's own work. "parse + jsonify" is the previous behaviour (json.loads of
+the upstream body, then jsonify) measured directly for comparison.
+
+    python bench/bench_payloads.py --devices 500 --requests 500
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from mock_partner import start_mock_partner  # noqa: E402
+
+CASES = [
+    ("pass-through", "", {}),
+    ("pass-through, gzip", "", {"Accept-Encoding": "gzip"}),
+    ("pass-through, br", "", {"Accept-Encoding": "br, gzip"}),
+    ("fields=tenant.name,licenses", "?fields=tenant.name,licenses", {}),
+]
+
+
+def measure(fn, count):
+    started = time.process_time()
+    size = 0
+    for _ in range(count):
+        size = fn()
+    return size, (time.process_time() - started) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=500, help="device records per data bundle")
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    server = start_mock_partner(org_count=2, latency=0, bundle_devices=args.devices)
+    app.partner_api.base_url = server.url
+    app.token_manager.token_url = f"{server.url}/oauth2/token"
+    client = app.app.test_client()
+    path = "/api/tenant/standalone-0"
+    raw = client.get(path).get_data()
+
+    def reserialize():
+        with app.app.app_context():
+            return len(app.jsonify(json.loads(raw)).get_data())
+
+    print(f"devices={args.devices} upstream body={len(raw)} bytes requests={args.requests}")
+    print(f"{'response':<32} {'bytes':>9} {'CPU/request (us)':>17}")
+    size, cpu = measure(reserialize, args.requests)
+    print(f"{'parse + jsonify (body only)':<32} {size:>9} {cpu * 1e6:>17.0f}")
+    try:
+        for name, query, headers in CASES:
+            if "br" in headers.get("Accept-Encoding", "") and "br" not in app.ENCODINGS:
+                print(f"{name:<32} {'(brotli not installed)':>27}")
+                continue
+            size, cpu = measure(lambda: len(client.get(path + query, headers=headers).get_data()), args.requests)
+            print(f"{name:<32} {size:>9} {cpu * 1e6:>17.0f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Proxy behaviour against a faulty partner API, with and without the upstream policy.
+
+Sends GET /api/tenant/<id> (response cache off) through the Flask app to the
+mock partner API under a few fault scenarios and reports the success rate,
+how many calls reached the upstream and the mean latency.
+
+    python bench/bench_resilience.py --requests 200 --latency 0.01
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from mock_partner import start_mock_partner  # noqa: E402
+from resilience import TokenBucket, UpstreamPolicy  # noqa: E402
+
+NO_FAULTS = {"error_rate": 0.0, "throttle_rate": 0.0, "reset_rate": 0.0, "down": False}
+
+SCENARIOS = [
+    ("flapping (30% 503)", {"error_rate": 0.3}),
+    ("throttled (20% 429, Retry-After 0)", {"throttle_rate": 0.2, "retry_after": 0}),
+    ("dropped connections (10%)", {"reset_rate": 0.1}),
+    ("outage (all 503)", {"down": True}),
+]
+
+POLICIES = [
+    ("no retries, no breaker", lambda: UpstreamPolicy(max_retries=0, failure_threshold=10 ** 9)),
+    ("default policy", lambda: UpstreamPolicy()),
+]
+
+
+def run(client, server, tenant_ids, count):
+    upstream_calls = server.call_count
+    succeeded = 0
+    started = time.perf_counter()
+    for i in range(count):
+        response = client.get(f"/api/tenant/{tenant_ids[i % len(tenant_ids)]}")
+        succeeded += response.status_code == 200
+    elapsed = time.perf_counter() - started
+    return succeeded / count, server.call_count - upstream_calls, elapsed / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--rate-limit", type=float, default=0, help="client-side calls/second (0 = off)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    server = start_mock_partner(org_count=5, latency=args.latency)
+    app.partner_api.base_url = server.url
+    app.token_manager.token_url = f"{server.url}/oauth2/token"
+    app.CACHE_TTLS["data_bundle"] = 0
+    tenant_ids = [tenant["externalPartnerId"] for tenant in server.dataset["tenants"]]
+    client = app.app.test_client()
+
+    print(f"requests={args.requests} latency={args.latency * 1000:.0f}ms rate_limit={args.rate_limit or 'off'}")
+    print(f"{'scenario':<36} {'policy':<24} {'ok %':>6} {'upstream calls':>15} {'mean (ms)':>10}")
+    try:
+        for scenario, faults in SCENARIOS:
+            for name, make_policy in POLICIES:
+                policy = make_policy()
+                policy.rate_limiter = TokenBucket(args.rate_limit, burst=10)
+                app.partner_api.policy = policy
+                server.set_faults(**dict(NO_FAULTS, **faults))
+                ok, calls, mean = run(client, server, tenant_ids, args.requests)
+                print(f"{scenario:<36} {name:<24} {ok * 100:>6.1f} {calls:>15} {mean * 1000:>10.1f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
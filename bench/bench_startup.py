@@ -0,0 +1,101 @@
+"""Startup cost of the app: import, create_app() and the first requests.
+
+Each run is a fresh interpreter against the mock partner API, timing
+`import app`, create_app(), the first request (which starts the process:
+logging, the default account, the job queue, a token fetch) and the same
+request again, then `import asgi_app` on top. Reports the median of --runs.
+
+    python bench/bench_startup.py --runs 10 --path /api/orgs
+    python bench/bench_startup.py --importtime 15
+
+--importtime also lists the slowest modules of one `python -X importtime -c
+"import app"`, cumulative, so a heavy import added to the module level
+shows up by name.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mock_partner import start_mock_partner  # noqa: E402
+
+# Runs in the fresh interpreter; prints the timings as JSON
+CHILD = """
+import json, os, sys, time
+timings = {}
+started = time.perf_counter()
+import app as sync_app
+timings["import app"] = time.perf_counter() - started
+if not os.path.isdir(os.path.join(sync_app.app.root_path, sync_app.app.template_folder)):
+    sync_app.app.template_folder = sync_app.app.root_path
+started = time.perf_counter()
+flask_app = sync_app.create_app()
+timings["create_app()"] = time.perf_counter() - started
+client = flask_app.test_client()
+for name in ("first request", "second request"):
+    started = time.perf_counter()
+    status = client.get(sys.argv[1]).status_code
+    timings[name] = time.perf_counter() - started
+    if status != 200:
+        raise SystemExit(f"{sys.argv[1]} answered {status}")
+started = time.perf_counter()
+import asgi_app
+timings["import asgi_app"] = time.perf_counter() - started
+print(json.dumps(timings))
+"""
+
+
+def run_child(env, path):
+    output = subprocess.run([sys.executable, "-c", CHILD, path], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, count):
+    # -X importtime writes "import time: self | cumulative | module" lines to stderr
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            modules.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(modules, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/api/orgs", help="the route requested after startup")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock upstream latency in seconds")
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="list the N slowest imports")
+    args = parser.parse_args()
+
+    server = start_mock_partner(org_count=10, latency=args.latency)
+    env = dict(os.environ, LOG_LEVEL="WARNING", PARTNER_API_BASE_URL=server.url,
+               PARTNER_TOKEN_URL=f"{server.url}/oauth2/token", PARTNER_CP_KEY="bench",
+               # Keep the runs independent: no token or snapshot left by the last one
+               TOKEN_CACHE_FILE="", SNAPSHOT_DB=":memory:")
+    try:
+        runs = [run_child(env, args.path) for _ in range(args.runs)]
+        print(f"{args.runs} runs, {args.path}, latency={args.latency * 1000:.0f}ms, Python {sys.version.split()[0]}")
+        print(f"{'step':<16} {'median (ms)':>12} {'min (ms)':>9} {'max (ms)':>9}")
+        for step in runs[0]:
+            values = [run[step] * 1000 for run in runs]
+            print(f"{step:<16} {statistics.median(values):>12.1f} {min(values):>9.1f} {max(values):>9.1f}")
+        if args.importtime:
+            print(f"\n{'cumulative (ms)':>15}  module")
+            for microseconds, module in slowest_imports(env, args.importtime):
+                print(f"{microseconds / 1000:>15.1f}  {module}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
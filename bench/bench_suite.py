@@ -0,0 +1,265 @@
+"""Load test of index() and every proxy route against the mock partner API.
+
+Starts the mock partner API and the app (gunicorn gthread, or uvicorn with
+--server asgi) as separate processes, then drives each scenario below with
+--concurrency parallel clients. For each one it reports throughput, latency
+percentiles, non-2xx responses and partner API calls per request (counted
+by the mock, so cache hits show up as fewer calls).
+
+    python bench/bench_suite.py --repeat 3 --save-baseline bench/baseline.json
+    python bench/bench_suite.py --repeat 3 --baseline bench/baseline.json
+
+With --baseline the run is compared with a stored one and exits 1 when a
+scenario's req/s or p95 got more than --tolerance worse, or it makes more
+upstream calls per request. Baselines are only comparable on the same
+machine and settings, including which scenarios ran (the response cache
+carries over from one to the next); the settings are stored with the
+numbers and a mismatch is reported. Writes create orders and keys in the mock only.
+Extra app settings go through --env, e.g. --env DASHBOARD_RENDER=server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_asgi import free_port, percentile, start_server  # noqa: E402
+
+# Settings that must match for two runs to be compared
+CONFIG_KEYS = ("server", "workers", "threads", "orgs", "tenants_per_org", "standalone", "bundle_devices",
+               "latency", "error_rate", "concurrency", "requests", "repeat", "no_cache", "env", "scenarios")
+
+
+class Dataset:
+    # The ids the mock generates for these sizes (see build_dataset)
+    def __init__(self, orgs, tenants_per_org, standalone):
+        self.org_ids = [f"org-{i}" for i in range(orgs)] or ["org-0"]
+        self.tenant_ids = ([f"org-{i}-tenant-{j}" for i in range(orgs) for j in range(tenants_per_org)] +
+                           [f"standalone-{i}" for i in range(standalone)]) or ["standalone-0"]
+        # Created ids must be unique across runs against one mock
+        self.run_id = f"bench{int(time.time())}"
+
+    def org(self, i):
+        return self.org_ids[i % len(self.org_ids)]
+
+    def tenant(self, i):
+        return self.tenant_ids[i % len(self.tenant_ids)]
+
+
+def new_org_body(data, i):
+    return {
+        "transactionId": f"{data.run_id}-org-{i}", "externalPartnerId": f"{data.run_id}-org-{i}", "seatTotal": 10,
+        "defaultOrganization": "false", "commercialPartnerName": "Bench", "contactEmail": "bench@example.com",
+        "contactFirstName": "Bench", "contactLastName": "Load", "name": f"Bench Org {i}"
+    }
+
+
+def new_order_body(data, i):
+    return {
+        "transactionId": f"{data.run_id}-order-{i}", "externalPartnerId": f"{data.run_id}-tenant-{i}",
+        "seatTotal": 5, "skus": ["MESP-C-U1Y-PD-TST"], "contactEmail": "bench@example.com",
+        "contactFirstName": "Bench", "contactLastName": "Load", "companyName": f"Bench Tenant {i}",
+        "managed": i % 2 == 0, "externalOrgId": data.org(i)
+    }
+
+
+# name -> (method, path(data, i), body(data, i) or None); reads first, so the
+# writes' new orgs and tenants don't change what the reads measure
+SCENARIOS = {
+    "index": ("GET", lambda data, i: "/", None),
+    "dashboard": ("GET", lambda data, i: "/api/dashboard", None),
+    "orgs": ("GET", lambda data, i: "/api/orgs", None),
+    "org": ("GET", lambda data, i: f"/api/org/{data.org(i)}", None),
+    "tenant": ("GET", lambda data, i: f"/api/tenant/{data.tenant(i)}", None),
+    "tenant_keys": ("GET", lambda data, i: f"/api/mgmt/tenants/{data.tenant(i)}/keys", None),
+    "org_keys": ("GET", lambda data, i: f"/api/mgmt/orgs/{data.org(i)}/keys", None),
+    "tenant_search": ("GET", lambda data, i: f"/api/tenants/search?q=tenant-{i % 10}&limit=50", None),
+    "modify_order": ("POST", lambda data, i: "/api/orders/modify",
+                     lambda data, i: {"transactionId": f"{data.run_id}-modify-{i}",
+                                      "externalPartnerId": data.tenant(i), "seatTotal": 20}),
+    "cancel_order": ("POST", lambda data, i: "/api/orders/cancel",
+                     lambda data, i: {"transactionId": f"{data.run_id}-cancel-{i}",
+                                      "externalPartnerId": data.tenant(i)}),
+    "org_default": ("PUT", lambda data, i: f"/api/org/{data.org(i)}/default",
+                    lambda data, i: {"defaultOrganization": i % 2 == 0}),
+    "create_tenant_key": ("POST", lambda data, i: f"/api/mgmt/tenants/{data.tenant(i)}/keys",
+                          lambda data, i: {"name": f"bench-{i}"}),
+    "new_org": ("POST", lambda data, i: "/api/new_org", new_org_body),
+    "new_order": ("POST", lambda data, i: "/api/new_order", new_order_body),
+}
+
+
+async def run_scenario(base_url, mock_url, scenario, data, total, concurrency, warmup, first=0):
+    # Request numbers start at first, so repeated runs create distinct ids
+    method, path, body = scenario
+    latencies = []
+    errors = 0
+    counter = iter(range(first, first + total))
+
+    async with aiohttp.ClientSession(base_url, connector=aiohttp.TCPConnector(limit=concurrency),
+                                     timeout=aiohttp.ClientTimeout(total=120)) as session:
+        async def call(i):
+            kwargs = {"json": body(data, i)} if body else {}
+            async with session.request(method, path(data, i), **kwargs) as response:
+                await response.read()
+                return response.status
+
+        # Warm the token, the caches and the connections; the calls they make
+        # upstream aren't counted
+        for i in range(warmup):
+            await call(first + total + i)
+        async with session.post(f"{mock_url}/_mock/reset") as response:
+            await response.read()
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    if not 200 <= await call(i) < 300:
+                        errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        async with session.get(f"{mock_url}/_mock/stats") as response:
+            upstream = await response.json()
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "errors": errors,
+        "upstream_per_request": upstream["calls"] / total,
+        "upstream_endpoints": upstream["endpoints"]
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Returns the names of the scenarios that got worse than the baseline
+    regressed = []
+    print(f"\n{'scenario':<18} {'req/s':>16} {'p95 (ms)':>18} {'upstream/req':>18}")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<18} {'(not in baseline)':>16}")
+            continue
+        rps_change = result["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        p95_change = result["p95"] / before["p95"] - 1 if before["p95"] else 0.0
+        worse = (rps_change < -tolerance or p95_change > tolerance or
+                 result["upstream_per_request"] > before["upstream_per_request"] * (1 + tolerance) + 0.01)
+        if worse:
+            regressed.append(name)
+        print(f"{name:<18} {rps_change:>+15.1%} {p95_change:>+17.1%} "
+              f"{before['upstream_per_request']:>8.2f} -> {result['upstream_per_request']:<6.2f}"
+              f"{'  REGRESSED' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("sync", "asgi"), default="sync")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker (sync)")
+    parser.add_argument("--orgs", type=int, default=50)
+    parser.add_argument("--tenants-per-org", type=int, default=3)
+    parser.add_argument("--standalone", type=int, default=20)
+    parser.add_argument("--bundle-devices", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.02, help="mock upstream latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered 503")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="unmeasured requests before each scenario")
+    parser.add_argument("--no-cache", action="store_true", help="turn the response cache off")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE", help="extra app setting")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--save-baseline", metavar="PATH", help="write this run's results here")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with a stored run")
+    parser.add_argument("--repeat", type=int, default=1, help="run each scenario this many times, keep the best")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="allowed fraction worse than the baseline")
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in CONFIG_KEYS}
+    machine = f"{platform.machine()}, {os.cpu_count()} CPUs, Python {platform.python_version()}"
+    data = Dataset(args.orgs, args.tenants_per_org, args.standalone)
+    env = dict(os.environ, LOG_LEVEL="WARNING", UPSTREAM_POOL_SIZE=str(args.threads))
+    if args.no_cache:
+        env.update(CACHE_TTL_ORGS="0", CACHE_TTL_ORG="0", CACHE_TTL_DATA_BUNDLE="0", CACHE_TTL_KEYS="0")
+    env.update(setting.split("=", 1) for setting in args.env)
+
+    mock_port = free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock = start_server([
+        sys.executable, "bench/mock_partner.py", "--port", str(mock_port), "--orgs", str(args.orgs),
+        "--tenants-per-org", str(args.tenants_per_org), "--standalone", str(args.standalone),
+        "--bundle-devices", str(args.bundle_devices), "--latency", str(args.latency),
+        "--error-rate", str(args.error_rate)
+    ], env, mock_port)
+    env.update(PARTNER_API_BASE_URL=mock_url, PARTNER_TOKEN_URL=f"{mock_url}/oauth2/token")
+
+    port = free_port()
+    if args.server == "sync":
+        command = [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "-k", "gthread",
+                   "--threads", str(args.threads), "-b", f"127.0.0.1:{port}", "bench.bench_app:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "bench.bench_app:application", "--port", str(port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    results = {}
+    try:
+        app_server = start_server(command, env, port)
+        try:
+            print(f"server={args.server} workers={args.workers} latency={args.latency * 1000:.0f}ms "
+                  f"orgs={args.orgs} tenants={len(data.tenant_ids)} concurrency={args.concurrency} "
+                  f"requests={args.requests}")
+            print(f"{'scenario':<18} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+                  f"{'errors':>7} {'upstream/req':>13}")
+            for name in args.scenarios:
+                runs = [asyncio.run(run_scenario(f"http://127.0.0.1:{port}", mock_url, SCENARIOS[name], data,
+                                                 args.requests, args.concurrency, args.warmup,
+                                                 run * (args.requests + args.warmup)))
+                        for run in range(args.repeat)]
+                result = results[name] = max(runs, key=lambda run: run["rps"])
+                print(f"{name:<18} {result['rps']:>8.1f} {result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} "
+                      f"{result['p99'] * 1000:>9.1f} {result['errors']:>7} {result['upstream_per_request']:>13.2f}")
+        finally:
+            app_server.terminate()
+            app_server.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": config, "machine": machine, "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != machine:
+            print(f"\nWarning: the baseline was recorded on {baseline.get('machine')}, this is {machine}")
+        if baseline["config"] != config:
+            changed = sorted(key for key in CONFIG_KEYS if baseline["config"].get(key) != config[key])
+            print(f"\nWarning: settings differ from the baseline ({', '.join(changed)})")
+        regressed = compare(results, baseline, args.tolerance)
+        if regressed:
+            print(f"\nRegressed: {', '.join(regressed)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
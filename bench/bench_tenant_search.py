@@ -0,0 +1,65 @@
+"""Build and query times of the tenant search index over synthetic tenants.
+
+    python bench/bench_tenant_search.py --tenants 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tenant_search import TenantSearchIndex  # noqa: E402
+
+NAMES = ("Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Soylent")
+STATES = ("ACTIVE", "SUSPENDED", "CANCELLED")
+SKUS = ("BASE", "PREMIUM", "MDM", "VPN", "SUPPORT")
+
+QUERIES = [
+    ("substring, common", {"q": "acme"}),
+    ("substring, rare", {"q": "12345"}),
+    ("prefix on externalPartnerId", {"q": "ext-0012", "prefix": True, "fields": ("externalPartnerId",)}),
+    ("state + sku, by billing date", {"states": ["ACTIVE"], "skus": ["VPN"], "sort": "billingDate"}),
+    ("managed in one org", {"org_id": "org-7"}),
+    ("standalone, top license usage", {"managed": False, "sort": "licenseUsage", "descending": True}),
+    ("everything, by name", {"sort": "name"}),
+]
+
+
+def synthetic_tenants(count, seed=1):
+    rng = random.Random(seed)
+    return [{
+        "name": f"{rng.choice(NAMES)} {rng.choice(NAMES)} {i}",
+        "guid": f"guid-{i}",
+        "externalPartnerId": f"ext-{i:07d}",
+        "skus": rng.sample(SKUS, 2),
+        "billingDate": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "licenseUsage": rng.randint(0, 1000),
+        "state": rng.choice(STATES),
+        "orgId": f"org-{i % 200}" if i % 3 == 0 else None
+    } for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    tenants = synthetic_tenants(args.tenants)
+    started = time.perf_counter()
+    index = TenantSearchIndex(tenants)
+    print(f"tenants={args.tenants} index build {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    print(f"{'query':<32} {'matches':>8} {'mean (ms)':>10}")
+    for name, query in QUERIES:
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            total, _ = index.search(**query)
+        mean = (time.perf_counter() - started) / args.repeat
+        print(f"{name:<32} {total:>8} {mean * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Local stand-in for the partner API, used by the benchmarks in this folder.
+
+Serves a generated dataset of orgs and tenants with an injected per-request
+latency so the proxy can be measured without touching the real upstream.
+Faults can be injected on the /api/ paths: 503s, 429s with Retry-After,
+dropped connections, or a full outage. Set them with set_faults() or at
+runtime with POST /_mock/faults {"error_rate": 0.2, ...}.
+
+Calls are counted per endpoint template ("GET /api/partners/v1/orgs/{id}");
+GET /_mock/stats returns the counts and POST /_mock/reset zeroes them, for
+runs where the server is in another process.
+
+    python bench/mock_partner.py --orgs 200 --tenants-per-org 5 --latency 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Ids in a path become {id} in the per-endpoint counts
+_PATH_IDS = re.compile(r"/(tenants|orgs|application_keys)/(?!application_keys|tenants|default|data_bundle)[^/]+")
+
+
+def endpoint_template(method, path):
+    return f"{method} {_PATH_IDS.sub(lambda match: f'/{match.group(1)}/{{id}}', urlsplit(path).path)}"
+
+
+def build_dataset(org_count, tenants_per_org=3, standalone_tenants=20, bundle_devices=0):
+    orgs = []
+    org_tenants = {}
+    tenants = []
+    for i in range(org_count):
+        org_id = f"org-{i}"
+        orgs.append({
+            "externalOrgId": org_id,
+            "name": f"Org {i}",
+            "seats": tenants_per_org * 10,
+            "defaultOrganization": i == 0,
+            "state": "ACTIVE"
+        })
+        org_tenants[org_id] = []
+        for j in range(tenants_per_org):
+            tenant = make_tenant(f"{org_id}-tenant-{j}")
+            org_tenants[org_id].append(tenant)
+            tenants.append(tenant)
+    for i in range(standalone_tenants):
+        tenants.append(make_tenant(f"standalone-{i}"))
+    return {"orgs": orgs, "org_tenants": org_tenants, "tenants": tenants, "keys": {}, "bundle_devices": bundle_devices}
+
+
+def make_devices(tenant, count):
+    # Filler for data bundles, which are large upstream
+    return [{
+        "deviceId": f"{tenant['guid']}-device-{i}",
+        "platform": "android" if i % 2 else "ios",
+        "osVersion": f"{12 + i % 4}.{i % 10}",
+        "lastSeen": f"2025-01-{1 + i % 28:02d}T12:00:00Z",
+        "riskLevel": ("LOW", "MEDIUM", "HIGH")[i % 3],
+        "threats": [{"type": "PHISHING", "count": i % 5}]
+    } for i in range(count)]
+
+
+def make_tenant(external_partner_id):
+    return {
+        "name": f"Tenant {external_partner_id}",
+        "guid": f"guid-{external_partner_id}",
+        "externalPartnerId": external_partner_id,
+        "skus": ["MESP-C-U1Y-PD-TST"],
+        "billingDate": "2025-01-01",
+        "licenseUsage": 5,
+        "state": "ACTIVE"
+    }
+
+
+class MockPartnerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def inject_fault(self):
+        # True when a fault was served instead of the real response
+        if not self.path.startswith("/api/"):
+            return False
+        faults = self.server.faults
+        roll = random.random()
+        if faults["down"] or roll < faults["error_rate"]:
+            self.send_json({"error": "service unavailable"}, 503)
+            return True
+        roll -= faults["error_rate"]
+        if roll < faults["throttle_rate"]:
+            self.send_json({"error": "too many requests"}, 429, {"Retry-After": str(faults["retry_after"])})
+            return True
+        roll -= faults["throttle_rate"]
+        if roll < faults["reset_rate"]:
+            # Hang up without answering, like a dropped upstream connection
+            self.close_connection = True
+            return True
+        return False
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(body) if body else {}
+        except ValueError:
+            return {}
+
+    def do_POST(self):
+        data = self.read_json()
+        if self.path == "/_mock/faults":
+            try:
+                self.server.set_faults(**data)
+            except ValueError as e:
+                return self.send_json({"error": str(e)}, 400)
+            return self.send_json(self.server.faults)
+        if self.path == "/_mock/reset":
+            self.server.reset_calls()
+            return self.send_json(self.server.call_stats())
+        self.server.record_call("POST", self.path)
+        time.sleep(self.server.latency)
+        if self.inject_fault():
+            return
+        if self.path == "/oauth2/token":
+            return self.send_json({"access_token": "mock-token", "expires_in": 3600})
+        if self.path in ("/api/partners/v1/orders/cancel", "/api/partners/v1/orders/modify"):
+            if not data.get("externalPartnerId"):
+                return self.send_json({"error": "externalPartnerId is required"}, 400)
+            return self.send_json({"status": "ACCEPTED", "externalPartnerId": data["externalPartnerId"]})
+        if self.path == "/api/partners/v1/orders":
+            return self.create_order(data)
+        match = re.fullmatch(r"/api/partners/v1/mgmt/(tenants|orgs)/([^/]+)/application_keys", self.path)
+        if match:
+            with self.server.lock:
+                keys = self.server.dataset["keys"].setdefault(match.group(2), {})
+                key = {"keyGuid": f"key-{match.group(2)}-{len(keys)}", "name": data.get("name", "")}
+                keys[key["keyGuid"]] = key
+            return self.send_json(key)
+        self.send_json({"error": "not found"}, 404)
+
+    def do_PUT(self):
+        data = self.read_json()
+        self.server.record_call("PUT", self.path)
+        time.sleep(self.server.latency)
+        if self.inject_fault():
+            return
+        match = re.fullmatch(r"/api/partners/v1/orgs/([^/]+)/default", self.path)
+        if match:
+            with self.server.lock:
+                orgs = self.server.dataset["orgs"]
+                if any(org["externalOrgId"] == match.group(1) for org in orgs):
+                    default = data.get("defaultOrganization", True) in (True, "true")
+                    for org in orgs:
+                        if org["externalOrgId"] == match.group(1):
+                            org["defaultOrganization"] = default
+                        elif default:
+                            org["defaultOrganization"] = False
+                    return self.send_json({"status": "ACCEPTED", "externalOrgId": match.group(1)})
+        self.send_json({"error": "not found"}, 404)
+
+    def create_order(self, data):
+        # An org order (it has commercialPartnerName) adds an org whose
+        # externalOrgId is its externalPartnerId; anything else adds a tenant,
+        # in externalOrgId's org when managed
+        partner_id = data.get("externalPartnerId")
+        if not partner_id:
+            return self.send_json({"error": "externalPartnerId is required"}, 400)
+        dataset = self.server.dataset
+        with self.server.lock:
+            if data.get("commercialPartnerName"):
+                if any(org["externalOrgId"] == partner_id for org in dataset["orgs"]):
+                    return self.send_json({"error": f"org {partner_id} exists"}, 409)
+                dataset["orgs"].append({
+                    "externalOrgId": partner_id,
+                    "name": data.get("name", partner_id),
+                    "seats": data.get("seatTotal", 0),
+                    "defaultOrganization": data.get("defaultOrganization") in (True, "true"),
+                    "state": "ACTIVE"
+                })
+                dataset["org_tenants"][partner_id] = []
+            else:
+                if any(tenant["externalPartnerId"] == partner_id for tenant in dataset["tenants"]):
+                    return self.send_json({"error": f"tenant {partner_id} exists"}, 409)
+                org_tenants = None
+                if data.get("managed"):
+                    org_tenants = dataset["org_tenants"].get(data.get("externalOrgId"))
+                    if org_tenants is None:
+                        return self.send_json({"error": f"org {data.get('externalOrgId')} not found"}, 400)
+                tenant = make_tenant(partner_id)
+                tenant["name"] = data.get("companyName", tenant["name"])
+                dataset["tenants"].append(tenant)
+                if org_tenants is not None:
+                    org_tenants.append(tenant)
+        self.send_json({"status": "ACCEPTED", "transactionId": data.get("transactionId"),
+                        "externalPartnerId": partner_id}, 201)
+
+    def do_DELETE(self):
+        self.server.record_call("DELETE", self.path)
+        time.sleep(self.server.latency)
+        if self.inject_fault():
+            return
+        match = re.fullmatch(r"/api/partners/v1/mgmt/(tenants|orgs)/([^/]+)/application_keys/([^/]+)", self.path)
+        if match:
+            with self.server.lock:
+                key = self.server.dataset["keys"].get(match.group(2), {}).pop(match.group(3), None)
+            if key:
+                return self.send_json(key)
+        self.send_json({"error": "not found"}, 404)
+
+    def do_GET(self):
+        if self.path == "/_mock/stats":
+            return self.send_json(self.server.call_stats())
+        self.server.record_call("GET", self.path)
+        time.sleep(self.server.latency)
+        if self.inject_fault():
+            return
+        dataset = self.server.dataset
+        url = urlsplit(self.path)
+        path = url.path
+        if path == "/api/partners/v1/tenants":
+            query = parse_qs(url.query)
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", [str(len(dataset["tenants"]))])[0])
+            return self.send_json({
+                "tenants": dataset["tenants"][offset:offset + limit],
+                "count": len(dataset["tenants"])
+            })
+        if path == "/api/partners/v1/orgs":
+            return self.send_json({"orgs": dataset["orgs"]})
+        match = re.fullmatch(r"/api/partners/v1/tenants/([^/]+)/data_bundle", path)
+        if match:
+            tenant = next((t for t in dataset["tenants"] if t["externalPartnerId"] == match.group(1)), None)
+            if tenant:
+                return self.send_json({"tenant": tenant, "licenses": {"total": 10, "used": tenant["licenseUsage"]},
+                                       "devices": make_devices(tenant, dataset["bundle_devices"])})
+        match = re.fullmatch(r"/api/partners/v1/orgs/([^/]+)/tenants", path)
+        if match and match.group(1) in dataset["org_tenants"]:
+            return self.send_json({"tenants": dataset["org_tenants"][match.group(1)]})
+        match = re.fullmatch(r"/api/partners/v1/orgs/([^/]+)", path)
+        if match:
+            org = next((o for o in dataset["orgs"] if o["externalOrgId"] == match.group(1)), None)
+            if org:
+                return self.send_json(dict(org, tenantCount=len(dataset["org_tenants"].get(org["externalOrgId"], []))))
+        match = re.fullmatch(r"/api/partners/v1/mgmt/(tenants|orgs)/([^/]+)/application_keys(?:/([^/]+))?", path)
+        if match:
+            with self.server.lock:
+                keys = dict(dataset["keys"].get(match.group(2), {}))
+            if match.group(3) is None:
+                return self.send_json({"keys": list(keys.values())})
+            if match.group(3) in keys:
+                return self.send_json(keys[match.group(3)])
+        self.send_json({"error": "not found"}, 404)
+
+
+class MockPartnerServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, dataset, latency=0.0):
+        super().__init__(address, MockPartnerHandler)
+        self.dataset = dataset
+        self.latency = latency
+        self.call_count = 0
+        self.endpoint_calls = {}
+        self.faults = {"error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1, "reset_rate": 0.0, "down": False}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record_call(self, method, path):
+        key = endpoint_template(method, path)
+        with self.lock:
+            self.call_count += 1
+            self.endpoint_calls[key] = self.endpoint_calls.get(key, 0) + 1
+
+    def reset_calls(self):
+        with self.lock:
+            self.call_count = 0
+            self.endpoint_calls = {}
+
+    def call_stats(self):
+        with self.lock:
+            return {"calls": self.call_count, "endpoints": dict(self.endpoint_calls)}
+
+    def set_faults(self, **faults):
+        unknown = set(faults) - set(self.faults)
+        if unknown:
+            raise ValueError(f"Unknown fault settings: {', '.join(sorted(unknown))}")
+        self.faults = dict(self.faults, **faults)
+
+
+def start_mock_partner(org_count=10, latency=0.05, port=0, **dataset_options):
+    # Starts the server on a daemon thread; call shutdown() when done
+    server = MockPartnerServer(("127.0.0.1", port), build_dataset(org_count, **dataset_options), latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--orgs", type=int, default=50)
+    parser.add_argument("--tenants-per-org", type=int, default=3)
+    parser.add_argument("--standalone", type=int, default=20, help="tenants outside any org")
+    parser.add_argument("--bundle-devices", type=int, default=0, help="device records per data bundle")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of /api/ calls answered with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of /api/ calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--reset-rate", type=float, default=0.0, help="fraction of /api/ calls dropped unanswered")
+    args = parser.parse_args()
+
+    dataset = build_dataset(args.orgs, args.tenants_per_org, args.standalone, args.bundle_devices)
+    server = MockPartnerServer(("127.0.0.1", args.port), dataset, args.latency)
+    server.set_faults(error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                      retry_after=args.retry_after, reset_rate=args.reset_rate)
+    print(f"Mock partner API listening on {server.url}", flush=True)
+    server.serve_forever()
@@ -0,0 +1,228 @@
+"""Change-tracked dashboard snapshot behind /api/dashboard.
+
+Tenants, orgs and membership are rebuilt at most every DASHBOARD_TTL seconds
+(sooner after a write) and compared with the previous build. Each tenant
+carries the version at which it last changed and removed tenants leave a
+tombstone, so a client that sends ?since=<version> only gets what changed.
+
+Versions are millisecond timestamps of the build that saw the change and
+are tracked per worker process; a since older than what this process has
+tracked is answered with the full snapshot.
+
+A state seeded from the snapshot store is served as-is while the first real
+build runs in the background.
+
+Listeners added with add_listener(fn) are called as fn(previous, snapshot)
+after every build that changed something; /api/events publishes the delta
+between the two.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from utils import digest
+
+DASHBOARD_TTL = int(os.environ.get("DASHBOARD_TTL", "10"))
+# How long removed tenants are remembered for delta clients
+DASHBOARD_TOMBSTONE_TTL = int(os.environ.get("DASHBOARD_TOMBSTONE_TTL", "86400"))
+
+
+def encode(payload):
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+class DashboardSnapshot:
+    """One immutable build; deltas are computed from it without locking."""
+
+    def __init__(self, version, horizon, tenants, removed, orgs, orgs_version, meta):
+        self.version = version
+        self.horizon = horizon
+        self.tenants = tenants  # [(tenant, version)] in upstream order
+        self.removed = removed  # {tenant_id: version}
+        self.orgs = orgs
+        self.orgs_version = orgs_version
+        self.meta = meta
+        self.last_modified = datetime.fromtimestamp(version / 1000, timezone.utc)
+        self.etag = str(version)
+        self.body = encode(dict(meta, version=version, full=True, orgs=orgs, removed=[],
+                                tenants=[tenant for tenant, _ in tenants]))
+
+    def delta(self, since):
+        # Returns (body, etag) with what changed after since
+        if since < self.horizon:
+            return self.body, self.etag
+        payload = dict(
+            self.meta,
+            version=self.version,
+            since=since,
+            full=False,
+            tenants=[tenant for tenant, version in self.tenants if version > since],
+            removed=[tenant_id for tenant_id, version in self.removed.items() if version > since]
+        )
+        if self.orgs_version > since:
+            payload["orgs"] = self.orgs
+        return encode(payload), f"{self.version}-{since}"
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class DashboardState:
+    def __init__(self, ttl=DASHBOARD_TTL, tombstone_ttl=DASHBOARD_TOMBSTONE_TTL):
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.snapshot = None
+        self.built_at = 0.0
+        self.stale = False
+        self._flight = None  # the build in progress, if any
+        self._generation = None
+        self._tenants = {}  # tenant_id -> (tenant, digest, version)
+        self._removed = {}
+        self._orgs = ([], None, 0)  # (orgs, digest, version)
+        self._meta = ({}, None, 0)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        # Called under the state's lock, so it must be quick
+        self._listeners.append(listener)
+
+    def get(self, build, generation=None):
+        """Return the current snapshot, rebuilding it if stale.
+
+        build() returns (tenants, orgs, meta) and is only called when the
+        snapshot is older than ttl or generation (the response cache's
+        invalidation counter) moved since the last build. One build runs at
+        a time, outside the lock: concurrent callers wait for it rather
+        than each calling upstream, and peek() isn't held up by it. A
+        seeded (stale) snapshot is returned at once while build() runs on a
+        background thread.
+        """
+        with self._lock:
+            if self.stale:
+                self._build_in_background(build, generation)
+                return self.snapshot
+            if self.snapshot is not None and not self._outdated(generation):
+                return self.snapshot
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+        if leader:
+            self._run(flight, build, generation)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return self.snapshot
+
+    def peek(self, build, generation=None):
+        """Like get(), but only waits on build() when there is no snapshot yet.
+
+        An outdated snapshot is returned as-is while the rebuild runs in the
+        background, for readers that must not block on upstream.
+        """
+        with self._lock:
+            if self.snapshot is not None:
+                if self.stale or self._outdated(generation):
+                    self._build_in_background(build, generation)
+                return self.snapshot
+        return self.get(build, generation)
+
+    def seed(self, tenants, orgs, meta):
+        # Last-known data from the snapshot store; served until a build succeeds
+        with self._lock:
+            self._apply(tenants, orgs, meta)
+            self.stale = True
+
+    def _outdated(self, generation):
+        return generation != self._generation or time.monotonic() - self.built_at >= self.ttl
+
+    def _build_in_background(self, build, generation):
+        # Called under the lock; nothing to do if a build is already running
+        if self._flight is None:
+            self._flight = _Flight()
+            threading.Thread(target=self._run, args=(self._flight, build, generation, True),
+                             name="dashboard-build", daemon=True).start()
+
+    def _run(self, flight, build, generation, background=False):
+        try:
+            tenants, orgs, meta = build()
+        except Exception as e:
+            flight.error = e
+            if background:
+                logging.error(f"Dashboard refresh failed, still serving the previous snapshot: {str(e)}")
+        else:
+            with self._lock:
+                self._apply(tenants, orgs, meta)
+                self._generation = generation
+                self.built_at = time.monotonic()
+                self.stale = False
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+
+    def _apply(self, tenants, orgs, meta):
+        previous = self.snapshot
+        now = int(time.time() * 1000)
+        if previous is not None:
+            now = max(now, previous.version + 1)
+        changed = previous is None
+
+        current = {}
+        for tenant in tenants:
+            tenant_id = tenant['externalPartnerId']
+            tenant_digest = digest(tenant)
+            known = self._tenants.get(tenant_id)
+            if known and known[1] == tenant_digest:
+                current[tenant_id] = known
+            else:
+                current[tenant_id] = (tenant, tenant_digest, now)
+                changed = True
+            self._removed.pop(tenant_id, None)
+        for tenant_id in self._tenants.keys() - current.keys():
+            self._removed[tenant_id] = now
+            changed = True
+        self._tenants = current
+
+        orgs_digest = digest(orgs)
+        if orgs_digest != self._orgs[1]:
+            self._orgs = (orgs, orgs_digest, now)
+            changed = True
+        # membershipUpdatedAt moves on every index refresh without the
+        # content changing, so it doesn't count as a change
+        meta_digest = digest({key: value for key, value in meta.items() if key != 'membershipUpdatedAt'})
+        if meta_digest != self._meta[1]:
+            changed = True
+        self._meta = (meta, meta_digest, now)
+
+        horizon = previous.horizon if previous else now
+        cutoff = int((time.time() - self.tombstone_ttl) * 1000)
+        expired = [tenant_id for tenant_id, version in self._removed.items() if version < cutoff]
+        for tenant_id in expired:
+            del self._removed[tenant_id]
+        if expired:
+            horizon = max(horizon, cutoff)
+
+        self.snapshot = DashboardSnapshot(
+            version=now if changed else previous.version,
+            horizon=horizon,
+            tenants=[(tenant, version) for tenant, _, version in current.values()],
+            removed=dict(self._removed),
+            orgs=self._orgs[0],
+            orgs_version=self._orgs[2],
+            meta=meta
+        )
+        if previous is not None and changed:
+            for listener in self._listeners:
+                try:
+                    listener(previous, self.snapshot)
+                except Exception as e:
+                    logging.error(f"Dashboard change listener failed: {str(e)}")
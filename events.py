@@ -0,0 +1,168 @@
+"""Server-sent events for the dashboard page (/api/events).
+
+EventHub fans events out to the open event streams of this process. Each
+stream has a bounded queue; one that falls EVENTS_QUEUE_SIZE events behind
+is closed, and its EventSource reconnects and catches up with since=, so a
+slow browser never holds events in memory.
+
+DashboardPoller is the one upstream poll per process behind every stream:
+while anyone is subscribed it rebuilds the dashboard every
+EVENTS_POLL_SECONDS, and shortly after wake(), which successful local
+writes call (debounced, so a burst of writes costs one rebuild). Each
+rebuild that changed something reaches the streams as one delta event
+through the dashboard's change listener, so upstream load follows the
+change rate rather than the number of open pages.
+
+Streams, subscribers and the poller are per worker process; a write
+served by another worker shows up at that worker's next poll.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+EVENTS_POLL_SECONDS = int(os.environ.get("EVENTS_POLL_SECONDS", "30"))
+EVENTS_DEBOUNCE_SECONDS = float(os.environ.get("EVENTS_DEBOUNCE_SECONDS", "0.5"))
+EVENTS_HEARTBEAT_SECONDS = int(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "100"))
+# A stream is ended after this long and the browser reconnects, so a sync
+# worker's threads aren't held forever
+EVENTS_STREAM_SECONDS = int(os.environ.get("EVENTS_STREAM_SECONDS", "300"))
+# Tells the EventSource how long to wait before reconnecting
+EVENTS_RETRY_MS = int(os.environ.get("EVENTS_RETRY_MS", "3000"))
+
+HEARTBEAT = b": keepalive\n\n"
+
+
+def format_event(event, data, event_id=None):
+    # data is one line of JSON text
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def stream_preamble():
+    return f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+
+
+class Subscription:
+    def __init__(self, hub, wakeup, queue_size):
+        self.messages = deque()
+        self.overflowed = False
+        self._hub = hub
+        self._wakeup = wakeup
+        self._queue_size = queue_size
+
+    def push(self, message):
+        if len(self.messages) >= self._queue_size:
+            self.overflowed = True
+        else:
+            self.messages.append(message)
+        self._wakeup()
+
+    def drain(self):
+        messages = []
+        while self.messages:
+            messages.append(self.messages.popleft())
+        return messages
+
+    def close(self):
+        self._hub.unsubscribe(self)
+
+
+class EventHub:
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.published = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def subscribe(self, wakeup, max_clients=None):
+        """Returns a Subscription, or None when max_clients streams are open.
+
+        wakeup() is called from the publishing thread after every message.
+        """
+        with self._lock:
+            if max_clients is not None and len(self._subscribers) >= max_clients:
+                return None
+            subscription = Subscription(self, wakeup, self.queue_size)
+            self._subscribers.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event, data, event_id=None):
+        message = format_event(event, data, event_id)
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.published += 1
+        for subscription in subscribers:
+            subscription.push(message)
+
+    def stats(self):
+        return {"subscribers": self.subscribers, "published": self.published}
+
+
+def event_stream(subscription, ready, initial=(), heartbeat=EVENTS_HEARTBEAT_SECONDS,
+                 max_age=EVENTS_STREAM_SECONDS):
+    """The body of a sync /api/events response; ready is the subscription's threading.Event."""
+    deadline = time.monotonic() + max_age
+    try:
+        yield stream_preamble()
+        yield from initial
+        while not subscription.overflowed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not ready.wait(min(heartbeat, remaining)):
+                # Also how a disconnected client is noticed: the write fails
+                yield HEARTBEAT
+                continue
+            ready.clear()
+            yield from subscription.drain()
+    finally:
+        subscription.close()
+
+
+class DashboardPoller:
+    def __init__(self, refresh, hub, interval=EVENTS_POLL_SECONDS, debounce=EVENTS_DEBOUNCE_SECONDS):
+        # refresh() brings the dashboard up to date; its change listener
+        # publishes the events
+        self.refresh = refresh
+        self.hub = hub
+        self.interval = interval
+        self.debounce = debounce
+        self._wake = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        # One thread per process, started by the first subscriber
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name="dashboard-poller", daemon=True).start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            if self._wake.wait(self.interval):
+                # Let a burst of writes settle into one rebuild
+                time.sleep(self.debounce)
+                self._wake.clear()
+            if not self.hub.subscribers:
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"Dashboard poll for events failed: {str(e)}")
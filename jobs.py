@@ -0,0 +1,234 @@
+"""Background jobs for the order write routes.
+
+A route called with ?async=1 (or Prefer: respond-async) validates the payload,
+stores a job and answers 202 at once; a local worker pool makes the upstream
+call and /api/jobs/<id> reports the outcome. Jobs are kept in SQLite, in
+memory by default or in JOBS_DB so every worker process (and a restart) sees
+the same jobs. Queued jobs are claimed with a conditional UPDATE, so one job
+runs once however many processes pick it up.
+
+The payload's transactionId is the job's idempotency key: submitting the
+same kind and transactionId again returns the existing job instead of
+creating another, and a different payload under that key is a conflict.
+A job ends succeeded, failed or unknown. Failed means the partner API
+definitively rejected the call (a 4xx, or it never got the request) and
+the job is run again when it is resubmitted, with the same transactionId,
+which the partner API also sees. Unknown means the order may have been
+created anyway (a read timeout, a 5xx, a worker that died mid-call), so a
+resubmission returns the job as it is and never calls the partner API
+again: check upstream before submitting under a new transactionId.
+
+Jobs belong to a partner account: the key, and the lookup by id, are per
+account, and the handler runs for the job's account. One pool runs the
+jobs of every account.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+JOBS_DB = os.environ.get("JOBS_DB", ":memory:")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# Finished jobs are dropped after this many seconds
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", "86400"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    account TEXT NOT NULL DEFAULT 'default',
+    kind TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    transaction_id TEXT,
+    payload TEXT NOT NULL,
+    payload_digest TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    status INTEGER,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+COLUMNS = ("id, kind, transaction_id, state, status, result, error, created_at, started_at, finished_at, "
+           "payload_digest, owner")
+
+
+class JobConflict(Exception):
+    pass
+
+
+def payload_digest(payload):
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def outcome_state(outcome):
+    # Only a call the partner API rejected, or never got, is safe to run again
+    if outcome['ok']:
+        return 'succeeded'
+    status = outcome.get('status')
+    if outcome.get('sent') is False or (status is not None and 400 <= status < 500):
+        return 'failed'
+    return 'unknown'
+
+
+def job_dict(row):
+    (job_id, kind, transaction_id, state, status, result, error,
+     created_at, started_at, finished_at, _, _) = row
+    return {
+        "id": job_id,
+        "kind": kind,
+        "transactionId": transaction_id,
+        "state": state,
+        "status": status,
+        "result": json.loads(result) if result else None,
+        "error": error,
+        "createdAt": created_at,
+        "startedAt": started_at,
+        "finishedAt": finished_at
+    }
+
+
+class JobQueue:
+    def __init__(self, handlers, path=JOBS_DB, max_workers=JOB_WORKERS, retention=JOB_RETENTION, context=None):
+        # handlers: kind -> fn(payload) returning {"ok", "status", "result"|"error"},
+        # plus "sent": False for a call that never reached the partner API;
+        # context(account) is the context manager a job's handler runs in
+        self.handlers = handlers
+        self.context = context
+        self.path = path
+        self.max_workers = max_workers
+        self.retention = retention
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn = None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_process(self):
+        # Connection and pool are per process, created lazily (neither
+        # survives a fork)
+        pid = os.getpid()
+        if self._pid != pid:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            # A JOBS_DB from before accounts
+            if "account" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+                conn.execute("ALTER TABLE jobs ADD COLUMN account TEXT NOT NULL DEFAULT 'default'")
+            self._conn = conn
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+            self.owner = f"{socket.gethostname()}:{pid}"
+            self._pid = pid
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self._ensure_process()
+            with self._conn:
+                cursor = self._conn.execute(sql, params)
+                return cursor.rowcount, cursor.fetchall()
+
+    def _row(self, where, params):
+        _, rows = self._execute(f"SELECT {COLUMNS} FROM jobs WHERE {where}", params)
+        return rows[0] if rows else None
+
+    def submit(self, kind, payload, key=None, account="default"):
+        """Returns (job, created); raises JobConflict for a reused key with another payload."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind {kind}")
+        digest = payload_digest(payload)
+        idempotency_key = f"{account}:{kind}:{key}" if key else None
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        created, _ = self._execute(
+            "INSERT OR IGNORE INTO jobs (id, account, kind, idempotency_key, transaction_id, payload, payload_digest, "
+            "state, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, account, kind, idempotency_key, key, json.dumps(payload), digest, now))
+        if not created:
+            row = self._row("idempotency_key = ?", (idempotency_key,))
+            if row[10] != digest:
+                raise JobConflict(f"transactionId {key} was already submitted with a different payload")
+            job_id = row[0]
+            # A failed job is retried; anything else (unknown included) is
+            # returned as it is
+            retried, _ = self._execute(
+                "UPDATE jobs SET state = 'queued', status = NULL, result = NULL, error = NULL, started_at = NULL, "
+                "finished_at = NULL WHERE id = ? AND state = 'failed'", (job_id,))
+            if not retried:
+                return job_dict(row), False
+        self._executor.submit(self._run, job_id)
+        self._purge(now)
+        return self.get(job_id, account), True
+
+    def get(self, job_id, account="default"):
+        row = self._row("id = ? AND account = ?", (job_id, account))
+        return job_dict(row) if row else None
+
+    def resume(self):
+        # At startup: run the queued jobs left by a previous process, and mark
+        # unknown the ones a dead process on this host was running (the call
+        # may have reached the partner API)
+        hostname = socket.gethostname()
+        _, rows = self._execute("SELECT id, state, owner FROM jobs WHERE state IN ('queued', 'running')")
+        for job_id, state, owner in rows:
+            if state == 'queued':
+                self._executor.submit(self._run, job_id)
+                continue
+            host, _, pid = (owner or "").rpartition(":")
+            if host == hostname and pid.isdigit() and not pid_alive(int(pid)):
+                self._finish(job_id, 'unknown', None, None,
+                             "Interrupted by a restart; the order may have been created upstream")
+        return len(rows)
+
+    def _run(self, job_id):
+        claimed, _ = self._execute(
+            "UPDATE jobs SET state = 'running', owner = ?, started_at = ? WHERE id = ? AND state = 'queued'",
+            (self.owner, time.time(), job_id))
+        if not claimed:
+            return
+        _, rows = self._execute("SELECT kind, payload, account FROM jobs WHERE id = ?", (job_id,))
+        kind, payload, account = rows[0]
+        try:
+            if self.context:
+                with self.context(account):
+                    outcome = self.handlers[kind](json.loads(payload))
+            else:
+                outcome = self.handlers[kind](json.loads(payload))
+        except Exception as e:
+            logging.error(f"Job {job_id} ({kind}) failed: {str(e)}")
+            outcome = {"ok": False, "status": None, "error": str(e)}
+        state = outcome_state(outcome)
+        self._finish(job_id, state, outcome.get('status'), outcome.get('result'), outcome.get('error'))
+        metrics.JOBS.inc(kind, state, account)
+
+    def _finish(self, job_id, state, status, result, error):
+        self._execute(
+            "UPDATE jobs SET state = ?, status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (state, status, json.dumps(result) if result is not None else None, error, time.time(), job_id))
+
+    def _purge(self, now):
+        self._execute("DELETE FROM jobs WHERE state IN ('succeeded', 'failed', 'unknown') AND finished_at < ?",
+                      (now - self.retention,))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
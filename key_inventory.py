@@ -0,0 +1,319 @@
+"""Inventory of the application keys of every tenant and org, for audits.
+
+The orgs, then the tenants (page by page), are walked and each one's keys
+listed on at most max_workers threads with a bounded number of calls queued,
+so memory stays flat whatever the size of the fleet. Each entity becomes one
+record, streamed out as it completes:
+
+    {"entityType": "tenant", "entityId": ..., "entityName": ..., "keys": [...]}
+    {"entityType": "org", "entityId": ..., "entityName": ..., "error": ..., "status": 404}
+    {"entityType": "tenant", "entityId": ..., "removed": true}
+
+As NDJSON that is one line per record and a summary line at the end; as
+CSV one row per key (an entity without keys still gets a row), with a
+status column of ok, error or removed.
+
+With a state file (SQLite) runs are incremental. An entity whose listing
+record is unchanged since the last run is skipped without a call, unless
+its keys were last fetched more than KEY_EXPORT_MAX_AGE seconds ago (key
+changes don't show in the listing, so this bounds how late they are seen).
+Of the entities fetched, only those whose keys changed are written out, and
+entities gone from the listings come out as removed. A failed entity is
+fetched again next run, and nothing is marked removed after a listing that
+failed part way. A state file is locked for the whole run, so a second
+export with the same state fails (StateLocked) instead of sweeping away
+the entities the first one saw.
+
+    python key_inventory.py --format csv --state keys.state > keys.csv
+"""
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; fall back to in-process locking
+    fcntl = None
+
+from utils import digest, run_bounded
+
+KEY_EXPORT_MAX_WORKERS = int(os.environ.get("KEY_EXPORT_MAX_WORKERS", "8"))
+KEY_EXPORT_MAX_AGE = int(os.environ.get("KEY_EXPORT_MAX_AGE", "86400"))
+
+ENTITY_TYPES = ('org', 'tenant')
+# CSV columns; the key fields are the ones the key modals show
+CSV_COLUMNS = ('entityType', 'entityId', 'entityName', 'guid', 'keyName', 'createdAt', 'expiresAt', 'status', 'error')
+KEY_FIELDS = ('guid', 'keyName', 'createdAt', 'expiresAt')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    entity_type TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    entity_digest TEXT,
+    keys_digest TEXT,
+    fetched_at REAL,
+    run TEXT NOT NULL,
+    PRIMARY KEY (entity_type, entity_id)
+);
+CREATE INDEX IF NOT EXISTS entities_run ON entities (run);
+"""
+
+
+def key_list(data):
+    # The keys endpoint answers with a list, or {"keys": [...]}
+    if isinstance(data, dict):
+        data = data.get('keys', [])
+    return data if isinstance(data, list) else []
+
+
+class StateLocked(Exception):
+    pass
+
+
+class ExportState:
+    """What the last runs saw of each entity; used by one export at a time.
+
+    Holds an exclusive lock on path + ".lock" until close(); raises
+    StateLocked if another export (in any process) holds it.
+    """
+
+    # Writes are committed in batches of this many
+    COMMIT_EVERY = 500
+
+    # Without fcntl the paths in use are only known within the process
+    _held = set()
+    _held_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.run = f"{time.time():.6f}"
+        self._lock_file = self._acquire()
+        try:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        except Exception:
+            self._release()
+            raise
+        self._writes = 0
+
+    def _acquire(self):
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                with self._held_lock:
+                    if self.path in self._held:
+                        raise BlockingIOError
+                    self._held.add(self.path)
+        except BlockingIOError:
+            lock_file.close()
+            raise StateLocked(f"Another export is using the state {os.path.basename(self.path)}")
+        return lock_file
+
+    def _release(self):
+        if fcntl is None:
+            with self._held_lock:
+                self._held.discard(self.path)
+        # Closing the file drops the flock
+        self._lock_file.close()
+        self._lock_file = None
+
+    def get(self, kind, entity_id):
+        # (entity_digest, keys_digest, fetched_at) or None
+        return self._conn.execute(
+            "SELECT entity_digest, keys_digest, fetched_at FROM entities WHERE entity_type = ? AND entity_id = ?",
+            (kind, entity_id)).fetchone()
+
+    def seen(self, kind, entity_id):
+        self._execute("UPDATE entities SET run = ? WHERE entity_type = ? AND entity_id = ?",
+                      (self.run, kind, entity_id))
+
+    def record(self, kind, entity_id, entity_digest, keys_digest):
+        self._execute("INSERT OR REPLACE INTO entities (entity_type, entity_id, entity_digest, keys_digest, "
+                      "fetched_at, run) VALUES (?, ?, ?, ?, ?, ?)",
+                      (kind, entity_id, entity_digest, keys_digest, time.time(), self.run))
+
+    def failed(self, kind, entity_id):
+        # Seen, but with nothing stored it is fetched again next run
+        self._execute("INSERT INTO entities (entity_type, entity_id, run) VALUES (?, ?, ?) "
+                      "ON CONFLICT (entity_type, entity_id) DO UPDATE SET entity_digest = NULL, run = excluded.run",
+                      (kind, entity_id, self.run))
+
+    def sweep(self, kinds):
+        # Yields the (kind, entity_id) of this run's kinds that it didn't
+        # see, then forgets them
+        self._conn.commit()
+        placeholders = ", ".join("?" * len(kinds))
+        where = f"entity_type IN ({placeholders}) AND run != ?"
+        cursor = self._conn.execute(f"SELECT entity_type, entity_id FROM entities WHERE {where}", (*kinds, self.run))
+        while True:
+            rows = cursor.fetchmany(self.COMMIT_EVERY)
+            if not rows:
+                break
+            yield from rows
+        self._execute(f"DELETE FROM entities WHERE {where}", (*kinds, self.run))
+
+    def _execute(self, sql, params):
+        self._conn.execute(sql, params)
+        self._writes += 1
+        if self._writes >= self.COMMIT_EVERY:
+            self._conn.commit()
+            self._writes = 0
+
+    def close(self):
+        if self._lock_file is None:
+            return
+        try:
+            self._conn.commit()
+            self._conn.close()
+        finally:
+            self._release()
+
+
+def new_export_summary():
+    return {"entities": 0, "exported": 0, "unchanged": 0, "skipped": 0, "failed": 0, "removed": 0, "keys": 0}
+
+
+def export_keys(entities, fetch_keys, summary, state=None, full=False, kinds=ENTITY_TYPES, listing_errors=(),
+                max_workers=KEY_EXPORT_MAX_WORKERS, max_age=KEY_EXPORT_MAX_AGE):
+    """Yields one record per exported entity, in completion order.
+
+    entities yields (kind, entity_id, name, record) from the listings and
+    appends to listing_errors (a list) instead of raising. fetch_keys(kind,
+    entity_id) returns (keys, None) or (None, (error, status)) and must not
+    raise. With full=True every entity is fetched and written out, and the
+    state (if any) is rebuilt.
+    """
+    now = time.time()
+
+    def pending():
+        for kind, entity_id, name, record in entities:
+            summary["entities"] += 1
+            entity_digest = digest(record)
+            known = state.get(kind, entity_id) if state else None
+            if (known and not full and known[0] == entity_digest and known[2]
+                    and now - known[2] < max_age):
+                state.seen(kind, entity_id)
+                summary["skipped"] += 1
+                continue
+            yield kind, entity_id, name, entity_digest, known
+
+    def fetch(entity):
+        kind, entity_id = entity[:2]
+        return entity, fetch_keys(kind, entity_id)
+
+    for (kind, entity_id, name, entity_digest, known), (keys, error) in run_bounded(fetch, pending(), max_workers):
+        result = {"entityType": kind, "entityId": entity_id, "entityName": name}
+        if error:
+            result["error"], result["status"] = error
+            summary["failed"] += 1
+            if state:
+                state.failed(kind, entity_id)
+            yield result
+            continue
+        keys_digest = digest(keys)
+        if state:
+            state.record(kind, entity_id, entity_digest, keys_digest)
+        if known and not full and known[1] == keys_digest:
+            summary["unchanged"] += 1
+            continue
+        result["keys"] = keys
+        summary["exported"] += 1
+        summary["keys"] += len(keys)
+        yield result
+
+    for error in listing_errors:
+        yield {"error": error}
+    if state and not listing_errors:
+        for kind, entity_id in state.sweep(kinds):
+            summary["removed"] += 1
+            yield {"entityType": kind, "entityId": entity_id, "removed": True}
+
+
+def ndjson_lines(results, summary):
+    for result in results:
+        yield json.dumps(result) + "\n"
+    yield json.dumps(dict(summary, done=True)) + "\n"
+
+
+def csv_rows(result):
+    entity = (result.get('entityType'), result.get('entityId'), result.get('entityName'))
+    empty_key = (None,) * len(KEY_FIELDS)
+    if result.get('removed'):
+        return [entity + empty_key + ('removed', None)]
+    if 'keys' not in result:
+        return [entity + empty_key + ('error', result.get('error'))]
+    keys = result['keys'] or [{}]
+    return [entity + tuple(key.get(field) for field in KEY_FIELDS) + ('ok', None) for key in keys]
+
+
+def csv_lines(results):
+    # One encoded chunk per entity, written through a reused buffer
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for result in results:
+        writer.writerows(csv_rows(result))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=("ndjson", "csv"), default="ndjson")
+    parser.add_argument("--output", help="write here instead of stdout")
+    parser.add_argument("--state", help="SQLite file of the last run; makes the run incremental")
+    parser.add_argument("--full", action="store_true", help="fetch and write every entity, rebuilding the state")
+    parser.add_argument("--type", choices=ENTITY_TYPES, action="append", help="only these entities (repeatable)")
+    parser.add_argument("--workers", type=int, default=KEY_EXPORT_MAX_WORKERS)
+    parser.add_argument("--max-age", type=int, default=KEY_EXPORT_MAX_AGE,
+                        help="seconds before an unchanged entity's keys are fetched again")
+    args = parser.parse_args()
+
+    # Imported here so the module itself doesn't depend on the app
+    import app
+    app.configure_logging()
+    kinds = tuple(kind for kind in ENTITY_TYPES if kind in (args.type or ENTITY_TYPES))
+    summary = new_export_summary()
+    listing_errors = []
+    try:
+        state = ExportState(args.state) if args.state else None
+    except StateLocked as e:
+        print(e, file=sys.stderr)
+        return 1
+    output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        results = export_keys(app.iter_key_entities(app.auth_headers(), kinds, listing_errors),
+                              app.fetch_entity_keys, summary, state, args.full, kinds, listing_errors,
+                              args.workers, args.max_age)
+        lines = csv_lines(results) if args.format == 'csv' else ndjson_lines(results, summary)
+        for line in lines:
+            output.write(line)
+    finally:
+        if state:
+            state.close()
+        if args.output:
+            output.close()
+    logging.info(f"Key export: {summary}")
+    print(f"Exported {summary['exported']} of {summary['entities']} entities ({summary['keys']} keys), "
+          f"{summary['skipped']} skipped and {summary['unchanged']} unchanged since the last run, "
+          f"{summary['failed']} failed, {summary['removed']} removed", file=sys.stderr)
+    for error in listing_errors:
+        print(error, file=sys.stderr)
+    return 0 if not summary["failed"] and not listing_errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Standing tenant -> org membership index for the dashboard.
+
+Built from the per-org tenant listings and kept warm by a background thread,
+so rendering a page is one dict lookup per tenant instead of a crawl of every
+org. Refreshes are incremental: an org is only re-queried when its seat count
+or state changed since the last pass (or on the periodic full resync).
+"""
+import logging
+import os
+import threading
+import time
+
+MEMBERSHIP_REFRESH_INTERVAL = int(os.environ.get("MEMBERSHIP_REFRESH_INTERVAL", "60"))
+# Seat counts can stay equal when tenants move between orgs, so re-query
+# everything this often regardless
+MEMBERSHIP_FULL_RESYNC = int(os.environ.get("MEMBERSHIP_FULL_RESYNC", "900"))
+
+
+def org_signature(org):
+    return (org.get('seats'), org.get('state'))
+
+
+class MembershipIndex:
+    def __init__(self, refresh_interval=MEMBERSHIP_REFRESH_INTERVAL, full_resync=MEMBERSHIP_FULL_RESYNC):
+        self.refresh_interval = refresh_interval
+        self.full_resync = full_resync
+        self.updated_at = None
+        self.org_errors = []
+        # Set while serving members loaded from a snapshot
+        self.stale = False
+        self._members = {}
+        self._org_tenants = {}
+        self._org_names = {}
+        self._signatures = {}
+        self._last_full_sync = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresher_pid = None
+
+    @property
+    def is_warm(self):
+        return self.updated_at is not None
+
+    def get(self, tenant_id):
+        return self._members.get(tenant_id)
+
+    def members(self):
+        # tenant_id -> {'managed', 'orgId', 'orgName'}; replaced, never
+        # mutated in place by refresh(), so safe to read without the lock
+        return self._members
+
+    def load(self, members, updated_at):
+        """Seed the index from a stored snapshot until the first refresh.
+
+        No org signatures are known, so that refresh re-queries every org.
+        """
+        with self._lock:
+            self._members = dict(members)
+            self._org_tenants = {}
+            for tenant_id, member in members.items():
+                self._org_tenants.setdefault(member['orgId'], set()).add(tenant_id)
+                self._org_names[member['orgId']] = member['orgName']
+            self.updated_at = updated_at or time.time()
+            self.stale = True
+
+    def refresh(self, orgs, fetch_org_tenants, map_fn=map):
+        """Bring the index in line with the given org listing.
+
+        fetch_org_tenants(org) returns (org, tenants, error) and map_fn
+        applies it to the orgs that need re-querying (pass executor.map to
+        run them concurrently). Returns the number of orgs re-queried.
+        """
+        with self._refresh_lock:
+            now = time.time()
+            full = now - self._last_full_sync >= self.full_resync
+            current = {org['externalOrgId']: org for org in orgs}
+            stale = [org for org_id, org in current.items()
+                     if full or self._signatures.get(org_id) != org_signature(org)]
+
+            results = list(map_fn(fetch_org_tenants, stale))
+
+            org_errors = []
+            with self._lock:
+                for org_id in set(self._org_tenants) - set(current):
+                    self._drop_org(org_id)
+                for org_id, org in current.items():
+                    self._org_names[org_id] = org['name']
+                for org, org_tenants, error in results:
+                    org_id = org['externalOrgId']
+                    if error:
+                        # Keep the last known members and retry next pass
+                        self._signatures.pop(org_id, None)
+                        org_errors.append({'orgId': org_id, 'orgName': org['name'], 'error': error})
+                        continue
+                    self._org_tenants[org_id] = {tenant['externalPartnerId'] for tenant in org_tenants}
+                    self._signatures[org_id] = org_signature(org)
+                # Swapped in whole so lock-free readers never see a partial index
+                self._members = {
+                    tenant_id: {'managed': True, 'orgId': org_id, 'orgName': self._org_names.get(org_id, org_id)}
+                    for org_id, tenant_ids in self._org_tenants.items()
+                    for tenant_id in tenant_ids
+                }
+                self.org_errors = org_errors
+                self.updated_at = now
+                self.stale = False
+                if full:
+                    self._last_full_sync = now
+            return len(stale)
+
+    def patch(self, tenant_id, org_id, org_name=None):
+        # Applied right after a local write so the next render already
+        # reflects it; the following refresh confirms it upstream
+        with self._lock:
+            previous = self._members.get(tenant_id)
+            if previous:
+                self._org_tenants.get(previous['orgId'], set()).discard(tenant_id)
+            self._org_tenants.setdefault(org_id, set()).add(tenant_id)
+            self._signatures.pop(org_id, None)
+            self._members[tenant_id] = {
+                'managed': True,
+                'orgId': org_id,
+                'orgName': org_name or self._org_names.get(org_id, org_id)
+            }
+
+    def _drop_org(self, org_id):
+        self._org_tenants.pop(org_id, None)
+        self._signatures.pop(org_id, None)
+
+    def start(self, refresh_fn):
+        """Run refresh_fn every refresh_interval seconds on a daemon thread.
+
+        Safe to call on every request: starts at most one thread per process.
+        """
+        pid = os.getpid()
+        if self._refresher_pid == pid:
+            return
+        with self._lock:
+            if self._refresher_pid == pid:
+                return
+            self._refresher_pid = pid
+            threading.Thread(target=self._refresh_loop, args=(refresh_fn,),
+                             name="membership-refresher", daemon=True).start()
+
+    def _refresh_loop(self, refresh_fn):
+        # A snapshot-loaded index is refreshed straight away
+        delay = 0 if self.stale else self.refresh_interval
+        while True:
+            time.sleep(delay)
+            delay = self.refresh_interval
+            try:
+                refresh_fn()
+            except Exception as e:
+                logging.error(f"Membership index refresh failed: {str(e)}")
@@ -0,0 +1,142 @@
+"""Process-local request and upstream-call metrics for /metrics.
+
+Counters and histograms are dicts keyed by label values, updated under one
+lock, so recording a sample is a couple of dict operations. render() writes
+them in the Prometheus text format. Each worker process keeps its own
+numbers; Prometheus sums them when every worker is scraped. Every series is
+labelled with the partner account it was recorded for (see accounts.py).
+"""
+import re
+import threading
+from urllib.parse import urlsplit
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_lock = threading.Lock()
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with _lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with _lock:
+            values = sorted(self._values.items())
+        for labelvalues, value in values:
+            lines.append(f"{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labelvalues -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        with _lock:
+            counts = self._values.get(labelvalues)
+            if counts is None:
+                counts = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            values = sorted((labelvalues, list(counts)) for labelvalues, counts in self._values.items())
+        for labelvalues, counts in values:
+            # Stored per bucket, exposed cumulatively
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else format_value(float(bound))
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labelvalues, [('le', le)])} {cumulative}")
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Ids in partner API paths, so each endpoint is one series however many
+# tenants and orgs it is called for
+_PATH_IDS = re.compile(r"/(tenants|orgs|application_keys)/([^/]+)")
+_ID_NAMES = {"tenants": "{tenant_id}", "orgs": "{org_id}", "application_keys": "{key_guid}"}
+
+
+def endpoint_template(path):
+    # /api/partners/v1/orgs/org-1/tenants -> /api/partners/v1/orgs/{org_id}/tenants
+    path = urlsplit(path).path
+    return _PATH_IDS.sub(lambda match: f"/{match.group(1)}/{_ID_NAMES[match.group(1)]}", path)
+
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "Requests served, by route template, method and status.",
+    ("route", "method", "status", "account"))
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce the response (to the first byte for streamed responses), by route template.",
+    ("route", "method", "account"))
+UPSTREAM_REQUESTS = Counter(
+    "partner_api_requests_total",
+    "Partner API calls, by endpoint template, method and status (exception name if no response).",
+    ("endpoint", "method", "status", "account"))
+UPSTREAM_REQUEST_DURATION = Histogram(
+    "partner_api_request_duration_seconds", "Partner API call latency, by endpoint template.",
+    ("endpoint", "method", "account"))
+TOKEN_REFRESHES = Counter(
+    "partner_token_refreshes_total", "Calls to the token endpoint, by grant type and result.",
+    ("grant", "result", "account"))
+UPSTREAM_RETRIES = Counter(
+    "partner_api_retries_total", "Partner API attempts that were retried, by endpoint template and reason.",
+    ("endpoint", "reason", "account"))
+UPSTREAM_CIRCUIT_REJECTIONS = Counter(
+    "partner_api_circuit_rejections_total", "Calls failed fast because the endpoint's circuit was open.",
+    ("endpoint", "account"))
+UPSTREAM_THROTTLE_WAIT = Counter(
+    "partner_api_throttle_wait_seconds_total", "Time spent waiting on the client-side rate limit or Retry-After.",
+    ("endpoint", "account"))
+JOBS = Counter(
+    "jobs_total", "Background order jobs finished, by kind and final state.",
+    ("kind", "state", "account"))
@@ -0,0 +1,119 @@
+"""Response bodies for the proxy routes: pass-through, projection, compression.
+
+Upstream JSON is cached as the bytes it arrived in (CachedJSON) and parsed
+only when something reads .data, so a proxy route without fields= sends the
+upstream body as-is instead of a json.loads + jsonify round trip.
+
+fields= is a comma-separated list of field names, dotted for nested ones
+("guid,keyName" or "tenants.name"). It applies to every object in a list, at
+any level.
+
+Compressible responses are sent gzip-encoded, or brotli-encoded when the
+brotli package is installed and the client prefers it; bodies smaller than
+COMPRESS_MIN_BYTES aren't worth the CPU and are left alone.
+"""
+import gzip
+import json
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", "5"))
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/csv')
+# In order of preference when the client accepts several
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+class CachedJSON:
+    """An upstream JSON body; parsed on first use of .data, then kept.
+
+    Compressed copies are kept the same way, so a cached body is compressed
+    once per encoding rather than once per response.
+    """
+
+    __slots__ = ('raw', '_data', '_encoded')
+
+    def __init__(self, raw):
+        self.raw = raw.encode() if isinstance(raw, str) else raw
+        self._data = None
+        self._encoded = {}
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = json.loads(self.raw)
+        return self._data
+
+    def encoded(self, encoding):
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = self._encoded[encoding] = compress(self.raw, encoding)
+        return body
+
+
+def parse_fields(value):
+    # "a,b.c,b.d" -> {"a": True, "b": {"c": True, "d": True}}; None without fields
+    if not value:
+        return None
+    spec = {}
+    for path in value.split(','):
+        names = [name.strip() for name in path.split('.') if name.strip()]
+        if not names:
+            continue
+        node = spec
+        for name in names[:-1]:
+            child = node.get(name)
+            if child is True:
+                break
+            if child is None:
+                child = node[name] = {}
+            node = child
+        else:
+            node[names[-1]] = True
+    return spec or None
+
+
+def project(value, spec):
+    if isinstance(value, list):
+        return [project(item, spec) for item in value]
+    if isinstance(value, dict):
+        return {name: value[name] if sub is True else project(value[name], sub)
+                for name, sub in spec.items() if name in value}
+    return value
+
+
+def encode(value):
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    # Flushes after every chunk so a streamed page or NDJSON line still
+    # reaches the client as soon as it is produced
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode() if isinstance(chunk, str) else chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,333 @@
+"""Bulk provisioning of orgs and tenant orders from CSV or JSONL.
+
+Every row is one /api/new_org or /api/new_order payload plus a "type" field,
+"org" or "tenant". In CSV, skus are separated by ";", seatTotal and
+termLength are integers and managed is true/false; empty cells are left out.
+
+A file is read a row at a time, never whole, in three passes:
+
+1. validate every row with the single-item routes' required fields (plus
+   externalOrgId for managed tenants), unique transactionIds and
+   externalPartnerIds, before anything is sent upstream;
+2. submit the orgs;
+3. submit the tenants, skipping managed tenants whose org from the same
+   file was not created.
+
+Submission runs on at most max_workers threads with a bounded number of rows
+queued. With a checkpoint file every finished row is appended to it, keyed
+by transactionId, and a rerun with the same checkpoint skips the rows that
+already succeeded.
+
+    python provisioning.py reseller.csv --checkpoint reseller.checkpoint
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+
+from utils import run_bounded
+
+PROVISION_MAX_WORKERS = int(os.environ.get("PROVISION_MAX_WORKERS", "8"))
+
+# CSV cells are strings; these become the JSON types the routes send
+INT_FIELDS = ('seatTotal', 'termLength')
+BOOL_FIELDS = ('managed',)
+LIST_FIELDS = ('skus',)
+TRUE_VALUES = frozenset(('1', 'true', 'yes', 'y'))
+# Matched against each other in sets, so they must be strings or numbers
+ID_FIELDS = ('transactionId', 'externalPartnerId', 'externalOrgId')
+
+
+class RowValidator:
+    """Required-field rules, precompiled into ordered tuples and sets once.
+
+    Built from app.py's NEW_ORG_REQUIRED_FIELDS / NEW_ORDER_REQUIRED_FIELDS.
+    Checking a row is a set difference over its non-empty keys rather than a
+    loop over the rules.
+    """
+
+    def __init__(self, org_fields, order_fields):
+        self.rules = {
+            'org': (org_fields, frozenset(org_fields)),
+            'tenant': (order_fields, frozenset(order_fields)),
+            'managed': (order_fields + ('externalOrgId',), frozenset(order_fields + ('externalOrgId',)))
+        }
+
+    def missing(self, kind, data):
+        if kind == 'tenant' and data.get('managed'):
+            kind = 'managed'
+        fields, required = self.rules[kind]
+        missing = required.difference(key for key, value in data.items() if value)
+        return [field for field in fields if field in missing] if missing else []
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            if line.strip():
+                return 'jsonl' if line.lstrip().startswith('{') else 'csv'
+    return 'csv'
+
+
+def read_rows(path, fmt):
+    # Yields (line, kind, data, error), one row at a time
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if fmt == 'csv':
+            yield from read_csv_rows(f)
+        else:
+            yield from read_jsonl_rows(f)
+
+
+def read_csv_rows(f):
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if not header:
+        return
+    header = [name.strip() for name in header]
+    int_columns = [i for i, name in enumerate(header) if name in INT_FIELDS]
+    bool_columns = [i for i, name in enumerate(header) if name in BOOL_FIELDS]
+    list_columns = [i for i, name in enumerate(header) if name in LIST_FIELDS]
+    for values in reader:
+        if not any(values):
+            continue
+        line = reader.line_num
+        if len(values) > len(header):
+            yield line, None, {}, f"Row has {len(values)} columns, the header has {len(header)}"
+            continue
+        error = None
+        for i in int_columns:
+            if i < len(values) and values[i]:
+                try:
+                    values[i] = int(values[i])
+                except ValueError:
+                    error = f"{header[i]} must be an integer, got {values[i]!r}"
+        for i in bool_columns:
+            if i < len(values):
+                values[i] = values[i].strip().lower() in TRUE_VALUES
+        for i in list_columns:
+            if i < len(values) and values[i]:
+                values[i] = [value.strip() for value in values[i].split(';') if value.strip()]
+        data = {name: value for name, value in zip(header, values) if value != ''}
+        yield line, str(data.pop('type', '')).strip().lower(), data, error
+
+
+def read_jsonl_rows(f):
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            yield line, None, {}, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(data, dict):
+            yield line, None, {}, "Row must be a JSON object"
+            continue
+        yield line, str(data.pop('type', '')).strip().lower(), data, None
+
+
+def row_result(line, kind, data, **outcome):
+    result = {
+        "line": line,
+        "type": kind,
+        "transactionId": data.get('transactionId'),
+        "externalPartnerId": data.get('externalPartnerId')
+    }
+    result.update(outcome)
+    return result
+
+
+def non_scalar_ids(data):
+    return [field for field in ID_FIELDS if isinstance(data.get(field), (dict, list))]
+
+
+class Validation:
+    def __init__(self):
+        self.rows = 0
+        self.counts = {'org': 0, 'tenant': 0}
+        self.errors = []  # row results for the invalid rows
+        self.invalid_lines = set()
+        self.invalid_org_ids = set()  # externalPartnerIds of the invalid org rows
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def validate(path, validator, fmt=None):
+    """Checks every row of the file; makes no upstream call."""
+    fmt = fmt or detect_format(path)
+    validation = Validation()
+    transaction_ids = set()
+    partner_ids = {'org': set(), 'tenant': set()}
+    for line, kind, data, error in read_rows(path, fmt):
+        validation.rows += 1
+        if error is None:
+            if kind not in ('org', 'tenant'):
+                error = f"type must be 'org' or 'tenant', got {kind!r}"
+            else:
+                validation.counts[kind] += 1
+                missing = validator.missing(kind, data)
+                non_scalar = non_scalar_ids(data)
+                if missing:
+                    error = f"Missing required fields: {', '.join(missing)}"
+                elif non_scalar:
+                    error = f"Must be a string or a number: {', '.join(non_scalar)}"
+                elif data['transactionId'] in transaction_ids:
+                    error = f"Duplicate transactionId {data['transactionId']}"
+                elif data['externalPartnerId'] in partner_ids[kind]:
+                    error = f"Duplicate externalPartnerId {data['externalPartnerId']}"
+        if error:
+            validation.errors.append(row_result(line, kind, data, ok=False, status=400, error=error))
+            validation.invalid_lines.add(line)
+            # Unless an accepted row already has the id: that org is still created
+            if (kind == 'org' and data.get('externalPartnerId') and 'externalPartnerId' not in non_scalar_ids(data)
+                    and data['externalPartnerId'] not in partner_ids['org']):
+                validation.invalid_org_ids.add(data['externalPartnerId'])
+            continue
+        transaction_ids.add(data['transactionId'])
+        partner_ids[kind].add(data['externalPartnerId'])
+    return validation
+
+
+class Checkpoint:
+    """Append-only JSONL of finished rows; the succeeded ones are skipped on resume."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for text in f:
+                    try:
+                        result = json.loads(text)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    if result.get('ok') and result.get('transactionId'):
+                        self.done[result['transactionId']] = result
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def record(self, result):
+        with self._lock:
+            self._file.write(json.dumps(result) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def submit_rows(path, submit, validation, fmt=None, checkpoint=None, max_workers=PROVISION_MAX_WORKERS):
+    """Creates the orgs, then the tenants; yields one result per valid row.
+
+    submit(line, kind, data) makes the upstream call and returns a dict with
+    ok and status, plus result or error; it must not raise. Rows that failed
+    validation are not sent.
+    """
+    fmt = fmt or detect_format(path)
+    # An org row's externalPartnerId is what its managed tenants give as
+    # externalOrgId
+    failed_orgs = set(validation.invalid_org_ids)
+
+    def run(row):
+        line, kind, data = row
+        result = row_result(line, kind, data)
+        result.update((key, value) for key, value in submit(line, kind, data).items() if key != 'index')
+        if checkpoint:
+            checkpoint.record(result)
+        return result
+
+    def rows(wanted):
+        for line, kind, data, _ in read_rows(path, fmt):
+            if kind != wanted or line in validation.invalid_lines:
+                continue
+            done = checkpoint.done.get(data['transactionId']) if checkpoint else None
+            if done:
+                yield None, row_result(line, kind, data, ok=True, status=done.get('status'), resumed=True)
+            elif kind == 'tenant' and data.get('externalOrgId') in failed_orgs:
+                yield None, row_result(line, kind, data, ok=False, status=424,
+                                       error=f"Org {data['externalOrgId']} was not created")
+            else:
+                yield (line, kind, data), None
+
+    for kind in ('org', 'tenant'):
+        # Rows settled without a call are passed through in order; the rest
+        # go to the pool
+        settled = []
+
+        def pending():
+            for row, result in rows(kind):
+                if result is None:
+                    yield row
+                else:
+                    settled.append(result)
+
+        for result in run_bounded(run, pending(), max_workers):
+            while settled:
+                yield settled.pop(0)
+            if kind == 'org' and not result['ok']:
+                failed_orgs.add(result['externalPartnerId'])
+            yield result
+        yield from settled
+
+
+def new_summary():
+    return {"total": 0, "succeeded": 0, "failed": 0, "resumed": 0}
+
+
+def count_result(summary, result):
+    summary["total"] += 1
+    summary["succeeded" if result['ok'] else "failed"] += 1
+    summary["resumed"] += bool(result.get('resumed'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="CSV or JSONL of org and tenant rows")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    parser.add_argument("--checkpoint", help="JSONL of finished rows; rerun with the same file to resume")
+    parser.add_argument("--report", help="write the per-row results here (JSONL) instead of stdout")
+    parser.add_argument("--workers", type=int, default=PROVISION_MAX_WORKERS)
+    parser.add_argument("--dry-run", action="store_true", help="validate only")
+    parser.add_argument("--skip-invalid", action="store_true", help="submit the valid rows even if some are invalid")
+    args = parser.parse_args()
+
+    # Imported here so the module itself doesn't depend on the app
+    import app
+    app.configure_logging()
+    fmt = args.format or detect_format(args.file)
+    validation = validate(args.file, app.provisioning_validator, fmt)
+    report = open(args.report, 'w', encoding='utf-8') if args.report else sys.stdout
+    for result in validation.errors:
+        report.write(json.dumps(result) + "\n")
+    print(f"Validated {validation.rows} rows ({validation.counts['org']} orgs, {validation.counts['tenant']} tenants), "
+          f"{len(validation.errors)} invalid", file=sys.stderr)
+    if args.dry_run or (validation.errors and not args.skip_invalid):
+        return 0 if validation.ok else 1
+
+    checkpoint = Checkpoint(args.checkpoint) if args.checkpoint else None
+    summary = new_summary()
+    try:
+        for result in submit_rows(args.file, app.submit_provisioning_row, validation, fmt, checkpoint, args.workers):
+            report.write(json.dumps(result) + "\n")
+            count_result(summary, result)
+    finally:
+        if checkpoint:
+            checkpoint.close()
+    logging.info(f"Provisioning {args.file}: {summary}")
+    print(f"Submitted {summary['total']} rows: {summary['succeeded']} succeeded "
+          f"({summary['resumed']} from the checkpoint), {summary['failed']} failed", file=sys.stderr)
+    return 0 if not summary["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
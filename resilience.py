@@ -0,0 +1,216 @@
+"""Retry, circuit-breaker and rate-limit policy for partner API calls.
+
+UpstreamPolicy is consulted around every attempt. Before: wait for the
+client-side token bucket (and any Retry-After pause), or fail fast while the
+endpoint's circuit is open. After: decide whether the attempt is retried and
+after how long (jittered exponential backoff, Retry-After on 429/503). It
+does no I/O, so the requests-based client and the async ASGI client share it
+and only differ in how they sleep.
+"""
+import email.utils
+import os
+import random
+import threading
+import time
+
+import requests
+
+import metrics
+
+# Retries after the first attempt
+UPSTREAM_MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "2"))
+UPSTREAM_BACKOFF_BASE = float(os.environ.get("UPSTREAM_BACKOFF_BASE", "0.1"))
+UPSTREAM_BACKOFF_MAX = float(os.environ.get("UPSTREAM_BACKOFF_MAX", "2"))
+# A longer Retry-After is returned to the caller instead of waited out
+UPSTREAM_RETRY_AFTER_MAX = float(os.environ.get("UPSTREAM_RETRY_AFTER_MAX", "10"))
+# Consecutive failures (5xx, timeouts, connection errors) that open an
+# endpoint's circuit, and how long it stays open before a probe is let through
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30"))
+# Client-side limit on calls per second per worker process; 0 disables it
+UPSTREAM_RATE_LIMIT = float(os.environ.get("UPSTREAM_RATE_LIMIT", "0"))
+UPSTREAM_RATE_BURST = int(os.environ.get("UPSTREAM_RATE_BURST", "20"))
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+
+def parse_retry_after(value):
+    # Retry-After is either delta-seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate=UPSTREAM_RATE_LIMIT, burst=UPSTREAM_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token; returns how long the caller must wait before using it.
+
+        The balance goes negative rather than making callers poll, so waiting
+        callers are served in the order they arrived.
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self.rate > 0:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = -self._tokens / self.rate
+            return max(delay, self._paused_until - now)
+
+    def pause(self, seconds):
+        # After a 429 nobody in this process calls upstream until Retry-After
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._probing:
+                return False
+            # Half-open: one probe call decides whether to close again
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class UpstreamPolicy:
+    def __init__(self, max_retries=UPSTREAM_MAX_RETRIES, backoff_base=UPSTREAM_BACKOFF_BASE,
+                 backoff_max=UPSTREAM_BACKOFF_MAX, retry_after_max=UPSTREAM_RETRY_AFTER_MAX,
+                 failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 rate_limiter=None, account="default"):
+        self.account = account
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(endpoint, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def before_attempt(self, endpoint):
+        """Returns the seconds to wait before sending; raises CircuitOpenError."""
+        if not self.breaker(endpoint).allow():
+            metrics.UPSTREAM_CIRCUIT_REJECTIONS.inc(endpoint, self.account)
+            raise CircuitOpenError(f"Partner API circuit open for {endpoint}, failing fast")
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            metrics.UPSTREAM_THROTTLE_WAIT.inc(endpoint, self.account, amount=delay)
+        return delay
+
+    def after_attempt(self, endpoint, method, attempt, status=None, retry_after=None, error=None,
+                      safe_to_resend=False):
+        """Record the outcome of an attempt and decide on a retry.
+
+        Pass the response status (and Retry-After header) or the exception;
+        safe_to_resend marks errors where the request never reached the
+        server (connect failures), which are retried for any method.
+        Returns the delay before the next attempt, or None to give up.
+        """
+        breaker = self.breaker(endpoint)
+        if error is not None or status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+
+        if attempt >= self.max_retries or breaker.opened_at is not None:
+            return None
+
+        if error is not None:
+            if not (safe_to_resend or method in IDEMPOTENT_METHODS):
+                return None
+            reason = type(error).__name__
+            delay = self.backoff(attempt)
+        elif status in RETRY_STATUSES and (status == 429 or method in IDEMPOTENT_METHODS):
+            # A 429 was rejected before being processed, so it is safe to
+            # resend whatever the method
+            reason = str(status)
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = self.backoff(attempt)
+            elif delay > self.retry_after_max:
+                return None
+            if status == 429:
+                self.rate_limiter.pause(delay)
+        else:
+            return None
+
+        metrics.UPSTREAM_RETRIES.inc(endpoint, reason, self.account)
+        return delay
+
+    def backoff(self, attempt):
+        # Full jitter keeps retrying workers from arriving in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            "circuits": {
+                endpoint: {"state": breaker.state, "failures": breaker.failures}
+                for endpoint, breaker in sorted(breakers.items())
+            },
+            "max_retries": self.max_retries,
+            "rate_limit": self.rate_limiter.rate
+        }
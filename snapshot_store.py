@@ -0,0 +1,186 @@
+"""SQLite store of the last-known partner data, for fast cold starts.
+
+Tenants, orgs, tenant data bundles and org membership are written as the
+proxy receives them from upstream, one transaction per page or response. At
+startup the app reads them back, so the dashboard can be served (marked
+stale) while the first refresh runs. Tenants can be queried by
+externalPartnerId, guid, state and orgId, each backed by an index.
+
+With SNAPSHOT_DB unset the store is an in-memory database: queries still
+work but nothing survives a restart. Every worker process opens its own
+connection; SQLite's file locking serialises writers sharing one file.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SNAPSHOT_DB = os.environ.get("SNAPSHOT_DB", ":memory:")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tenants (
+    external_partner_id TEXT PRIMARY KEY,
+    guid TEXT,
+    state TEXT,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    seen_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tenants_guid ON tenants (guid);
+CREATE INDEX IF NOT EXISTS tenants_state ON tenants (state);
+CREATE TABLE IF NOT EXISTS orgs (
+    external_org_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    external_partner_id TEXT PRIMARY KEY,
+    org_id TEXT NOT NULL,
+    org_name TEXT
+);
+CREATE INDEX IF NOT EXISTS memberships_org_id ON memberships (org_id);
+CREATE TABLE IF NOT EXISTS data_bundles (
+    external_partner_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+class SnapshotStore:
+    def __init__(self, path=SNAPSHOT_DB):
+        self.path = path
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        # One connection per process, opened lazily (sqlite connections must
+        # not cross a fork); calls are serialised by self._lock
+        pid = os.getpid()
+        if self._conn is None or self._conn_pid != pid:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            if self.path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+            self._conn_pid = pid
+        return self._conn
+
+    def _write(self, statements):
+        # statements: [(sql, params or [params, ...])], run as one transaction
+        with self._lock:
+            conn = self.conn
+            with conn:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        conn.executemany(sql, params)
+                    else:
+                        conn.execute(sql, params)
+
+    def _read(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def put_tenants(self, tenants, position=0):
+        # One page of the tenants listing, position is its offset
+        now = time.time()
+        self._write([(
+            "INSERT OR REPLACE INTO tenants (external_partner_id, guid, state, position, data, seen_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(tenant['externalPartnerId'], tenant.get('guid'), tenant.get('state'), position + i,
+              json.dumps(tenant), now) for i, tenant in enumerate(tenants)]
+        )])
+
+    def finish_tenant_sync(self, started_at):
+        # After a complete listing: anything not seen since it started is gone
+        self._write([
+            ("DELETE FROM tenants WHERE seen_at < ?", (started_at,)),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('tenants_synced_at', ?)", (time.time(),))
+        ])
+
+    def put_orgs(self, orgs):
+        self._write([
+            ("DELETE FROM orgs", ()),
+            ("INSERT OR REPLACE INTO orgs (external_org_id, position, data) VALUES (?, ?, ?)",
+             [(org['externalOrgId'], i, json.dumps(org)) for i, org in enumerate(orgs)])
+        ])
+
+    def put_memberships(self, members, updated_at):
+        # members: tenant_id -> {'orgId', 'orgName'}, as in MembershipIndex
+        self._write([
+            ("DELETE FROM memberships", ()),
+            ("INSERT INTO memberships (external_partner_id, org_id, org_name) VALUES (?, ?, ?)",
+             [(tenant_id, member['orgId'], member.get('orgName')) for tenant_id, member in members.items()]),
+            ("INSERT OR REPLACE INTO meta (key, value) VALUES ('membership_updated_at', ?)", (updated_at,))
+        ])
+
+    def put_membership(self, tenant_id, org_id, org_name=None):
+        self._write([(
+            "INSERT OR REPLACE INTO memberships (external_partner_id, org_id, org_name) VALUES (?, ?, ?)",
+            (tenant_id, org_id, org_name)
+        )])
+
+    def put_data_bundle(self, tenant_id, body):
+        # body is the upstream JSON as received, stored without re-encoding
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        self._write([(
+            "INSERT OR REPLACE INTO data_bundles (external_partner_id, data, seen_at) VALUES (?, ?, ?)",
+            (tenant_id, body, time.time())
+        )])
+
+    def get_data_bundle(self, tenant_id):
+        # Returns (JSON body, seen_at) or None
+        rows = self._read("SELECT data, seen_at FROM data_bundles WHERE external_partner_id = ?", (tenant_id,))
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    def meta(self, key):
+        rows = self._read("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def load_tenants(self):
+        return [json.loads(data) for data, in self._read("SELECT data FROM tenants ORDER BY position")]
+
+    def load_orgs(self):
+        return [json.loads(data) for data, in self._read("SELECT data FROM orgs ORDER BY position")]
+
+    def load_memberships(self):
+        # Returns (members, updated_at) in MembershipIndex's shape
+        members = {
+            tenant_id: {'managed': True, 'orgId': org_id, 'orgName': org_name or org_id}
+            for tenant_id, org_id, org_name in self._read(
+                "SELECT external_partner_id, org_id, org_name FROM memberships")
+        }
+        return members, self.meta('membership_updated_at')
+
+    def query_tenants(self, external_partner_id=None, guid=None, state=None, org_id=None, limit=100, offset=0):
+        """Tenants matching every given filter, annotated like annotate_tenants."""
+        clauses = []
+        params = []
+        for column, value in (("t.external_partner_id", external_partner_id), ("t.guid", guid),
+                              ("t.state", state), ("m.org_id", org_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = ("SELECT t.data, m.org_id, m.org_name FROM tenants t "
+               "LEFT JOIN memberships m ON m.external_partner_id = t.external_partner_id")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY t.position LIMIT ? OFFSET ?"
+
+        tenants = []
+        for data, member_org_id, org_name in self._read(sql, params + [limit, offset]):
+            tenant = json.loads(data)
+            tenant['managed'] = member_org_id is not None
+            tenant['orgId'] = member_org_id or ''
+            tenant['orgName'] = (org_name or member_org_id) if member_org_id else '-'
+            tenants.append(tenant)
+        return tenants
@@ -0,0 +1,138 @@
+"""In-memory search, filter and sort over the dashboard's tenant list.
+
+Built from a dashboard snapshot, never from upstream. Name and
+externalPartnerId are each kept as one lowercased, NUL-separated string,
+so a substring or prefix match is a str.find scan in C plus a bisect to
+map hits back to tenants. state, SKU and org filters are sets of tenant
+positions, and each sort key has a presorted order. An index is immutable
+and swapped whole when the snapshot version changes.
+"""
+import threading
+from bisect import bisect_right
+
+SEARCH_FIELDS = ('name', 'externalPartnerId')
+SORT_KEYS = {
+    'name': lambda tenant: (tenant.get('name') or '').lower(),
+    'billingDate': lambda tenant: tenant.get('billingDate') or '',
+    'licenseUsage': lambda tenant: tenant.get('licenseUsage') or 0
+}
+
+
+class TextColumn:
+    def __init__(self, values):
+        # "\0a\0b\0c": every value starts right after a NUL
+        self.starts = []
+        parts = []
+        offset = 1
+        for value in values:
+            self.starts.append(offset)
+            value = (value or '').lower().replace('\0', '')
+            parts.append(value)
+            offset += len(value) + 1
+        self.text = '\0' + '\0'.join(parts)
+
+    def find(self, query, prefix=False):
+        # Positions of the values containing (or starting with) query
+        query = query.replace('\0', '')
+        needle = ('\0' + query) if prefix else query
+        # A prefix hit starts on the NUL just before its value
+        shift = 1 if prefix else 0
+        matches = set()
+        text = self.text
+        starts = self.starts
+        position = text.find(needle)
+        while position != -1:
+            doc = bisect_right(starts, position + shift) - 1
+            matches.add(doc)
+            if doc + 1 == len(starts):
+                break
+            # Skip the rest of this value, one hit per tenant is enough
+            position = text.find(needle, starts[doc + 1] - shift)
+        return matches
+
+
+class TenantSearchIndex:
+    def __init__(self, tenants, version=None):
+        self.version = version
+        self.tenants = tenants
+        self.columns = {field: TextColumn(tenant.get(field) for tenant in tenants) for field in SEARCH_FIELDS}
+        self.by_state = {}
+        self.by_sku = {}
+        self.by_org = {}
+        self.managed = set()
+        for doc, tenant in enumerate(tenants):
+            self.by_state.setdefault(tenant.get('state'), set()).add(doc)
+            for sku in tenant.get('skus') or ():
+                self.by_sku.setdefault(sku, set()).add(doc)
+            if tenant.get('orgId'):
+                self.managed.add(doc)
+                self.by_org.setdefault(tenant['orgId'], set()).add(doc)
+        self.standalone = set(range(len(tenants))) - self.managed
+        self.sorted = {key: sorted(range(len(tenants)), key=lambda doc: sort_key(tenants[doc]))
+                       for key, sort_key in SORT_KEYS.items()}
+        self.ranks = {}
+        for key, order in self.sorted.items():
+            ranks = [0] * len(order)
+            for rank, doc in enumerate(order):
+                ranks[doc] = rank
+            self.ranks[key] = ranks
+
+    def search(self, q=None, fields=SEARCH_FIELDS, prefix=False, states=(), skus=(), managed=None, org_id=None,
+               sort=None, descending=False, offset=0, limit=50):
+        """Returns (total, tenants) for one page of matches.
+
+        q matches case-insensitively in any of fields; states and skus match
+        any of the given values; all the filters given must hold. Without
+        sort, tenants keep the upstream listing order.
+        """
+        sets = []
+        if q:
+            query = q.lower()
+            sets.append(set().union(*(self.columns[field].find(query, prefix) for field in fields)))
+        if states:
+            sets.append(set().union(*(self.by_state.get(state, ()) for state in states)))
+        if skus:
+            sets.append(set().union(*(self.by_sku.get(sku, ()) for sku in skus)))
+        if org_id:
+            sets.append(self.by_org.get(org_id, set()))
+        if managed is not None:
+            sets.append(self.managed if managed else self.standalone)
+
+        if sets:
+            sets.sort(key=len)
+            matches = sets[0].intersection(*sets[1:])
+        else:
+            matches = None
+
+        total = len(self.tenants) if matches is None else len(matches)
+        order = self.order(matches, sort)
+        if descending:
+            order = order[::-1]
+        return total, [self.tenants[doc] for doc in order[offset:offset + limit]]
+
+    def order(self, matches, sort):
+        if matches is None:
+            return self.sorted[sort] if sort else range(len(self.tenants))
+        if not sort:
+            return sorted(matches)
+        # Walking the presorted list beats sorting once most tenants match
+        if len(matches) * 8 > len(self.tenants):
+            return [doc for doc in self.sorted[sort] if doc in matches]
+        return sorted(matches, key=self.ranks[sort].__getitem__)
+
+
+class TenantSearch:
+    """Holds the index for the newest dashboard snapshot seen."""
+
+    def __init__(self):
+        self.index = TenantSearchIndex([])
+        self._lock = threading.Lock()
+
+    def for_snapshot(self, snapshot):
+        index = self.index
+        if index.version == snapshot.version:
+            return index
+        with self._lock:
+            if self.index.version != snapshot.version:
+                self.index = TenantSearchIndex([tenant for tenant, _ in snapshot.tenants], snapshot.version)
+            return self.index
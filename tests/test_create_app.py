@@ -0,0 +1,42 @@
+import logging
+import sys
+
+import pytest
+
+import app as sync_app
+import payloads
+
+
+@pytest.fixture
+def restore_settings():
+    modules = [module for module in map(sys.modules.get, sync_app.SETTING_MODULES + ("app",)) if module]
+    saved = [(module, name, getattr(module, name)) for module in modules
+             for name in sync_app.CONFIG_SETTINGS if hasattr(module, name)]
+    level = logging.getLogger().level
+    yield
+    for module, name, value in saved:
+        setattr(module, name, value)
+    logging.getLogger().setLevel(level)
+
+
+def test_log_level_override_reaches_the_root_logger(restore_settings):
+    logging.basicConfig(level=logging.INFO)
+    sync_app.create_app({"LOG_LEVEL": "DEBUG"})
+    assert logging.getLogger().level == logging.DEBUG
+
+
+def test_settings_from_other_modules_are_changed_there_too(restore_settings):
+    sync_app.create_app({"COMPRESS_RESPONSES": False, "DASHBOARD_RENDER": "server"})
+    assert sync_app.COMPRESS_RESPONSES is False
+    assert payloads.COMPRESS_RESPONSES is False
+    assert sync_app.DASHBOARD_RENDER == "server"
+
+
+def test_flask_keys_go_to_app_config(restore_settings):
+    assert sync_app.create_app({"TESTING": True}).config["TESTING"] is True
+
+
+@pytest.mark.parametrize("name", ["JOBS_DB", "UPSTREAM_POOL_SIZE", "NO_SUCH_SETTING"])
+def test_settings_read_at_import_are_rejected(restore_settings, name):
+    with pytest.raises(ValueError, match=name):
+        sync_app.create_app({name: "1"})
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from dashboard import DashboardState
+
+
+def tenant(tenant_id, **fields):
+    return dict({"externalPartnerId": tenant_id, "name": tenant_id}, **fields)
+
+
+class SlowBuild:
+    """A build() that counts its calls and blocks until released."""
+
+    def __init__(self, tenants, error=None):
+        self.tenants = tenants
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.tenants, [], {}
+
+
+def in_thread(fn, results):
+    thread = threading.Thread(target=lambda: results.append(fn()))
+    thread.start()
+    return thread
+
+
+def test_peek_does_not_wait_for_a_rebuild():
+    state = DashboardState(ttl=60)
+    first = state.get(lambda: ([tenant("a")], [], {}), generation=1)
+    build = SlowBuild([tenant("a"), tenant("b")])
+    results = []
+    thread = in_thread(lambda: state.get(build, generation=2), results)
+    assert build.started.wait(5)
+
+    started = time.monotonic()
+    assert state.peek(build, generation=2) is first
+    assert time.monotonic() - started < 0.5
+
+    build.release.set()
+    thread.join()
+    assert build.calls == 1
+    assert len(results[0].tenants) == 2
+
+
+def test_concurrent_gets_share_one_build():
+    state = DashboardState(ttl=60)
+    build = SlowBuild([tenant("a")])
+    results = []
+    threads = [in_thread(lambda: state.get(build), results) for _ in range(5)]
+    assert build.started.wait(5)
+    build.release.set()
+    for thread in threads:
+        thread.join()
+    assert build.calls == 1
+    assert len({id(snapshot) for snapshot in results}) == 1
+
+
+def test_build_error_reaches_every_waiter_and_the_next_call_retries():
+    state = DashboardState(ttl=60)
+    build = SlowBuild([], error=ValueError("upstream down"))
+    errors = []
+
+    def call():
+        try:
+            state.get(build)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert build.started.wait(5)
+    build.release.set()
+    for thread in threads:
+        thread.join()
+    assert build.calls == 1 and len(errors) == 3
+    assert state.get(lambda: ([tenant("a")], [], {})).tenants
+
+
+def test_seeded_snapshot_is_served_while_the_first_build_runs():
+    state = DashboardState(ttl=60)
+    state.seed([tenant("a")], [], {"stale": True})
+    build = SlowBuild([tenant("a"), tenant("b")])
+    seeded = state.get(build)
+    assert len(seeded.tenants) == 1
+    assert build.started.wait(5)
+    # Only one background build, however many readers arrive
+    assert state.peek(build) is seeded
+    build.release.set()
+    for _ in range(100):
+        if not state.stale:
+            break
+        time.sleep(0.01)
+    assert build.calls == 1
+    assert len(state.get(build).tenants) == 2
+
+
+def test_delta_after_a_rebuild_has_only_the_changed_tenant():
+    state = DashboardState(ttl=0)
+    before = state.get(lambda: ([tenant("a"), tenant("b")], [], {}))
+    time.sleep(0.002)
+    after = state.get(lambda: ([tenant("a"), tenant("b", name="renamed")], [], {}))
+    assert after.version > before.version
+    body, _ = after.delta(before.version)
+    assert b'"renamed"' in body
+    assert b'"externalPartnerId":"a"' not in body
@@ -0,0 +1,109 @@
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+from jobs import JobQueue
+from resilience import CircuitOpenError
+from upstream import request_not_sent
+
+
+class ScriptedHandler:
+    """Returns the given outcomes in turn (raising the exceptions), counting calls."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, payload):
+        outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+        self.calls += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def wait_finished(queue, job_id):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['state'] not in ('queued', 'running'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def submit_and_wait(queue, key="tx-1"):
+    job, _ = queue.submit("order", {"transactionId": key}, key=key)
+    return wait_finished(queue, job['id'])
+
+
+@pytest.mark.parametrize("outcome", [
+    {"ok": False, "status": 502, "error": "Read timed out"},
+    {"ok": False, "status": 503, "error": "503 Server Error"},
+    {"ok": False, "status": None, "error": "no status"},
+    RuntimeError("handler crashed"),
+])
+def test_unknown_outcome_is_not_run_again(outcome):
+    handler = ScriptedHandler(outcome, {"ok": True, "status": 200, "result": {}})
+    queue = JobQueue({"order": handler}, path=":memory:")
+    assert submit_and_wait(queue)['state'] == 'unknown'
+    job, created = queue.submit("order", {"transactionId": "tx-1"}, key="tx-1")
+    assert not created
+    assert job['state'] == 'unknown'
+    time.sleep(0.1)
+    assert handler.calls == 1
+
+
+@pytest.mark.parametrize("outcome", [
+    {"ok": False, "status": 400, "error": "400 Client Error"},
+    {"ok": False, "status": 429, "error": "429 Too Many Requests"},
+    {"ok": False, "status": 502, "error": "Connection refused", "sent": False},
+])
+def test_rejected_job_is_run_again(outcome):
+    handler = ScriptedHandler(outcome, {"ok": True, "status": 200, "result": {"id": 1}})
+    queue = JobQueue({"order": handler}, path=":memory:")
+    assert submit_and_wait(queue)['state'] == 'failed'
+    job, created = queue.submit("order", {"transactionId": "tx-1"}, key="tx-1")
+    assert created
+    job = wait_finished(queue, job['id'])
+    assert job['state'] == 'succeeded'
+    assert job['result'] == {"id": 1}
+    assert handler.calls == 2
+
+
+def test_resume_marks_interrupted_jobs_unknown(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    handler = ScriptedHandler({"ok": True, "status": 200, "result": {}})
+    queue = JobQueue({"order": handler}, path=path)
+    job, _ = queue.submit("order", {"transactionId": "tx-1"}, key="tx-1")
+    wait_finished(queue, job['id'])
+    # As if a worker process on this host had died during the call
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    queue._execute("UPDATE jobs SET state = 'running', owner = ?, finished_at = NULL WHERE id = ?",
+                   (f"{socket.gethostname()}:{dead.pid}", job['id']))
+
+    restarted = JobQueue({"order": handler}, path=path)
+    assert restarted.resume() == 1
+    assert restarted.get(job['id'])['state'] == 'unknown'
+    job, created = restarted.submit("order", {"transactionId": "tx-1"}, key="tx-1")
+    assert not created
+    assert handler.calls == 1
+
+
+def test_request_not_sent():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+    # Nothing listens on the port any more
+    with pytest.raises(requests.exceptions.ConnectionError) as refused:
+        requests.get(f"http://127.0.0.1:{port}/", timeout=2)
+    assert request_not_sent(refused.value)
+    assert request_not_sent(requests.exceptions.ConnectTimeout("connect timed out"))
+    assert request_not_sent(CircuitOpenError("circuit open"))
+    assert not request_not_sent(requests.exceptions.ReadTimeout("read timed out"))
+    assert not request_not_sent(requests.exceptions.ConnectionError("Connection aborted"))
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from key_inventory import ExportState, StateLocked, export_keys, new_export_summary
+
+
+def run_export(state, entity_ids):
+    summary = new_export_summary()
+    entities = [("tenant", entity_id, entity_id, {"id": entity_id}) for entity_id in entity_ids]
+    results = list(export_keys(iter(entities), lambda kind, entity_id: ([], None), summary, state, max_workers=2))
+    return results, summary
+
+
+def test_state_is_locked_until_closed(tmp_path):
+    path = str(tmp_path / "keys.state")
+    state = ExportState(path)
+    with pytest.raises(StateLocked):
+        ExportState(path)
+    state.close()
+    state.close()
+    ExportState(path).close()
+
+
+def test_state_is_locked_across_processes(tmp_path):
+    path = str(tmp_path / "keys.state")
+    child = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {sys.path[0]!r})
+        from key_inventory import ExportState, StateLocked
+        try:
+            ExportState({path!r})
+        except StateLocked:
+            sys.exit(3)
+    """)
+    state = ExportState(path)
+    try:
+        assert subprocess.run([sys.executable, "-c", child]).returncode == 3
+    finally:
+        state.close()
+    assert subprocess.run([sys.executable, "-c", child]).returncode == 0
+
+
+def test_sweep_removes_only_entities_gone_from_the_listing(tmp_path):
+    path = str(tmp_path / "keys.state")
+    state = ExportState(path)
+    run_export(state, ["a", "b", "c"])
+    state.close()
+
+    state = ExportState(path)
+    results, summary = run_export(state, ["a", "b"])
+    state.close()
+    assert summary["removed"] == 1
+    assert {"entityType": "tenant", "entityId": "c", "removed": True} in results
@@ -0,0 +1,60 @@
+import json
+
+from provisioning import RowValidator, submit_rows, validate
+
+validator = RowValidator(("transactionId", "externalPartnerId", "name"), ("transactionId", "externalPartnerId"))
+
+
+def write_rows(tmp_path, rows):
+    path = tmp_path / "rows.jsonl"
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+    return str(path)
+
+
+def test_non_scalar_ids_are_row_errors(tmp_path):
+    path = write_rows(tmp_path, [
+        {"type": "org", "transactionId": ["tx-1"], "externalPartnerId": "org-1", "name": "a"},
+        {"type": "org", "transactionId": "tx-2", "externalPartnerId": {"id": "org-2"}, "name": "b"},
+        {"type": "tenant", "transactionId": "tx-3", "externalPartnerId": "t-3", "managed": True,
+         "externalOrgId": ["org-1"]},
+        {"type": "tenant", "transactionId": 4, "externalPartnerId": "t-4"},
+    ])
+    validation = validate(path, validator)
+    assert validation.rows == 4
+    assert [(error["line"], error["status"], error["error"]) for error in validation.errors] == [
+        (1, 400, "Must be a string or a number: transactionId"),
+        (2, 400, "Must be a string or a number: externalPartnerId"),
+        (3, 400, "Must be a string or a number: externalOrgId"),
+    ]
+    assert validation.invalid_lines == {1, 2, 3}
+    assert validation.invalid_org_ids == {"org-1"}
+
+
+def test_duplicate_ids(tmp_path):
+    path = write_rows(tmp_path, [
+        {"type": "org", "transactionId": "tx-1", "externalPartnerId": "org-1", "name": "a"},
+        {"type": "org", "transactionId": "tx-1", "externalPartnerId": "org-2", "name": "b"},
+        {"type": "tenant", "transactionId": "tx-3", "externalPartnerId": "org-1"},
+        {"type": "tenant", "transactionId": "tx-4", "externalPartnerId": "org-1"},
+    ])
+    validation = validate(path, validator)
+    assert [error["error"] for error in validation.errors] == [
+        "Duplicate transactionId tx-1",
+        "Duplicate externalPartnerId org-1",
+    ]
+
+
+def test_duplicate_org_row_does_not_fail_the_accepted_org(tmp_path):
+    path = write_rows(tmp_path, [
+        {"type": "org", "transactionId": "tx-1", "externalPartnerId": "org-1", "name": "a"},
+        {"type": "org", "transactionId": "tx-2", "externalPartnerId": "org-1", "name": "b"},
+        {"type": "org", "transactionId": "tx-1", "externalPartnerId": "org-1", "name": "c"},
+        {"type": "tenant", "transactionId": "tx-3", "externalPartnerId": "t-3", "managed": True,
+         "externalOrgId": "org-1"},
+    ])
+    validation = validate(path, validator)
+    assert [error["line"] for error in validation.errors] == [2, 3]
+    assert validation.invalid_org_ids == set()
+    submit = lambda line, kind, data: {"ok": True, "status": 201}
+    results = list(submit_rows(path, submit, validation, max_workers=1))
+    assert [(result["transactionId"], result["status"]) for result in results] == [("tx-1", 201), ("tx-3", 201)]
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from token_manager import FileTokenBackend, TokenManager
+
+
+class FakeResponse:
+    def __init__(self, payload, status=200):
+        self.payload = payload
+        self.status_code = status
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+    def json(self):
+        return self.payload
+
+
+class FakeTokenClient:
+    """Stands in for UpstreamClient: counts token calls, optionally slowly."""
+
+    def __init__(self, expires_in=3600, delay=0.0, status=200):
+        self.expires_in = expires_in
+        self.delay = delay
+        self.status = status
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None):
+        with self._lock:
+            self.calls += 1
+            number = self.calls
+        time.sleep(self.delay)
+        return FakeResponse({"access_token": f"token-{number}", "expires_in": self.expires_in}, self.status)
+
+
+def manager(client, **kwargs):
+    kwargs.setdefault("background_refresh", False)
+    return TokenManager("http://token.test/oauth2/token", "key", client, **kwargs)
+
+
+def test_concurrent_callers_share_one_fetch():
+    client = FakeTokenClient(delay=0.2)
+    tokens = manager(client)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(tokens.get_token())) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.calls == 1
+    assert results == ["token-1"] * 20
+
+
+def test_cached_token_is_reused():
+    client = FakeTokenClient()
+    tokens = manager(client)
+    assert tokens.get_token() == tokens.get_token() == "token-1"
+    assert client.calls == 1
+
+
+def test_fetch_error_reaches_every_waiter():
+    client = FakeTokenClient(delay=0.1, status=503)
+    tokens = manager(client)
+    errors = []
+
+    def call():
+        try:
+            tokens.get_token()
+        except requests.exceptions.RequestException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.calls == 1
+    assert len(errors) == 5
+
+
+def test_short_lived_token_is_fresh_for_half_its_lifetime():
+    # expires_in below the refresh margin: refreshed halfway, not at once
+    client = FakeTokenClient(expires_in=60)
+    tokens = manager(client, refresh_margin=120)
+    tokens.get_token()
+    assert tokens.refresh()["access_token"] == "token-1"
+    assert client.calls == 1
+    tokens.refresh(force=True)
+    assert client.calls == 1
+
+
+def test_background_refresher_does_not_spin_on_short_lived_tokens():
+    client = FakeTokenClient(expires_in=60)
+    tokens = manager(client, refresh_margin=120, background_refresh=True)
+    tokens.get_token()
+    time.sleep(0.5)
+    assert client.calls == 1
+
+
+def test_background_refresher_waits_between_refreshes():
+    # A token that is always due (already expired when it arrives)
+    client = FakeTokenClient(expires_in=0)
+    tokens = manager(client, background_refresh=True, min_refresh_interval=0.2)
+    tokens._ensure_refresher()
+    time.sleep(0.5)
+    assert 1 <= client.calls <= 4
+
+
+def test_file_backend_shares_the_token_between_managers(tmp_path):
+    path = str(tmp_path / "token.json")
+    client = FakeTokenClient()
+    first = manager(client, backend=FileTokenBackend(path))
+    second = manager(client, backend=FileTokenBackend(path))
+    assert first.get_token() == "token-1"
+    assert second.get_token() == "token-1"
+    assert client.calls == 1
+    with open(path) as f:
+        assert json.load(f)["access_token"] == "token-1"
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_file_backend_forced_refresh_skips_a_token_another_worker_just_fetched(tmp_path):
+    path = str(tmp_path / "token.json")
+    client = FakeTokenClient()
+    first = manager(client, backend=FileTokenBackend(path))
+    second = manager(client, backend=FileTokenBackend(path))
+    first.get_token()
+    # Still fresh in the shared file, so neither refresh calls the endpoint
+    second.refresh(force=True)
+    first.refresh()
+    assert client.calls == 1
+
+
+def test_file_backend_ignores_a_corrupt_file(tmp_path):
+    path = tmp_path / "token.json"
+    path.write_text("{not json")
+    client = FakeTokenClient()
+    tokens = manager(client, backend=FileTokenBackend(str(path)))
+    assert tokens.get_token() == "token-1"
+    assert json.loads(path.read_text())["access_token"] == "token-1"
+
+
+@pytest.mark.parametrize("expires_in", [0, 1])
+def test_expired_token_is_fetched_again(expires_in):
+    client = FakeTokenClient(expires_in=expires_in)
+    tokens = manager(client)
+    tokens.get_token()
+    time.sleep(expires_in + 0.01)
+    tokens.get_token()
+    assert client.calls == 2
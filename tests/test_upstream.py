@@ -0,0 +1,51 @@
+import socket
+
+import pytest
+import requests
+
+from resilience import TokenBucket, UpstreamPolicy
+from upstream import UpstreamClient
+
+
+def closed_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def client_for(base_url, max_retries=2):
+    policy = UpstreamPolicy(max_retries=max_retries, backoff_base=0, backoff_max=0, failure_threshold=100,
+                            rate_limiter=TokenBucket(0))
+    return UpstreamClient(base_url, policy=policy)
+
+
+def count_attempts(client):
+    attempts = []
+    send = client.session.request
+
+    def counting(*args, **kwargs):
+        attempts.append(args[0])
+        return send(*args, **kwargs)
+    client.session.request = counting
+    return attempts
+
+
+def test_refused_post_is_retried():
+    client = client_for(f"http://127.0.0.1:{closed_port()}")
+    attempts = count_attempts(client)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.post("/api/partners/v1/orders", json={})
+    assert attempts == ["POST"] * 3
+
+
+def test_post_that_may_have_been_sent_is_not_retried():
+    # Accepts the connection, then drops it without answering
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        client = client_for(f"http://127.0.0.1:{listener.getsockname()[1]}")
+        client.timeout = (1, 0.2)
+        attempts = count_attempts(client)
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            client.post("/api/partners/v1/orders", json={})
+    assert attempts == ["POST"]
@@ -0,0 +1,269 @@
+"""OAuth token cache for the partner API.
+
+TokenManager hands out the current access token, coalesces concurrent
+refreshes into a single call to the token endpoint and refreshes in the
+background shortly before expiry. With FileTokenBackend the token is shared
+by every worker process on the host (point it at /dev/shm to keep it in
+shared memory).
+"""
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; fall back to in-process locking
+    fcntl = None
+
+import requests
+
+import metrics
+
+# Refresh this many seconds before expires_at, or halfway through the
+# token's lifetime if that comes later
+TOKEN_REFRESH_MARGIN = int(os.environ.get("TOKEN_REFRESH_MARGIN", "120"))
+# The background refresher waits at least this long after a refresh
+TOKEN_REFRESH_MIN_INTERVAL = float(os.environ.get("TOKEN_REFRESH_MIN_INTERVAL", "5"))
+# Optional shared cache file, e.g. /dev/shm/papi-token.json
+TOKEN_CACHE_FILE = os.environ.get("TOKEN_CACHE_FILE")
+
+
+class MemoryTokenBackend:
+    def __init__(self):
+        self._token = None
+
+    def load(self):
+        return self._token
+
+    def store(self, token):
+        self._token = token
+
+    def locked(self):
+        # Nothing outside this process to coordinate with
+        return _NullLock()
+
+
+class FileTokenBackend:
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, token):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(token, f)
+            os.chmod(tmp_path, 0o600)
+            # Readers only ever see a complete file
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def locked(self):
+        return _FileLock(self.lock_path)
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _FileLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        return False
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.token = None
+        self.error = None
+
+
+class TokenManager:
+    def __init__(self, token_url, partner_key, client, backend=None,
+                 refresh_margin=TOKEN_REFRESH_MARGIN, background_refresh=True, account="default",
+                 min_refresh_interval=TOKEN_REFRESH_MIN_INTERVAL):
+        self.token_url = token_url
+        self.partner_key = partner_key
+        self.client = client
+        self.backend = backend or MemoryTokenBackend()
+        self.refresh_margin = refresh_margin
+        self.min_refresh_interval = min_refresh_interval
+        self.background_refresh = background_refresh
+        self.refresh_count = 0
+        self.account = account
+        self._token = None
+        self._lock = threading.Lock()
+        self._flight = None
+        self._refresher_pid = None
+
+    def get_token(self):
+        """Return a valid access token, fetching one only if none is cached.
+
+        Raises requests.exceptions.RequestException if the token endpoint
+        fails and there is no usable token.
+        """
+        self._ensure_refresher()
+        token = self._token
+        if self._is_valid(token):
+            return token["access_token"]
+
+        # Another worker may already have refreshed the shared copy
+        token = self.backend.load()
+        if self._is_valid(token):
+            self._token = token
+            return token["access_token"]
+
+        return self.refresh()["access_token"]
+
+    def peek(self):
+        # Cached token without any I/O or waiting, or None; lets async
+        # callers skip a thread hop on the common path
+        token = self._token
+        if self._is_valid(token):
+            return token["access_token"]
+        return None
+
+    def refresh(self, force=False):
+        # Single flight: the first caller fetches, everyone else waits on it
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if leader:
+            try:
+                flight.token = self._refresh_shared(force)
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._flight = None
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.token
+
+    def _refresh_shared(self, force):
+        with self.backend.locked():
+            # Re-check under the cross-process lock so only one worker calls
+            # the token endpoint per expiry
+            token = self.backend.load()
+            if self._is_fresh(token) or (not force and self._is_valid(token)):
+                self._token = token
+                return token
+
+            token = self._fetch(token or self._token)
+            self.backend.store(token)
+            self._token = token
+            return token
+
+    def _fetch(self, previous):
+        headers = {
+            "Accept": "application/json",
+            "Authorization": f"Bearer {self.partner_key}"
+        }
+        refresh_token = previous.get("refresh_token") if previous else None
+        if refresh_token:
+            try:
+                return self._request_token({"grant_type": "refresh_token", "refresh_token": refresh_token}, headers, previous)
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Refresh token rejected, requesting a new token: {str(e)}")
+        return self._request_token({"grant_type": "client_credentials"}, headers, previous)
+
+    def _request_token(self, data, headers, previous):
+        issued_at = time.time()
+        try:
+            response = self.client.post(self.token_url, data=data, headers=headers)
+            response.raise_for_status()
+            new_token_data = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            metrics.TOKEN_REFRESHES.inc(data["grant_type"], "error", self.account)
+            raise
+        metrics.TOKEN_REFRESHES.inc(data["grant_type"], "ok", self.account)
+        self.refresh_count += 1
+        return {
+            "access_token": new_token_data.get("access_token"),
+            # Keep the old refresh token if the endpoint doesn't rotate it
+            "refresh_token": new_token_data.get("refresh_token") or (previous or {}).get("refresh_token"),
+            "issued_at": issued_at,
+            "expires_at": issued_at + new_token_data.get("expires_in", 3600)
+        }
+
+    def _is_valid(self, token):
+        return bool(token and token.get("access_token") and time.time() < token.get("expires_at", 0))
+
+    def _is_fresh(self, token):
+        # Valid and not yet inside the proactive refresh window
+        return self._is_valid(token) and time.time() < self._refresh_at(token)
+
+    def _refresh_at(self, token):
+        # A token living shorter than twice the margin is refreshed halfway
+        # through instead, so it isn't due again the moment it arrives
+        margin = self.refresh_margin
+        if token.get("issued_at"):
+            margin = min(margin, (token["expires_at"] - token["issued_at"]) / 2)
+        return token["expires_at"] - margin
+
+    def _ensure_refresher(self):
+        # Threads don't survive fork, so start one per worker process
+        if not self.background_refresh or self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+            threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True).start()
+
+    def _refresh_loop(self):
+        failures = 0
+        while True:
+            token = self._token or self.backend.load()
+            if token and token.get("expires_at"):
+                # Jitter spreads the wake-ups of workers sharing one token
+                wait = self._refresh_at(token) - time.time() + random.uniform(0, 5)
+                if wait > 0:
+                    time.sleep(min(wait, 300))
+                    continue
+            try:
+                self.refresh(force=True)
+                failures = 0
+                time.sleep(self.min_refresh_interval)
+            except Exception as e:
+                failures += 1
+                logging.error(f"Background token refresh failed: {str(e)}")
+                time.sleep(min(2 ** failures, 60))
@@ -0,0 +1,236 @@
+"""Shared HTTP client for every call the app makes to the partner API.
+
+One keep-alive connection pool per worker process, default connect/read
+timeouts on every call, and counters for how the pool is being used. Every
+call goes through the shared UpstreamPolicy (retries, circuit breaker, rate
+limit) and is counted and timed per endpoint in metrics.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+from resilience import CircuitOpenError, UpstreamPolicy
+
+# Sized per worker: should cover the org fan-out plus concurrent requests
+UPSTREAM_POOL_SIZE = int(os.environ.get("UPSTREAM_POOL_SIZE", "16"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "30"))
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_created = 0
+            self.checkouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_created(self):
+        with self._lock:
+            self.connections_created += 1
+
+    def record_checkout(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connections_created": self.connections_created,
+                "connections_reused": max(self.checkouts - self.connections_created, 0),
+                "checkouts": self.checkouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0
+            }
+
+
+class _CountingPoolMixin:
+    pool_stats = None
+
+    def _new_conn(self):
+        self.pool_stats.record_created()
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        # With block=True this is where a request queues for a free connection
+        started = time.perf_counter()
+        conn = super()._get_conn(timeout)
+        self.pool_stats.record_checkout(time.perf_counter() - started)
+        return conn
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    def __init__(self, pool_stats, **kwargs):
+        self.pool_stats = pool_stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {"pool_stats": self.pool_stats}
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("CountingHTTPConnectionPool", (_CountingPoolMixin, HTTPConnectionPool), attrs),
+            "https": type("CountingHTTPSConnectionPool", (_CountingPoolMixin, HTTPSConnectionPool), attrs)
+        }
+
+
+def request_not_sent(error):
+    # True for a RequestException raised before the request reached the
+    # server: a connect failure, or an open circuit failing fast
+    if isinstance(error, (requests.exceptions.ConnectTimeout, CircuitOpenError)):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+
+class UpstreamClient:
+    """Pooled session for the partner API.
+
+    Paths are resolved against base_url; absolute URLs (e.g. the token
+    endpoint) are used as-is. Every call gets the default timeouts unless the
+    caller passes its own.
+    """
+
+    def __init__(self, base_url, pool_size=None, connect_timeout=None, read_timeout=None, policy=None,
+                 account="default"):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size or UPSTREAM_POOL_SIZE
+        self.timeout = (connect_timeout or UPSTREAM_CONNECT_TIMEOUT, read_timeout or UPSTREAM_READ_TIMEOUT)
+        # The partner account this client calls for, as labelled in metrics
+        self.account = account
+        self.policy = policy or UpstreamPolicy(account=account)
+        self.pool_stats = PoolStats()
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Built lazily and rebuilt after a fork so gunicorn workers never
+        # share sockets inherited from the master process
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    self._session = self._build_session()
+                    self._session_pid = pid
+        return self._session
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = CountingHTTPAdapter(
+            self.pool_stats,
+            pool_connections=4,
+            pool_maxsize=self.pool_size,
+            pool_block=True
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def url_for(self, path):
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        endpoint = metrics.endpoint_template(path)
+        attempt = 0
+        while True:
+            wait = self.policy.before_attempt(endpoint)
+            if wait > 0:
+                time.sleep(wait)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url_for(path), **kwargs)
+            except requests.exceptions.RequestException as e:
+                metrics.UPSTREAM_REQUESTS.inc(endpoint, method, type(e).__name__, self.account)
+                delay = self.policy.after_attempt(endpoint, method, attempt, error=e,
+                                                  safe_to_resend=request_not_sent(e))
+                if delay is None:
+                    raise
+            else:
+                metrics.UPSTREAM_REQUESTS.inc(endpoint, method, str(response.status_code), self.account)
+                delay = self.policy.after_attempt(endpoint, method, attempt, status=response.status_code,
+                                                  retry_after=response.headers.get("Retry-After"))
+                if delay is None:
+                    return response
+                response.close()
+            finally:
+                metrics.UPSTREAM_REQUEST_DURATION.observe(time.perf_counter() - started, endpoint, method, self.account)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+    def stats(self):
+        stats = self.pool_stats.snapshot()
+        stats["pool_size"] = self.pool_size
+        stats["connect_timeout"], stats["read_timeout"] = self.timeout
+        stats.update(self.policy.stats())
+        return stats
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+def iter_pages(client, path, items_key, page_size=100, prefetch=True, **kwargs):
+    """Yield successive pages of an offset/limit listing endpoint.
+
+    With prefetch, the next page is requested while the caller is still
+    working on the current one. Stops after the first short page, or without
+    yielding anything if the upstream answers with an empty body. Only one
+    page (plus the one in flight) is held at a time.
+    """
+    def fetch(offset):
+        response = client.get(path, params={"offset": offset, "limit": page_size}, **kwargs)
+        response.raise_for_status()
+        if not response.content:
+            return None
+        return response.json().get(items_key, [])
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-prefetch") if prefetch else None
+    try:
+        offset = 0
+        pending = executor.submit(fetch, offset) if executor else None
+        while True:
+            items = pending.result() if executor else fetch(offset)
+            if items is None:
+                return
+            offset += len(items)
+            more = len(items) >= page_size
+            if more and executor:
+                pending = executor.submit(fetch, offset)
+            yield items
+            if not more:
+                return
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,29 @@
+"""Small helpers shared by the feature modules, with no app state of their own."""
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def digest(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(encoded, digest_size=12).hexdigest()
+
+
+def run_bounded(fn, items, max_workers):
+    # Yields fn(item) in completion order with at most 2 * max_workers items
+    # queued, so a large input is never submitted all at once
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        for item in items:
+            pending.add(executor.submit(fn, item))
+            if len(pending) >= max_workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)